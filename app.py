@@ -9,7 +9,7 @@ import html
 from io import BytesIO
 from PIL import Image
 from utils.ui_components import render_voice_command_ui, render_floating_voice_button
-from utils.themes import apply_theme, THEMES
+from utils.themes import get_app_stylesheet, THEMES
 # Emoji picker removed to fix chat functionality
 from utils.models import (
     get_gemini_response,
@@ -22,50 +22,22 @@ from utils.models import (
 from utils.google_auth import check_login, logout_user, get_current_user, is_admin
 from utils.database import init_db, save_conversation, load_conversations, get_most_recent_chat
 # Enhanced audio recording with WebRTC
-from utils.webrtc_audio import audio_recorder_ui
+from utils.webrtc_audio import SPEECH_SAMPLE_RATE, audio_recorder_ui
+from utils.asr import is_available as asr_available
 # Text-to-speech with ElevenLabs
 from utils.tts import render_tts_controls, render_play_button, text_to_speech
-
-# Add CSS for toggle buttons
-def add_toggle_button_css():
-    st.markdown("""
-    <style>
-    .toggle-button {
-        position: relative;
-        width: 40px;
-        height: 20px;
-        background-color: #333;
-        border-radius: 10px;
-        cursor: pointer;
-    }
-    
-    .toggle-button:before {
-        content: '';
-        position: absolute;
-        width: 18px;
-        height: 18px;
-        border-radius: 50%;
-        top: 1px;
-        left: 1px;
-        background-color: #555;
-        transition: 0.2s;
-    }
-    
-    .toggle-button.active {
-        background-color: #4285f4;
-    }
-    
-    .toggle-button.active:before {
-        transform: translateX(20px);
-        background-color: white;
-    }
-    
-    /* Make buttons look like actual buttons */
-    button {
-        cursor: pointer;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+# Document ingestion for PDF/DOCX/text uploads
+from utils.documents import ingest_document, build_document_prompt
+# Local retrieval over past chats and uploaded documents
+from utils.retrieval import index_document, index_messages_async, retrieve_context, format_context
+from utils.embeddings import embedding_model_ready, get_embedding_model_name, warm_up_embeddings
+# Rolling conversation summaries for long chats
+from utils.memory import build_memory_history, get_summary, schedule_summary_update
+from utils.tts_prefetch import cancel_prefetch, prefetch_reply, track_chat
+from utils.voice_events import (
+    VOICE_POLL_INTERVAL, drain_voice_commands, subscribe_voice_commands,
+    unsubscribe_voice_commands, voice_commands_pending
+)
 
 # Set page configuration
 st.set_page_config(
@@ -94,8 +66,6 @@ if "uploaded_image" not in st.session_state:
 # Voice command state variables
 if "voice_commands_active" not in st.session_state:
     st.session_state.voice_commands_active = False
-if "voice_processor" not in st.session_state:
-    st.session_state.voice_processor = None
 if "is_listening" not in st.session_state:
     st.session_state.is_listening = False
     
@@ -107,9 +77,8 @@ if "current_theme" not in st.session_state:
 if "message_cooldown" not in st.session_state:
     st.session_state.message_cooldown = False
 
-# Apply the current theme's CSS
-theme_css = apply_theme(st.session_state.current_theme)
-st.markdown(theme_css, unsafe_allow_html=True)
+# Apply the current theme together with the static app styles (prebuilt once per theme)
+st.markdown(get_app_stylesheet(st.session_state.current_theme), unsafe_allow_html=True)
 
 # Check user login
 check_login()
@@ -125,91 +94,115 @@ def encode_image(uploaded_file):
         return encoded
     return None
 
+# Build the message history sent to a model for the latest turn
+def build_model_history(messages, prompt):
+    """Copy the chat history, replacing the latest user message with the model prompt"""
+    history = list(messages)
+    if history and history[-1]["role"] == "user" and history[-1]["content"] != prompt:
+        history[-1] = {**history[-1], "content": prompt}
+    return history
+
+# Model names selected by voice commands
+VOICE_MODEL_SELECTIONS = {
+    "select_model_gemini": "Gemini",
+    "select_model_claude": "Anthropic (claude-3-5-sonnet-20241022)",
+    "select_model_gpt": "OpenAI (gpt-4o)",
+}
+
+# Apply voice commands recognized by the shared listener for this session
+def apply_voice_commands():
+    """Apply queued voice commands to this session's state (call before widgets are created)"""
+    for event in drain_voice_commands():
+        if event.action == "new_chat":
+            cancel_prefetch(st.session_state.get("chat_id"))
+            st.session_state.messages = []
+        elif event.action in VOICE_MODEL_SELECTIONS:
+            st.session_state.current_model = VOICE_MODEL_SELECTIONS[event.action]
+        elif event.action in ("increase_temperature", "decrease_temperature"):
+            step = 0.1 if event.action == "increase_temperature" else -0.1
+            st.session_state.temperature = round(min(1.0, max(0.0, st.session_state.temperature + step)), 2)
+            # Keep the sidebar slider from resetting it
+            st.session_state.temperature_sidebar = st.session_state.temperature
+        elif event.action == "dictate" and event.argument:
+            # Create a new user message
+            st.session_state.messages.append({"role": "user", "content": event.argument})
+        elif event.action == "stop_voice_commands":
+            unsubscribe_voice_commands()
+            st.session_state.voice_commands_active = False
+            st.session_state.is_listening = False
+
+# Rerun the app when voice commands arrive for this session
+@st.fragment(run_every=VOICE_POLL_INTERVAL)
+def poll_voice_commands():
+    """Check the voice command queue on a timer without rerunning the whole app"""
+    if voice_commands_pending():
+        st.rerun()
+
+# How often a background microphone recording refreshes its progress (seconds)
+MIC_POLL_INTERVAL = 0.5
+
+# Show a background microphone recording's progress until it ends or is stopped
+@st.fragment(run_every=MIC_POLL_INTERVAL)
+def poll_microphone_recording():
+    """Progress and Stop button for the recording in progress; reruns the app when it ends"""
+    handle = st.session_state.get("mic_capture")
+    if handle is None:
+        return
+    if not handle.wait(0):
+        st.progress(min(handle.duration / handle.length, 1.0), text=f"Recording... {handle.duration:.1f}s")
+        if not st.button("Stop Recording", key="stop_mic_recording", use_container_width=True):
+            return
+        handle.cancel()
+    st.rerun()
+
+# Server-side microphone recording (used when WebRTC is unavailable)
+def render_microphone_recorder():
+    """Fixed-length recording that runs in the background and can be stopped early"""
+    from utils.audio import finish_recording, start_recording
+    
+    handle = st.session_state.get("mic_capture")
+    if handle is not None and handle.wait(0):
+        st.session_state.mic_capture = None
+        _, temp_file_path = finish_recording(handle)
+        st.session_state.audio_path = temp_file_path
+        st.success("Audio recorded successfully!")
+        st.audio(temp_file_path)
+    elif handle is not None:
+        poll_microphone_recording()
+        return
+    
+    st.write("Choose recording duration:")
+    b1, b2 = st.columns(2)
+    for column, seconds in ((b1, 5), (b2, 10)):
+        if column.button(f"Record Audio ({seconds} seconds)", use_container_width=True):
+            try:
+                st.session_state.mic_capture = start_recording(duration=seconds)
+            except Exception as e:
+                error_message = str(e)
+                if "microphone is not accessible" in error_message or "Invalid input device" in error_message:
+                    st.error("Microphone not available in this environment.")
+                    st.info("You can upload an audio file instead or use text input.")
+                    st.session_state.audio_recording_unavailable = True
+                else:
+                    st.error(f"Failed to record audio: {error_message}")
+                return
+            st.rerun()
+
 # Main function
 def main():
     # Initialize database
     init_db()
     
-    # Add CSS for toggle buttons and UI elements
-    add_toggle_button_css()
-    
-    # Apply custom styling to match Google Gemini UI exactly
-    st.markdown("""
-    <style>
-    /* Dark background for the app */
-    .stApp {
-        background-color: #0e1117;
-    }
+    # Start loading the local embedding model before the first retrieval needs it
+    warm_up_embeddings()
     
-    /* Left sidebar styling */
-    [data-testid="stSidebar"] {
-        background-color: #0e1117;
-        border-right: 1px solid #333;
-    }
+    # Drop background speech jobs queued for a chat the user has left
+    track_chat(st.session_state.get("chat_id"))
     
-    /* Hide default Streamlit hamburger menu */
-    section[data-testid="stSidebarUserContent"] {
-        padding-top: 0rem;
-    }
-    
-    /* Make the main content full width */
-    .main .block-container {
-        max-width: 100%;
-        padding-top: 1rem;
-        padding-left: 1rem;
-        padding-right: 1rem;
-    }
-    
-    /* Right sidebar styling */
-    .right-sidebar {
-        position: fixed;
-        right: 0;
-        top: 0;
-        width: 250px;
-        height: 100vh;
-        padding: 1rem;
-        background-color: #0e1117;
-        border-left: 1px solid #333;
-        overflow-y: auto;
-        z-index: 10;
-    }
-    
-    /* Main content area with space for the right sidebar */
-    .main-content {
-        margin-right: 250px;
-    }
-    
-    /* Toggle button styling */
-    .toggle-container {
-        margin-top: 5px;
-    }
-    .toggle-button {
-        background-color: #333;
-        border-radius: 15px;
-        display: inline-block;
-        height: 20px;
-        position: relative;
-        width: 40px;
-    }
-    .toggle-button.active {
-        background-color: #4285f4;
-    }
-    .toggle-button::after {
-        background-color: white;
-        border-radius: 50%;
-        content: '';
-        height: 16px;
-        left: 2px;
-        position: absolute;
-        top: 2px;
-        transition: all 0.3s;
-        width: 16px;
-    }
-    .toggle-button.active::after {
-        left: 22px;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+    # Apply voice commands before any widget reads the state they change
+    apply_voice_commands()
+    if st.session_state.voice_commands_active:
+        poll_voice_commands()
     
     # Left sidebar matching the Google Gemini interface
     with st.sidebar:
@@ -373,29 +366,6 @@ def main():
         </div>
         """, unsafe_allow_html=True)
         
-        # Add custom CSS for improved message container
-        st.markdown("""
-        <style>
-        .chat-container {
-            height: 600px !important;
-            overflow-y: auto;
-            padding-right: 15px;
-            margin-bottom: 20px;
-            border-radius: 10px;
-            background-color: rgba(40, 40, 40, 0.2);
-        }
-        .stChatInputContainer {
-            min-height: 80px !important;
-            padding: 10px !important;
-            margin-top: 15px !important;
-        }
-        .stChatInput {
-            min-height: 60px !important;
-            font-size: 16px !important;
-        }
-        </style>
-        """, unsafe_allow_html=True)
-        
         # Create a taller fixed-height container for chat messages with Google AI Studio style
         chat_container = st.container(height=600, border=False)
         st.markdown('<div class="chat-container">', unsafe_allow_html=True)
@@ -494,39 +464,6 @@ def main():
         chat_input_container = st.container()
         with chat_input_container:
             st.markdown("""
-            <style>
-            /* Style for the chat input container with icons */
-            .chat-input-with-icons {
-                position: relative;
-                width: 100%;
-                margin-top: 20px;
-            }
-            
-            /* Icon container at the right side of the input */
-            .chat-icons {
-                position: absolute;
-                right: 15px;
-                top: 50%;
-                transform: translateY(-50%);
-                display: flex;
-                gap: 12px;
-                z-index: 100;
-            }
-            
-            /* Individual icon styling */
-            .chat-icon {
-                opacity: 0.6;
-                cursor: pointer;
-                transition: opacity 0.2s;
-                width: 20px;
-                height: 20px;
-            }
-            
-            .chat-icon:hover {
-                opacity: 1;
-            }
-            </style>
-            
             <div class="chat-input-with-icons">
                 <div class="chat-icons">
                     <svg class="chat-icon" xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="#888">
@@ -555,29 +492,71 @@ def main():
                 # Set cooldown to prevent double sending
                 st.session_state.message_cooldown = True
                     
-                # If document was uploaded and button clicked, use document text as message
-                if hasattr(st.session_state, 'document_text'):
-                    user_input = st.session_state.document_text
-                    # Clear it after use
-                    delattr(st.session_state, 'document_text')
-                
                 # Create message object
                 user_message = {"role": "user", "content": user_input}
                 
+                # The first retrieval in this process may still be waiting for the embedding model
+                if not embedding_model_ready():
+                    with st.spinner("Loading the embedding model..."):
+                        get_embedding_model_name()
+                
+                # Ground the question in the active document (relevant chunks only for large files)
+                username = get_current_user() or "anonymous"
+                model_prompt = user_input
+                active_document = st.session_state.get("active_document")
+                if active_document:
+                    user_message["document"] = active_document["name"]
+                    relevant_chunks = [
+                        {"index": hit["metadata"]["index"], "page": hit["metadata"]["page"], "text": hit["text"]}
+                        for hit in retrieve_context(
+                            username, user_input, k=8,
+                            where={"source": "document", "document": active_document["name"]}
+                        )
+                    ]
+                    model_prompt = build_document_prompt(active_document, user_input, relevant_chunks=relevant_chunks)
+                
+                # Add relevant snippets from the user's other conversations
+                past_context = format_context(retrieve_context(
+                    username, user_input, k=3,
+                    where={"source": "chat"},
+                    exclude={"chat_id": str(st.session_state.chat_id)}
+                ))
+                if past_context:
+                    model_prompt = f"Relevant context from earlier conversations:\n{past_context}\n\n{model_prompt}"
+                
                 # Add image to message if one is uploaded
                 if st.session_state.uploaded_image:
                     user_message["image"] = st.session_state.uploaded_image
                     
-                # Add audio to message if recorded
-                if hasattr(st.session_state, 'audio_data') and st.session_state.audio_data:
-                    user_message["audio"] = st.session_state.audio_data
-                    # Clear audio data after use
-                    st.session_state.audio_data = None
+                # Attach recorded audio to the message by path
+                if st.session_state.get("audio_path"):
+                    # Models other than Gemini do not take audio, so give them the transcript
+                    transcript = st.session_state.get("audio_transcript")
+                    if transcript and "gemini" not in st.session_state.current_model.lower():
+                        model_prompt = f"Transcript of the attached audio:\n{transcript}\n\n{model_prompt}"
+                    st.session_state.audio_transcript = None
+                    
+                    try:
+                        from utils.audio import store_audio_clip
+                        user_message["audio_path"] = store_audio_clip(st.session_state.audio_path)
+                    except Exception as e:
+                        print(f"Could not store audio clip: {e}")
+                        user_message["audio_path"] = st.session_state.audio_path
+                    # Clear audio after use
                     st.session_state.audio_path = None
                 
                 # Add user message to chat
                 st.session_state.messages.append(user_message)
                 
+                # History sent to the model, with the prompt in place of the displayed message
+                model_history = build_model_history(st.session_state.messages, model_prompt)
+                
+                # Long chats send the rolling summary plus recent turns instead of the whole transcript
+                model_history = build_memory_history(
+                    model_history,
+                    get_summary(username, st.session_state.chat_id, st.session_state.db_type)
+                )
+                
                 # Get AI response based on selected model
                 with st.spinner(f"Thinking... using {st.session_state.current_model}"):
                     try:
@@ -595,11 +574,11 @@ def main():
                             gemini_version = model_call_sign if model_call_sign else "gemini-1.5-pro"
                             
                             # Get audio data if available
-                            audio_data = user_message.get("audio")
+                            audio_data = user_message.get("audio_path") or user_message.get("audio")
                             
                             ai_response = get_gemini_response(
-                                user_input, 
-                                st.session_state.messages,
+                                model_prompt, 
+                                model_history,
                                 image_data=image_data,
                                 audio_data=audio_data,
                                 temperature=st.session_state.temperature,
@@ -612,8 +591,8 @@ def main():
                                 # Use the extracted call sign or default to Claude 3.5
                                 claude_model = model_call_sign if model_call_sign else "claude-3-5-sonnet-20241022"
                                 ai_response = get_vertex_ai_response(
-                                    user_input, 
-                                    st.session_state.messages,
+                                    model_prompt, 
+                                    model_history,
                                     model_name=claude_model,
                                     image_data=image_data,
                                     temperature=st.session_state.temperature
@@ -621,8 +600,8 @@ def main():
                             else:
                                 # Default Vertex AI model
                                 ai_response = get_vertex_ai_response(
-                                    user_input, 
-                                    st.session_state.messages,
+                                    model_prompt, 
+                                    model_history,
                                     image_data=image_data,
                                     temperature=st.session_state.temperature
                                 )
@@ -633,8 +612,8 @@ def main():
                             gpt_version = model_call_sign if model_call_sign else "gpt-4o"
                             
                             ai_response = get_openai_response(
-                                user_input, 
-                                st.session_state.messages,
+                                model_prompt, 
+                                model_history,
                                 model_name=gpt_version,
                                 image_data=image_data,
                                 temperature=st.session_state.temperature
@@ -646,8 +625,8 @@ def main():
                             claude_version = model_call_sign if model_call_sign else "claude-3-5-sonnet-20241022"
                             
                             ai_response = get_anthropic_response(
-                                user_input, 
-                                st.session_state.messages,
+                                model_prompt, 
+                                model_history,
                                 model_name=claude_version,
                                 image_data=image_data,
                                 temperature=st.session_state.temperature
@@ -659,8 +638,8 @@ def main():
                             pplx_version = model_call_sign if model_call_sign else "mistral-8x7b-instruct"
                             
                             ai_response = get_perplexity_response(
-                                user_input, 
-                                st.session_state.messages,
+                                model_prompt, 
+                                model_history,
                                 model_name=pplx_version,
                                 temperature=st.session_state.temperature
                             )
@@ -668,8 +647,8 @@ def main():
                         # Default to Gemini if model not recognized
                         else:
                             ai_response = get_gemini_response(
-                                user_input, 
-                                st.session_state.messages, 
+                                model_prompt, 
+                                model_history, 
                                 image_data=image_data,
                                 temperature=st.session_state.temperature
                             )
@@ -684,6 +663,24 @@ def main():
                             messages=st.session_state.messages
                         )
                         
+                        # Add the new turn to the user's retrieval index in the background
+                        index_messages_async(
+                            get_current_user() or "anonymous",
+                            st.session_state.chat_id,
+                            st.session_state.messages
+                        )
+                        
+                        # Fold older turns into the conversation summary in the background
+                        schedule_summary_update(
+                            get_current_user() or "anonymous",
+                            st.session_state.chat_id,
+                            st.session_state.messages,
+                            st.session_state.db_type
+                        )
+                        
+                        # Synthesize the reply's audio ahead of time if enabled
+                        prefetch_reply(ai_response, st.session_state.chat_id, len(st.session_state.messages) - 1)
+                        
                         # Clear image after use
                         st.session_state.uploaded_image = None
                         
@@ -699,29 +696,6 @@ def main():
     with right_sidebar:
         # More compact sidebar with model, tokens, and temperature sections combined
         st.markdown("""
-        <style>
-        /* Make the right sidebar more compact */
-        .compact-sidebar-section {
-            margin-bottom: 10px;
-            padding-bottom: 10px;
-            border-bottom: 1px solid #333;
-        }
-        .compact-sidebar-title {
-            display: flex;
-            align-items: center;
-            margin-bottom: 8px;
-        }
-        .compact-sidebar-icon {
-            margin-right: 8px;
-        }
-        .compact-sidebar-content {
-            background-color: #1e1e1e;
-            border-radius: 8px;
-            padding: 10px;
-            margin-bottom: 10px;
-        }
-        </style>
-        
         <div class="compact-sidebar-section">
             <div class="compact-sidebar-title">
                 <svg xmlns="http://www.w3.org/2000/svg" width="18" height="18" fill="#888" viewBox="0 0 24 24">
@@ -789,23 +763,6 @@ def main():
             if f"tool_{tool}" not in st.session_state:
                 st.session_state[f"tool_{tool}"] = False
         
-        # Create compact tools layout with columns
-        st.markdown("""
-        <style>
-        .tool-toggle {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 5px;
-            padding: 2px 0;
-        }
-        .tool-toggle span {
-            color: white;
-            font-size: 13px;
-        }
-        </style>
-        """, unsafe_allow_html=True)
-        
         # Create a 2-column layout for toggles to save vertical space
         col1, col2 = st.columns(2)
         
@@ -897,8 +854,7 @@ def main():
         
         # Audio recording tab - Enhanced with WebRTC
         with input_tabs[1]:
-            if "audio_data" not in st.session_state:
-                st.session_state.audio_data = None
+            if "audio_path" not in st.session_state:
                 st.session_state.audio_path = None
                 st.session_state.audio_recording_unavailable = False
             
@@ -908,20 +864,24 @@ def main():
             # Try using WebRTC recorder first
             try:
                 # Use the enhanced WebRTC audio recorder
-                base64_audio = audio_recorder_ui(
+                recorded_path = audio_recorder_ui(
                     key="webrtc_recorder",
                     title="Audio Recording",
                     description="Click start button to begin recording. Click stop when you're done.",
                     durations=[15, 30, 60, 120],
                     show_description=True,
-                    show_playback=True
+                    show_playback=True,
+                    target_rate=SPEECH_SAMPLE_RATE,
+                    mono=True,
+                    live_transcript=asr_available()
                 )
                 
                 # If audio was recorded, store it in session state
-                if base64_audio:
-                    st.session_state.audio_data = base64_audio
-                    # Path is already stored by the recorder in session state
-                    st.session_state.audio_path = st.session_state.get("webrtc_recorder_file_path")
+                if recorded_path:
+                    if st.session_state.audio_path != recorded_path:
+                        # Transcribed while recording, so models without audio input can use it too
+                        st.session_state.audio_transcript = st.session_state.get("webrtc_recorder_transcript")
+                    st.session_state.audio_path = recorded_path
                     
                     # Show success message
                     st.success("Audio recorded successfully!")
@@ -931,48 +891,10 @@ def main():
                 # Fallback to legacy recording if WebRTC fails
                 st.error(f"Enhanced audio recording unavailable: {str(e)}")
                 st.info("Falling back to basic audio recording...")
-                st.session_state.audio_recording_unavailable = True
                 
-                # Display legacy recording interface
-                if not st.session_state.audio_recording_unavailable:
-                    st.write("Choose recording duration:")
-                    b1, b2 = st.columns(2)
-                    
-                    # Record 5-second audio
-                    if b1.button("Record Audio (5 seconds)", use_container_width=True):
-                        try:
-                            from utils.audio import record_audio, encode_audio, cleanup_audio_file
-                            audio_bytes, temp_file_path = record_audio(duration=5)
-                            st.session_state.audio_data = encode_audio(audio_bytes)
-                            st.session_state.audio_path = temp_file_path
-                            st.success("Audio recorded successfully!")
-                            st.audio(temp_file_path)
-                        except Exception as e:
-                            error_message = str(e)
-                            if "microphone is not accessible" in error_message or "Invalid input device" in error_message:
-                                st.error("Microphone not available in this environment.")
-                                st.info("You can upload an audio file instead or use text input.")
-                                st.session_state.audio_recording_unavailable = True
-                            else:
-                                st.error(f"Failed to record audio: {error_message}")
-                    
-                    # Record 10-second audio
-                    if b2.button("Record Audio (10 seconds)", use_container_width=True):
-                        try:
-                            from utils.audio import record_audio, encode_audio, cleanup_audio_file
-                            audio_bytes, temp_file_path = record_audio(duration=10)
-                            st.session_state.audio_data = encode_audio(audio_bytes)
-                            st.session_state.audio_path = temp_file_path
-                            st.success("Audio recorded successfully!")
-                            st.audio(temp_file_path)
-                        except Exception as e:
-                            error_message = str(e)
-                            if "microphone is not accessible" in error_message or "Invalid input device" in error_message:
-                                st.error("Microphone not available in this environment.")
-                                st.info("You can upload an audio file instead or use text input.")
-                                st.session_state.audio_recording_unavailable = True
-                            else:
-                                st.error(f"Failed to record audio: {error_message}")
+                # Display legacy recording interface (unless the microphone itself failed)
+                if not st.session_state.get("audio_recording_unavailable", False):
+                    render_microphone_recorder()
                 else:
                     # Show alternative options when recording is unavailable
                     st.warning("Audio recording is not available in this environment.")
@@ -986,56 +908,92 @@ def main():
             st.markdown("Alternatively, upload a pre-recorded audio file")
             
             uploaded_audio = st.file_uploader("Upload audio file", type=["wav", "mp3", "ogg"], key="audio_upload")
-            if uploaded_audio:
+            upload_id = getattr(uploaded_audio, "file_id", None) or (uploaded_audio and f"{uploaded_audio.name}:{uploaded_audio.size}")
+            if uploaded_audio and st.session_state.get("audio_upload_id") != upload_id:
                 try:
-                    # Read the file and encode it
-                    audio_bytes = uploaded_audio.getvalue()
-                    
-                    # Create temporary file
+                    # Write each new upload to a temporary file once; only its path is kept
                     temp_file = tempfile.NamedTemporaryFile(suffix="." + uploaded_audio.name.split(".")[-1], delete=False)
                     temp_file_path = temp_file.name
-                    temp_file.write(audio_bytes)
+                    temp_file.write(uploaded_audio.getbuffer())
                     temp_file.close()
                     
                     # Save to session state
-                    from utils.audio import encode_audio
-                    st.session_state.audio_data = encode_audio(audio_bytes)
                     st.session_state.audio_path = temp_file_path
+                    st.session_state.audio_upload_id = upload_id
+                    st.session_state.audio_transcript = None
                     
                     # Show success and preview
                     st.success("Audio file uploaded successfully!")
                     st.audio(temp_file_path)
+                    
+                    # Transcribe locally so models without audio input can use it too
+                    from utils.transcription import is_available as transcription_available, transcribe_audio, format_transcript
+                    if transcription_available():
+                        with st.spinner("Transcribing audio..."):
+                            try:
+                                st.session_state.audio_transcript = format_transcript(transcribe_audio(temp_file_path))
+                            except Exception as e:
+                                st.warning(f"Could not transcribe audio: {str(e)}")
                 except Exception as e:
                     st.error(f"Failed to process audio file: {str(e)}")
             
+            if st.session_state.get("audio_transcript") and st.session_state.audio_path:
+                with st.expander("Transcript"):
+                    st.text(st.session_state.audio_transcript)
+            
             # Button to clear recorded/uploaded audio
-            if st.session_state.audio_data and st.button("Clear Audio"):
+            if st.session_state.audio_path and st.button("Clear Audio"):
                 if st.session_state.audio_path:
                     try:
                         from utils.audio import cleanup_audio_file
                         cleanup_audio_file(st.session_state.audio_path)
                     except:
                         pass
-                st.session_state.audio_data = None
                 st.session_state.audio_path = None
+                st.session_state.audio_transcript = None
                 st.rerun()
                 
         # File upload tab
         with input_tabs[2]:
-            uploaded_doc = st.file_uploader("Upload a document", type=["txt", "pdf", "doc", "docx"], 
+            uploaded_doc = st.file_uploader("Upload a document", type=["txt", "md", "pdf", "docx"], 
                                           help="Upload a document for the AI to analyze")
             if uploaded_doc:
-                # Read file content
-                if uploaded_doc.type == "text/plain":
-                    # Handle text files
-                    text_content = uploaded_doc.getvalue().decode("utf-8")
-                    st.text_area("Document Content", text_content, height=200)
+                # Extract and chunk each upload once; reruns reuse the result
+                if "ingested_documents" not in st.session_state:
+                    st.session_state.ingested_documents = {}
+                doc_key = f"{uploaded_doc.name}:{uploaded_doc.size}"
+                
+                if doc_key not in st.session_state.ingested_documents:
+                    progress_text = st.empty()
+                    try:
+                        document = ingest_document(
+                            uploaded_doc.name,
+                            uploaded_doc.getvalue(),
+                            progress_callback=lambda page: progress_text.caption(f"Extracted {page} page(s)...")
+                        )
+                        st.session_state.ingested_documents[doc_key] = document
+                    except Exception as e:
+                        st.error(f"Failed to process document: {str(e)}")
+                    progress_text.empty()
+                
+                document = st.session_state.ingested_documents.get(doc_key)
+                if document:
+                    st.caption(f"{document['pages']} page(s), {len(document['chunks'])} chunk(s), {document['char_count']:,} characters")
+                    if document["chunks"]:
+                        st.text_area("Document Preview", document["chunks"][0]["text"], height=200)
                     if st.button("Send Document to AI"):
-                        # Add document content to user message
-                        st.session_state.document_text = f"I'm sharing this document with you: \n\n{text_content}\n\nPlease analyze this content."
-                else:
-                    # For other file types, just show the filename
-                    st.info(f"File '{uploaded_doc.name}' uploaded. Send a message to the AI to analyze it.")
+                        # Later messages are answered from the relevant parts of this document
+                        with st.spinner("Indexing document..."):
+                            index_document(get_current_user() or "anonymous", document)
+                        st.session_state.active_document = document
+                        st.success(f"'{document['name']}' will be used to answer your next messages.")
+            
+            active_document = st.session_state.get("active_document")
+            if active_document:
+                st.info(f"Using document: {active_document['name']}")
+                if st.button("Stop using document"):
+                    st.session_state.active_document = None
+                    st.rerun()
         
         # We already have a chat input in the main area with ghosted icons
     
@@ -1081,50 +1039,17 @@ def main():
             def toggle_voice_commands(enable):
                 """Toggle voice commands on/off"""
                 if enable:
-                    if not st.session_state.voice_processor:
-                        try:
-                            # Import voice command processor
-                            from utils.voice_commands import VoiceCommandProcessor
-                            
-                            # Initialize processor with command callbacks
-                            processor = VoiceCommandProcessor()
-                            
-                            # Register command callbacks
-                            processor.register_callback("new_chat", lambda: st.session_state.update(messages=[]))
-                            processor.register_callback("select_model_gemini", lambda: st.session_state.update(current_model="Gemini"))
-                            processor.register_callback("select_model_claude", lambda: st.session_state.update(current_model="Anthropic (claude-3-5-sonnet-20241022)"))
-                            processor.register_callback("select_model_gpt", lambda: st.session_state.update(current_model="OpenAI (gpt-4o)"))
-                            processor.register_callback("increase_temperature", lambda: st.session_state.update(temperature=min(1.0, st.session_state.temperature + 0.1)))
-                            processor.register_callback("decrease_temperature", lambda: st.session_state.update(temperature=max(0.0, st.session_state.temperature - 0.1)))
-                            
-                            # Add send message command
-                            def send_dictated_message(text=None):
-                                if text:
-                                    # Create a new user message
-                                    st.session_state.messages.append({"role": "user", "content": text})
-                                    st.rerun()
-                            
-                            processor.register_callback("send_message", send_dictated_message)
-                            
-                            # Save the processor to session state
-                            st.session_state.voice_processor = processor
-                            
-                            # Start listening
-                            processor.start_listening()
-                            st.session_state.is_listening = True
-                        except Exception as e:
-                            st.error(f"Failed to initialize voice commands: {str(e)}")
-                            st.session_state.voice_commands_active = False
-                            return
-                    else:
-                        # Restart the existing processor
-                        st.session_state.voice_processor.start_listening()
+                    try:
+                        # Receive commands from the shared listener
+                        subscribe_voice_commands()
                         st.session_state.is_listening = True
+                    except Exception as e:
+                        st.error(f"Failed to initialize voice commands: {str(e)}")
+                        st.session_state.voice_commands_active = False
+                        return
                 else:
-                    # Stop listening if processor exists
-                    if st.session_state.voice_processor:
-                        st.session_state.voice_processor.stop_listening()
-                        st.session_state.is_listening = False
+                    unsubscribe_voice_commands()
+                    st.session_state.is_listening = False
                 
                 # Update the active state
                 st.session_state.voice_commands_active = enable
@@ -1232,6 +1157,9 @@ def main():
                 # Update session state with new model
                 st.session_state.current_model = selected_model
                 
+                # Drop speech queued for the chat being replaced
+                cancel_prefetch(st.session_state.chat_id)
+                
                 # Update chat_id in session state
                 st.session_state.chat_id = chat_id
                 
@@ -1291,6 +1219,7 @@ def main():
             
             if st.button("New Chat", use_container_width=True):
                 # Clear messages but keep other settings
+                cancel_prefetch(st.session_state.chat_id)
                 st.session_state.messages = []
                 st.session_state.chat_id = None
                 # Visual confirmation
@@ -1334,10 +1263,10 @@ def main():
             
             # Logout button
             if st.button("Logout", use_container_width=True):
-                # Clean up voice processor before logout
-                if st.session_state.voice_processor:
-                    st.session_state.voice_processor.stop_listening()
-                    st.session_state.voice_processor = None
+                # Stop receiving voice commands before logout
+                if st.session_state.voice_commands_active:
+                    unsubscribe_voice_commands()
+                    st.session_state.voice_commands_active = False
                     st.session_state.is_listening = False
                 logout_user()
                 st.rerun()
@@ -1424,28 +1353,5 @@ def main():
             st.markdown("AI Chat Studio | 2024")
 
 # Run the app
-# Clean up function for voice commands when the app exits
-def cleanup_on_exit():
-    """Clean up resources when the app exits"""
-    # Stop voice processor if running
-    if hasattr(st.session_state, 'voice_processor') and st.session_state.voice_processor:
-        try:
-            st.session_state.voice_processor.stop_listening()
-            print("Stopped voice command processor")
-        except:
-            pass
-    
-    # Clean up any temporary audio files
-    if hasattr(st.session_state, 'audio_path') and st.session_state.audio_path:
-        try:
-            from utils.audio import cleanup_audio_file
-            cleanup_audio_file(st.session_state.audio_path)
-        except:
-            pass
-
 if __name__ == "__main__":
-    try:
-        main()
-    finally:
-        # Execute cleanup when the app exits
-        cleanup_on_exit()
+    main()
@@ -36,11 +36,18 @@ from utils.database import (
     get_most_recent_chat
 )
 
+# Rolling conversation summaries
+from utils.memory import build_memory_history, get_summary, schedule_summary_update
+
 # Auth utilities
 from utils.google_auth import check_login, get_current_user
 
 # Audio utilities 
-from utils.webrtc_audio import audio_recorder_ui
+from utils.webrtc_audio import SPEECH_SAMPLE_RATE, audio_recorder_ui
+from utils.asr import is_available as asr_available
+
+# Spoken replies while streaming
+from utils.tts import create_streaming_speaker, queue_autoplay, render_autoplay
 
 # Apply the same theme as the main app
 from utils.themes import apply_theme
@@ -74,8 +81,8 @@ if "gemini_uploaded_image" not in st.session_state:
     st.session_state.gemini_uploaded_image = None
 if "gemini_webcam_image" not in st.session_state:
     st.session_state.gemini_webcam_image = None
-if "gemini_audio_data" not in st.session_state:
-    st.session_state.gemini_audio_data = None
+if "gemini_audio_path" not in st.session_state:
+    st.session_state.gemini_audio_path = None
 if "gemini_screen_share" not in st.session_state:
     st.session_state.gemini_screen_share = None
 if "gemini_message_cooldown" not in st.session_state:
@@ -99,7 +106,7 @@ def clear_multimodal_inputs():
     """Clear all multimodal inputs"""
     st.session_state.gemini_uploaded_image = None
     st.session_state.gemini_webcam_image = None
-    st.session_state.gemini_audio_data = None
+    st.session_state.gemini_audio_path = None
     st.session_state.gemini_screen_share = None
 
 def load_or_initialize_conversation():
@@ -128,11 +135,32 @@ def save_current_conversation():
     if not username:
         return
         
-    # Save conversation with the current model
-    save_conversation(
+    # Save conversation with the current model, under this page's own chat ID
+    # (a new conversation's ID is stored in gemini_chat_id)
+    chat_id = save_conversation(
         username=username,
         model=st.session_state.gemini_current_model,
-        messages=st.session_state.gemini_messages
+        messages=st.session_state.gemini_messages,
+        chat_key="gemini_chat_id"
+    )
+    
+    # Fold older turns into the conversation summary of the same row
+    if chat_id is not None:
+        schedule_summary_update(
+            username,
+            chat_id,
+            st.session_state.gemini_messages,
+            st.session_state.get("db_type", "json")
+        )
+
+def get_model_history():
+    """Conversation history to send: rolling summary plus recent turns for long chats"""
+    chat_id = st.session_state.get("gemini_chat_id")
+    if chat_id is None:
+        return st.session_state.gemini_messages
+    return build_memory_history(
+        st.session_state.gemini_messages,
+        get_summary(get_current_user() or "anonymous", chat_id, st.session_state.get("db_type", "json"))
     )
 
 def main():
@@ -312,19 +340,23 @@ def main():
                             except Exception as e:
                                 st.error(f"Could not display image: {str(e)}")
                         
+                        elif isinstance(part, dict) and part.get("type") == "audio" and part.get("path"):
+                            if os.path.exists(part["path"]):
+                                st.audio(part["path"])
+                        
                         elif isinstance(part, dict) and part.get("type") == "audio" and part.get("data"):
+                            # Messages saved before audio was stored by path
                             try:
-                                audio_data = base64.b64decode(part["data"])
-                                with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-                                    tmp.write(audio_data)
-                                    tmp_path = tmp.name
-                                st.audio(tmp_path)
+                                st.audio(base64.b64decode(part["data"]))
                             except Exception as e:
                                 st.error(f"Could not play audio: {str(e)}")
         
         # Close the chat container
         st.markdown('</div>', unsafe_allow_html=True)
         
+        # Finish speaking the last streamed reply, if any
+        render_autoplay()
+        
         # Multimodal input options
         input_tabs = st.tabs(["Image Upload", "Webcam", "Audio Recording", "Screen Share"])
         
@@ -364,25 +396,26 @@ def main():
             st.markdown("Record audio to include in the conversation")
             
             # Use WebRTC audio recorder
-            base64_audio = audio_recorder_ui(
+            recorded_path = audio_recorder_ui(
                 key="gemini_webrtc_recorder",
                 title="Record Audio",
                 description="Click start to begin recording. Click stop when done.",
                 durations=[15, 30, 60, 120],
                 show_description=True,
-                show_playback=True
+                show_playback=True,
+                target_rate=SPEECH_SAMPLE_RATE,
+                mono=True,
+                live_transcript=asr_available()
             )
             
-            if base64_audio:
-                st.session_state.gemini_audio_data = base64_audio
-                st.session_state.gemini_audio_path = st.session_state.get("gemini_webrtc_recorder_file_path")
+            if recorded_path:
+                st.session_state.gemini_audio_path = recorded_path
                 
                 st.success("Audio recorded successfully!")
                 st.info("You can now send a message to analyze this audio.")
                 
                 # Show removal button
                 if st.button("Remove recorded audio"):
-                    st.session_state.gemini_audio_data = None
                     st.session_state.gemini_audio_path = None
                     st.experimental_rerun()
         
@@ -412,7 +445,7 @@ def main():
         
         # Get multimodal status
         has_image = st.session_state.gemini_uploaded_image is not None or st.session_state.gemini_webcam_image is not None
-        has_audio = st.session_state.gemini_audio_data is not None
+        has_audio = st.session_state.gemini_audio_path is not None
         has_screen = st.session_state.gemini_screen_share is not None
         
         # Show active multimodal inputs
@@ -468,9 +501,15 @@ def main():
             
             # Add audio if provided
             if has_audio:
+                try:
+                    from utils.audio import store_audio_clip
+                    audio_path = store_audio_clip(st.session_state.gemini_audio_path)
+                except Exception as e:
+                    print(f"Could not store audio clip: {e}")
+                    audio_path = st.session_state.gemini_audio_path
                 message_content.append({
                     "type": "audio",
-                    "data": st.session_state.gemini_audio_data
+                    "path": audio_path
                 })
             
             # Add screen share if provided
@@ -507,7 +546,7 @@ def main():
                                 if part.get("type") == "image":
                                     image_data = part.get("data")
                                 elif part.get("type") == "audio":
-                                    audio_data = part.get("data")
+                                    audio_data = part.get("path") or part.get("data")
                     
                     # Use input text or empty string if content is multimodal
                     user_text = user_input or "Analyze this"
@@ -517,10 +556,13 @@ def main():
                         response_placeholder = st.empty()
                         full_response = ""
                         
+                        # Speak the reply sentence by sentence if enabled in the TTS settings
+                        speaker = create_streaming_speaker()
+                        
                         # Get streaming response
                         for chunk in get_gemini_streaming_response(
                             prompt=user_text,
-                            conversation_history=st.session_state.gemini_messages,
+                            conversation_history=get_model_history(),
                             image_data=image_data,
                             audio_data=audio_data,
                             temperature=st.session_state.gemini_temperature,
@@ -530,8 +572,14 @@ def main():
                             full_response += chunk
                             # Display the updated response with blinking cursor
                             response_placeholder.markdown(f"{full_response}▌")
+                            if speaker:
+                                speaker.feed(chunk)
                             time.sleep(0.01)  # Small delay for smooth animation
                         
+                        # Play the rest of the reply after the rerun
+                        if speaker:
+                            queue_autoplay(speaker.finish())
+                        
                         # Add AI response to messages
                         st.session_state.gemini_messages.append({
                             "role": "assistant", 
@@ -544,7 +592,7 @@ def main():
                         # Get complete response (non-streaming)
                         ai_response = get_gemini_response(
                             prompt=user_text,
-                            conversation_history=st.session_state.gemini_messages,
+                            conversation_history=get_model_history(),
                             image_data=image_data,
                             audio_data=audio_data,
                             temperature=st.session_state.gemini_temperature,
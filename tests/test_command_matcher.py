@@ -0,0 +1,77 @@
+"""Tests for voice command phrase matching"""
+from utils.command_matcher import DICTATE_WORD, CommandMatcher, tokenize
+
+MAPPING = {
+    "new chat": "new_chat",
+    "use gemini": "select_model_gemini",
+    "switch to gemini": "select_model_gemini",
+    "stop": "stop",
+    "stop listening": "stop_listening",
+    "Increase Temperature!": "increase_temperature",
+}
+
+
+def test_tokenize_lowercases_and_strips_punctuation():
+    assert tokenize("Hey, New-Chat! don't") == ["hey", "new", "chat", "don't"]
+
+
+def test_exact_match_anywhere_in_transcript():
+    match = CommandMatcher(MAPPING).match("okay please start a new chat now")
+
+    assert (match.action, match.phrase, match.confidence) == ("new_chat", "new chat", 1.0)
+
+
+def test_longest_phrase_wins():
+    matcher = CommandMatcher(MAPPING)
+
+    assert matcher.match("stop listening").action == "stop_listening"
+    assert matcher.match("please stop").action == "stop"
+
+
+def test_earliest_phrase_wins_among_equal_lengths():
+    match = CommandMatcher(MAPPING).match("use gemini then new chat")
+
+    assert match.action == "select_model_gemini"
+
+
+def test_phrases_are_normalized():
+    assert CommandMatcher(MAPPING).match("increase the temperature, increase temperature").action == "increase_temperature"
+
+
+def test_overlapping_phrases_use_failure_links():
+    # "to gemini" is a dead end for the longer phrase, but "gemini" inside it still matches
+    matcher = CommandMatcher({"to gemini now": "a", "gemini": "b"})
+
+    assert matcher.match("go to gemini later").action == "b"
+    assert matcher.match("switch to gemini now").action == "a"
+
+
+def test_fuzzy_match_for_misrecognized_words():
+    matcher = CommandMatcher(MAPPING)
+
+    match = matcher.match("new chap")
+
+    assert match.action == "new_chat"
+    assert 0.8 <= match.confidence < 1.0
+    assert matcher.match("new chap", fuzzy=False) is None
+
+
+def test_unrelated_speech_does_not_match():
+    matcher = CommandMatcher(MAPPING)
+
+    assert matcher.match("what is the weather like today") is None
+    assert matcher.match("...") is None
+
+
+def test_dictation_captures_the_rest_of_the_transcript():
+    match = CommandMatcher(MAPPING).match("Dictate: use gemini for this, please")
+
+    assert match.action == DICTATE_WORD
+    assert match.argument == "use gemini for this please"
+
+
+def test_grammar_lists_phrases_dictation_and_unknown():
+    grammar = CommandMatcher(MAPPING).grammar()
+
+    assert "increase temperature" in grammar
+    assert grammar[-2:] == [DICTATE_WORD, "[unk]"]
@@ -0,0 +1,70 @@
+"""Tests for document chunking and lexical chunk selection"""
+from utils.documents import chunk_pages, get_document_kind, select_relevant_chunks
+
+
+def test_document_kind_by_extension():
+    assert get_document_kind("report.PDF") == "pdf"
+    assert get_document_kind("notes.txt") == "text"
+    assert get_document_kind("image.png") is None
+
+
+def test_short_pages_form_one_chunk():
+    chunks = list(chunk_pages([(1, "First page."), (2, "Second page.")], chunk_size=100, overlap=10))
+
+    assert chunks == [{"index": 0, "page": 1, "text": "First page. Second page."}]
+
+
+def test_chunks_respect_size_and_overlap():
+    words = [f"word{i}" for i in range(200)]
+    chunks = list(chunk_pages([(1, " ".join(words))], chunk_size=100, overlap=20))
+
+    assert len(chunks) > 1
+    assert [chunk["index"] for chunk in chunks] == list(range(len(chunks)))
+    assert all(len(chunk["text"]) <= 100 for chunk in chunks)
+    # Cuts fall on whitespace, so no chunk ends mid-word
+    assert all(chunk["text"].split()[-1] in words for chunk in chunks)
+    # Consecutive chunks share text
+    for previous, current in zip(chunks, chunks[1:]):
+        assert previous["text"].split()[-1] in current["text"].split()
+    # Nothing is lost
+    assert set(words) <= {word for chunk in chunks for word in chunk["text"].split()}
+
+
+def test_chunks_record_the_page_they_start_on():
+    pages = [(page, " ".join(f"p{page}w{i}" for i in range(30))) for page in (1, 2, 3)]
+    chunks = list(chunk_pages(pages, chunk_size=120, overlap=0))
+
+    for chunk in chunks:
+        assert chunk["text"].startswith(f"p{chunk['page']}w")
+    assert [chunks[0]["page"], chunks[-1]["page"]] == [1, 3]
+
+
+def test_blank_pages_are_skipped():
+    chunks = list(chunk_pages([(1, "  \t "), (2, ""), (3, "Only text.")], chunk_size=100, overlap=10))
+
+    assert chunks == [{"index": 0, "page": 3, "text": "Only text."}]
+
+
+def test_select_relevant_chunks_prefers_matching_chunks_within_budget():
+    chunks = [
+        {"index": 0, "page": 1, "text": "Introduction to the annual report"},
+        {"index": 1, "page": 2, "text": "Revenue grew in the northern region"},
+        {"index": 2, "page": 3, "text": "Revenue and profit by region"},
+        {"index": 3, "page": 4, "text": "Appendix with staff lists"},
+    ]
+
+    selected = select_relevant_chunks(chunks, "How did revenue change by region?", max_chars=70)
+
+    # Best matches fit the budget and come back in document order
+    assert [chunk["index"] for chunk in selected] == [1, 2]
+
+
+def test_select_relevant_chunks_skips_chunks_over_budget():
+    chunks = [
+        {"index": 0, "page": 1, "text": "revenue " * 20},
+        {"index": 1, "page": 1, "text": "revenue summary"},
+    ]
+
+    selected = select_relevant_chunks(chunks, "revenue", max_chars=50)
+
+    assert [chunk["index"] for chunk in selected] == [1]
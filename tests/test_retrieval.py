@@ -0,0 +1,110 @@
+"""Tests for the on-disk vector store"""
+import pytest
+
+from utils import retrieval
+from utils.embeddings import HASHING_DIM, _hashing_embed, _normalize
+from utils.retrieval import VectorStore
+
+
+@pytest.fixture(autouse=True)
+def hashing_embeddings(monkeypatch):
+    """Embed with the deterministic hashing fallback, without the shared service"""
+    calls = []
+
+    def embed(texts, task=None):
+        calls.append((list(texts), task))
+        return _normalize(_hashing_embed(texts))
+
+    monkeypatch.setattr(retrieval, "embed_texts", embed)
+    monkeypatch.setattr(retrieval, "get_embedding_model_name", lambda: f"hashing:{HASHING_DIM}")
+    return calls
+
+
+def make_store(tmp_path):
+    store = VectorStore(str(tmp_path / "store"))
+    store.upsert([
+        {"id": "a", "text": "the cat sat on the mat", "metadata": {"source": "chat", "chat_id": 1}},
+        {"id": "b", "text": "dogs chase the cat around", "metadata": {"source": "chat", "chat_id": 2}},
+        {"id": "c", "text": "quarterly revenue report", "metadata": {"source": "document", "page": 3}},
+    ])
+    return store
+
+
+def test_search_ranks_by_similarity(tmp_path):
+    store = make_store(tmp_path)
+
+    results = store.search("cat on the mat", k=2, min_score=0)
+
+    assert [result["id"] for result in results][0] == "a"
+    assert results[0]["score"] >= results[-1]["score"]
+
+
+def test_search_embeds_queries_as_queries(tmp_path, hashing_embeddings):
+    store = make_store(tmp_path)
+    hashing_embeddings.clear()
+
+    store.search("cat")
+
+    assert hashing_embeddings == [(["cat"], retrieval.TASK_QUERY)]
+
+
+def test_search_filters_on_indexed_and_other_metadata(tmp_path):
+    store = make_store(tmp_path)
+
+    assert {r["id"] for r in store.search("cat", where={"chat_id": 2}, min_score=-1)} == {"b"}
+    assert {r["id"] for r in store.search("cat", exclude={"source": "document"}, min_score=-1)} == {"a", "b"}
+    assert {r["id"] for r in store.search("revenue", where={"page": 3}, min_score=-1)} == {"c"}
+    assert store.search("cat", where={"chat_id": 99}, min_score=-1) == []
+
+
+def test_search_with_no_matching_rows_skips_embedding(tmp_path, hashing_embeddings):
+    store = make_store(tmp_path)
+    hashing_embeddings.clear()
+
+    assert store.search("cat", where={"source": "missing"}) == []
+    assert hashing_embeddings == []
+
+
+def test_upsert_skips_unchanged_text_and_replaces_changed(tmp_path):
+    store = make_store(tmp_path)
+
+    assert store.upsert([{"id": "a", "text": "the cat sat on the mat"}]) == 0
+    assert store.upsert([{"id": "a", "text": "a bird in the tree", "metadata": {"chat_id": 1}}]) == 1
+
+    assert sorted(store.ids()) == ["a", "b", "c"]
+    results = store.search("bird tree", k=1, min_score=0)
+    assert results[0]["id"] == "a"
+    assert results[0]["text"] == "a bird in the tree"
+    # The superseded row no longer matches its old metadata
+    assert store.search("cat", where={"source": "chat"}, min_score=-1)[0]["id"] == "b"
+
+
+def test_delete_removes_items(tmp_path):
+    store = make_store(tmp_path)
+
+    assert store.delete(["a", "missing"]) == 1
+
+    assert sorted(store.ids()) == ["b", "c"]
+    assert all(result["id"] != "a" for result in store.search("cat mat", min_score=-1))
+
+
+def test_store_reloads_from_disk(tmp_path):
+    store = make_store(tmp_path)
+    store.upsert([{"id": "b", "text": "a different text about birds", "metadata": {"chat_id": 2}}])
+    store.delete(["c"])
+
+    reloaded = VectorStore(store.path)
+
+    assert sorted(reloaded.ids()) == ["a", "b"]
+    assert reloaded.search("birds", k=1, min_score=0)[0]["text"] == "a different text about birds"
+    assert {r["id"] for r in reloaded.search("cat", where={"chat_id": 1}, min_score=-1)} == {"a"}
+
+
+def test_store_is_rebuilt_when_the_model_changes(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    monkeypatch.setattr(retrieval, "get_embedding_model_name", lambda: "other-model")
+
+    reloaded = VectorStore(store.path)
+
+    assert reloaded.ids() == []
+    assert reloaded.search("cat") == []
@@ -0,0 +1,142 @@
+"""Tests for the schema migrations"""
+import psycopg2.errors
+import pytest
+
+from utils import schema
+
+
+class FakeDatabase:
+    """Records statements and tracks the schema_version table"""
+
+    def __init__(self, version=None):
+        # None means schema_version does not exist
+        self.version = version
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor:
+    def __init__(self, db: FakeDatabase):
+        self.db = db
+        self._row = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        statement = " ".join(sql.split())
+        self.db.statements.append(statement)
+        if statement.startswith("CREATE TABLE IF NOT EXISTS schema_version"):
+            self.db.version = self.db.version if self.db.version is not None else "empty"
+        elif statement == "SELECT version FROM schema_version":
+            if self.db.version is None:
+                raise psycopg2.errors.UndefinedTable()
+            self._row = None if self.db.version == "empty" else (self.db.version,)
+        elif statement.startswith("INSERT INTO schema_version"):
+            self.db.version = 0
+        elif statement.startswith("UPDATE schema_version"):
+            self.db.version = params[0]
+
+    def fetchone(self):
+        return self._row
+
+
+def ddl(db: FakeDatabase):
+    return [s for s in db.statements if s.startswith(("CREATE", "ALTER")) and "schema_version" not in s]
+
+
+@pytest.fixture(autouse=True)
+def fresh_process(monkeypatch):
+    monkeypatch.setattr(schema, "_ready", set())
+
+
+def test_migrate_applies_every_migration_to_an_empty_database():
+    db = FakeDatabase()
+
+    assert schema.migrate(db) == len(schema.MIGRATIONS)
+
+    assert db.version == len(schema.MIGRATIONS)
+    assert db.statements[0].startswith("SELECT pg_advisory_lock")
+    assert db.statements[-1].startswith("SELECT pg_advisory_unlock")
+    assert any("CREATE TABLE IF NOT EXISTS conversations" in s for s in ddl(db))
+
+
+def test_migrate_applies_only_pending_migrations():
+    db = FakeDatabase(version=len(schema.MIGRATIONS) - 1)
+
+    assert schema.migrate(db) == 1
+
+    assert db.version == len(schema.MIGRATIONS)
+    assert ddl(db)
+
+
+def test_migrate_does_nothing_when_up_to_date():
+    db = FakeDatabase(version=len(schema.MIGRATIONS))
+
+    assert schema.migrate(db) == 0
+
+    assert ddl(db) == []
+    assert not any(s.startswith("UPDATE") for s in db.statements)
+
+
+def test_failed_migration_rolls_back_and_unlocks(monkeypatch):
+    def broken(cur):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(schema, "MIGRATIONS", [*schema.MIGRATIONS, broken])
+    db = FakeDatabase(version=len(schema.MIGRATIONS) - 1)
+
+    with pytest.raises(RuntimeError):
+        schema.migrate(db)
+
+    assert db.rollbacks == 1
+    assert db.statements[-1].startswith("SELECT pg_advisory_unlock")
+
+
+def test_ensure_schema_reads_the_version_without_locking(monkeypatch):
+    db = FakeDatabase(version=len(schema.MIGRATIONS))
+    monkeypatch.setattr(schema.psycopg2, "connect", lambda url: db)
+
+    assert schema.ensure_schema("postgres://db")
+
+    assert db.statements == ["SELECT version FROM schema_version"]
+    assert db.closed
+
+
+def test_ensure_schema_migrates_a_new_database_once(monkeypatch):
+    connections = []
+
+    def connect(url):
+        connections.append(FakeDatabase())
+        return connections[-1]
+
+    monkeypatch.setattr(schema.psycopg2, "connect", connect)
+
+    assert schema.ensure_schema("postgres://db")
+    assert schema.ensure_schema("postgres://db")
+
+    assert len(connections) == 1
+    assert connections[0].version == len(schema.MIGRATIONS)
+    # The failed version read was rolled back before migrating
+    assert connections[0].rollbacks == 1
+
+
+def test_ensure_schema_without_url():
+    assert schema.ensure_schema(None) is False
@@ -0,0 +1,124 @@
+"""Tests for the LRU audio file cache"""
+import os
+import sqlite3
+
+import pytest
+
+from utils import tts_cache
+from utils.tts_cache import AudioFileCache
+
+
+class Clock:
+    """Controllable stand-in for time.time"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(tts_cache.time, "time", clock)
+    return clock
+
+
+def test_put_and_get(tmp_path, clock):
+    cache = AudioFileCache(str(tmp_path), max_bytes=100)
+
+    path = cache.put("hello", b"audio", voice_id="v", model_id="m")
+
+    assert cache.get_path("hello") == path == str(tmp_path / "hello.mp3")
+    assert cache.get_path("missing") is None
+    assert cache.stats() == {"entries": 1, "bytes": 5, "max_bytes": 100}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = AudioFileCache(str(tmp_path), max_bytes=25)
+    cache.put("a", b"x" * 10)
+    clock.now += tts_cache.TOUCH_INTERVAL
+    cache.put("b", b"x" * 10)
+    clock.now += tts_cache.TOUCH_INTERVAL
+    # Reading "a" makes "b" the least recently used
+    assert cache.get_path("a")
+    clock.now += tts_cache.TOUCH_INTERVAL
+
+    cache.put("c", b"x" * 10)
+
+    assert cache.get_path("b") is None
+    assert not os.path.exists(cache.path_for("b"))
+    assert cache.get_path("a") and cache.get_path("c")
+    assert cache.stats()["bytes"] == 20
+
+
+def test_corrupt_entries_are_discarded(tmp_path, clock):
+    cache = AudioFileCache(str(tmp_path), max_bytes=100)
+    path = cache.put("clip", b"complete audio")
+
+    with open(path, "wb") as f:
+        f.write(b"trunc")
+
+    assert cache.get_path("clip") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_entries_keep_their_extension(tmp_path, clock):
+    cache = AudioFileCache(str(tmp_path), max_bytes=100, extension=".mp3")
+
+    path = cache.put("upload", b"wave data", extension=".wav")
+
+    assert path.endswith("upload.wav")
+    assert AudioFileCache(str(tmp_path), max_bytes=100).get_path("upload") == path
+
+
+def test_reconcile_adopts_unindexed_files_and_drops_missing_ones(tmp_path, clock):
+    cache = AudioFileCache(str(tmp_path), max_bytes=100)
+    gone = cache.put("gone", b"data")
+    os.remove(gone)
+    (tmp_path / "legacy.mp3").write_bytes(b"old clip")
+    (tmp_path / "partial.tmp").write_bytes(b"interrupted")
+    (tmp_path / "notes.txt").write_bytes(b"not audio")
+
+    reopened = AudioFileCache(str(tmp_path), max_bytes=100)
+
+    assert reopened.get_path("gone") is None
+    assert reopened.get_path("legacy") == str(tmp_path / "legacy.mp3")
+    assert not (tmp_path / "partial.tmp").exists()
+    assert (tmp_path / "notes.txt").exists()
+    assert reopened.stats()["entries"] == 1
+
+
+def test_index_without_extension_column_is_migrated(tmp_path, clock):
+    conn = sqlite3.connect(str(tmp_path / "index.sqlite3"))
+    conn.execute("""
+        CREATE TABLE entries (
+            key TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            voice_id TEXT,
+            model_id TEXT,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+    """)
+    conn.execute("INSERT INTO entries VALUES ('old', 3, NULL, NULL, 0, 0)")
+    conn.commit()
+    conn.close()
+    (tmp_path / "old.mp3").write_bytes(b"abc")
+
+    cache = AudioFileCache(str(tmp_path), max_bytes=100)
+
+    assert cache.get_path("old") == str(tmp_path / "old.mp3")
+
+
+def test_reopening_over_budget_evicts(tmp_path, clock):
+    cache = AudioFileCache(str(tmp_path), max_bytes=100)
+    cache.put("a", b"x" * 40)
+    clock.now += 1
+    cache.put("b", b"x" * 40)
+
+    smaller = AudioFileCache(str(tmp_path), max_bytes=50)
+
+    assert smaller.get_path("a") is None
+    assert smaller.get_path("b")
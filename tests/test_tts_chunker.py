@@ -0,0 +1,35 @@
+"""Tests for splitting streamed replies into speakable sentences"""
+from utils.tts import SentenceChunker, speakable_text, split_sentences
+
+
+def test_sentences_are_returned_once_complete():
+    chunker = SentenceChunker(min_chars=10)
+
+    assert chunker.feed("The first sentence is here") == []
+    assert chunker.feed(". And the second") == ["The first sentence is here."]
+    assert chunker.feed(" one follows! Then") == ["And the second one follows!"]
+    assert chunker.flush() == ["Then"]
+    assert chunker.flush() == []
+
+
+def test_short_sentences_are_merged():
+    assert split_sentences("Yes. No. Maybe it is fine.", min_chars=10) == ["Yes. No. Maybe it is fine."]
+
+
+def test_paragraph_breaks_end_sentences():
+    chunker = SentenceChunker(min_chars=5)
+
+    assert chunker.feed("A heading line\n\nBody text") == ["A heading line"]
+
+
+def test_open_code_block_is_held_back():
+    chunker = SentenceChunker(min_chars=5)
+
+    assert chunker.feed("Run this code. ```python\nx = 1. y = 2. ") == ["Run this code."]
+    assert chunker.feed("```\nThat sets two values. ") == ["That sets two values."]
+
+
+def test_markdown_is_not_spoken():
+    text = "## Title\n- **Bold** item with `code` and a [link](http://example.com)"
+
+    assert speakable_text(text) == "Title Bold item with code and a link"
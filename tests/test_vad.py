@@ -0,0 +1,95 @@
+"""Tests for the energy-based voice activity detector"""
+import numpy as np
+
+from utils.vad import VAD_FRAME_MS, VAD_HANGOVER_MS, VoiceActivityDetector
+
+SAMPLE_RATE = 16000
+FRAME_SAMPLES = SAMPLE_RATE * VAD_FRAME_MS // 1000
+
+
+def noise(frames: int, amplitude: float = 30, seed: int = 0) -> bytes:
+    rng = np.random.default_rng(seed)
+    samples = rng.normal(0, amplitude, frames * FRAME_SAMPLES)
+    return samples.astype(np.int16).tobytes()
+
+
+def tone(frames: int, amplitude: float = 8000) -> bytes:
+    t = np.arange(frames * FRAME_SAMPLES) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * 440 * t)).astype(np.int16).tobytes()
+
+
+def feed_all(vad: VoiceActivityDetector, pcm: bytes, chunk: int = 1000):
+    """Feed audio in odd-sized chunks, collecting speech and the number of segment ends"""
+    speech, ends = b"", 0
+    pending = pcm
+    while pending:
+        out, ended = vad.feed(pending[:chunk])
+        pending = pending[chunk:]
+        speech += out
+        ends += ended
+        # An ended segment leaves the rest of the chunk buffered; flush it
+        while ended:
+            out, ended = vad.feed(b"")
+            speech += out
+            ends += ended
+    return speech, ends
+
+
+def test_silence_produces_no_speech():
+    vad = VoiceActivityDetector(SAMPLE_RATE)
+
+    speech, ends = feed_all(vad, noise(100))
+
+    assert speech == b""
+    assert ends == 0
+    assert not vad.in_speech
+
+
+def test_speech_segment_is_detected_and_ended():
+    vad = VoiceActivityDetector(SAMPLE_RATE)
+    hangover = VAD_HANGOVER_MS // VAD_FRAME_MS
+
+    speech, ends = feed_all(vad, noise(30) + tone(20) + noise(hangover + 10, seed=1))
+
+    assert ends == 1
+    assert not vad.in_speech
+    frames = len(speech) // (FRAME_SAMPLES * 2)
+    # The tone, preceded by some pre-roll and followed by the hangover
+    assert 20 + hangover <= frames <= 20 + hangover + 12
+
+
+def test_short_click_does_not_start_a_segment():
+    vad = VoiceActivityDetector(SAMPLE_RATE)
+
+    speech, ends = feed_all(vad, noise(30) + tone(1) + noise(30, seed=1))
+
+    assert speech == b""
+    assert ends == 0
+
+
+def test_long_segments_are_cut():
+    vad = VoiceActivityDetector(SAMPLE_RATE, max_segment_seconds=1.0)
+
+    _, ends = feed_all(vad, noise(20) + tone(100))
+
+    assert ends >= 1
+
+
+def test_partial_frames_are_buffered():
+    vad = VoiceActivityDetector(SAMPLE_RATE)
+
+    assert vad.feed(b"\x00" * (vad.frame_bytes - 2)) == (b"", False)
+    assert vad.noise_floor is None
+    vad.feed(b"\x00" * 2)
+    assert vad.noise_floor is not None
+
+
+def test_reset_forgets_state():
+    vad = VoiceActivityDetector(SAMPLE_RATE)
+    feed_all(vad, noise(10) + tone(10))
+    assert vad.in_speech
+
+    vad.reset()
+
+    assert not vad.in_speech
+    assert vad.noise_floor is None
@@ -0,0 +1,151 @@
+"""Tests for fanning voice commands out to sessions"""
+import pytest
+
+from utils import voice_events
+from utils.voice_events import MAX_SESSION_EVENTS, SESSION_IDLE_TIMEOUT, VoiceCommandEvent, VoiceEventBus
+
+
+class FakeProcessor:
+    """Listener stand-in that records starts and joins"""
+
+    def __init__(self, publish):
+        self.publish = publish
+        self.is_listening = False
+        self.listen_thread = None
+        self.starts = 0
+        self.joins = 0
+
+    def start_listening(self):
+        self.is_listening = True
+        self.starts += 1
+
+    def join(self):
+        self.joins += 1
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(voice_events.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def bus():
+    processors = []
+
+    def factory(publish):
+        processors.append(FakeProcessor(publish))
+        return processors[-1]
+
+    bus = VoiceEventBus(processor_factory=factory)
+    bus.processors = processors
+    return bus
+
+
+def event(action: str) -> VoiceCommandEvent:
+    return VoiceCommandEvent(action, "", action.replace("_", " "), 0.0)
+
+
+def test_first_subscriber_starts_one_shared_listener(bus, clock):
+    bus.subscribe("one")
+    bus.subscribe("two")
+
+    assert len(bus.processors) == 1
+    assert bus.processors[0].starts == 1
+    assert bus.is_listening
+
+
+def test_events_fan_out_to_every_session(bus, clock):
+    bus.subscribe("one")
+    bus.subscribe("two")
+
+    bus.processors[0].publish(event("new_chat"))
+    bus.processors[0].publish(event("logout"))
+
+    assert bus.pending("one")
+    assert [e.action for e in bus.drain("one")] == ["new_chat", "logout"]
+    assert [e.action for e in bus.drain("two")] == ["new_chat", "logout"]
+    assert bus.drain("one") == []
+    assert not bus.pending("one")
+
+
+def test_unsubscribed_sessions_get_nothing(bus, clock):
+    bus.subscribe("one")
+    bus.publish(event("new_chat"))
+
+    assert bus.drain("other") == []
+    assert not bus.is_subscribed("other")
+
+
+def test_queues_are_bounded(bus, clock):
+    bus.subscribe("one")
+
+    for index in range(MAX_SESSION_EVENTS + 5):
+        bus.publish(VoiceCommandEvent("dictate", str(index), "", 0.0))
+
+    drained = bus.drain("one")
+    assert len(drained) == MAX_SESSION_EVENTS
+    assert drained[0].argument == "5"
+    assert bus.dropped == 5
+
+
+def test_last_unsubscribe_stops_the_listener(bus, clock):
+    bus.subscribe("one")
+    bus.subscribe("two")
+    processor = bus.processors[0]
+
+    bus.unsubscribe("one")
+    assert processor.is_listening
+
+    bus.unsubscribe("two")
+    assert not processor.is_listening
+    assert processor.joins == 2
+
+
+def test_resubscribing_restarts_the_stopped_listener(bus, clock):
+    bus.subscribe("one")
+    bus.unsubscribe("one")
+
+    bus.subscribe("one")
+
+    assert len(bus.processors) == 1
+    assert bus.processors[0].starts == 2
+    assert bus.is_listening
+
+
+def test_idle_sessions_expire(bus, clock):
+    bus.subscribe("idle")
+    bus.subscribe("active")
+
+    clock.now += SESSION_IDLE_TIMEOUT / 2
+    bus.drain("active")
+    clock.now += SESSION_IDLE_TIMEOUT / 2 + 1
+    bus.publish(event("new_chat"))
+
+    assert not bus.is_subscribed("idle")
+    assert [e.action for e in bus.drain("active")] == ["new_chat"]
+
+
+def test_listener_stops_when_every_session_expired(bus, clock):
+    bus.subscribe("idle")
+    processor = bus.processors[0]
+
+    clock.now += SESSION_IDLE_TIMEOUT + 1
+    bus.publish(event("new_chat"))
+
+    # Signalled from the listener thread without joining it
+    assert not processor.is_listening
+    assert processor.joins == 1
+
+    bus.subscribe("new")
+    assert processor.joins == 2
+    assert processor.is_listening
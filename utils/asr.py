@@ -0,0 +1,113 @@
+"""
+Offline streaming speech recognition
+
+Wraps Vosk (Kaldi models running on the CPU) behind a small incremental
+interface: raw 16-bit PCM is fed in as it is captured and the recognizer
+returns partial hypotheses while the user is still speaking and a final
+transcript at the end of each utterance. The model is loaded once per process
+and shared by all recognizers; each recognizer holds its own decoding state.
+
+Vosk is optional. When the package or the model directory is missing,
+is_available() returns False and callers fall back to online recognition.
+"""
+import os
+import json
+import threading
+from typing import List, Optional, Tuple
+
+# Vosk model directory (e.g. vosk-model-small-en-us-0.15, about 40 MB)
+VOSK_MODEL_PATH = os.environ.get("VOSK_MODEL_PATH", "models/vosk/vosk-model-small-en-us-0.15")
+
+# Sample rate audio is captured and decoded at
+ASR_SAMPLE_RATE = 16000
+
+_model = None
+_model_failed = False
+_model_lock = threading.Lock()
+
+
+def _get_model():
+    """Load the Vosk model once, or None if unavailable"""
+    global _model, _model_failed
+    with _model_lock:
+        if _model is None and not _model_failed:
+            try:
+                import vosk
+                vosk.SetLogLevel(-1)
+                _model = vosk.Model(VOSK_MODEL_PATH)
+            except Exception as e:
+                print(f"Offline speech recognition unavailable: {e}")
+                _model_failed = True
+        return _model
+
+
+def is_available() -> bool:
+    """Whether offline recognition can be used in this environment"""
+    if _model_failed or not os.path.isdir(VOSK_MODEL_PATH):
+        return False
+    try:
+        import vosk  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class StreamingRecognizer:
+    """Incremental recognizer for one audio stream"""
+
+    def __init__(self, sample_rate: int = ASR_SAMPLE_RATE, phrases: Optional[List[str]] = None):
+        """
+        Create a recognizer
+
+        Args:
+            sample_rate: Sample rate of the PCM that will be fed in
+            phrases: Optional list of phrases to restrict decoding to
+                ("[unk]" lets other speech through as unknown)
+
+        Raises:
+            Exception: If the Vosk model is unavailable
+        """
+        model = _get_model()
+        if model is None:
+            raise Exception("Vosk model could not be loaded")
+
+        from vosk import KaldiRecognizer
+        self.sample_rate = sample_rate
+        if phrases:
+            self._recognizer = KaldiRecognizer(model, sample_rate, json.dumps(phrases))
+        else:
+            self._recognizer = KaldiRecognizer(model, sample_rate)
+        self._last_partial = ""
+
+    def accept(self, pcm: bytes) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Decode the next piece of audio
+
+        Args:
+            pcm: Little-endian 16-bit mono samples
+
+        Returns:
+            Tuple of (final, partial): the finished utterance's transcript when
+            an utterance ended, and the current hypothesis when it changed
+        """
+        if self._recognizer.AcceptWaveform(pcm):
+            self._last_partial = ""
+            text = json.loads(self._recognizer.Result()).get("text", "").strip()
+            return (text or None), None
+
+        partial = json.loads(self._recognizer.PartialResult()).get("partial", "").strip()
+        if partial and partial != self._last_partial:
+            self._last_partial = partial
+            return None, partial
+        return None, None
+
+    def finish(self) -> Optional[str]:
+        """Flush the decoder and return the transcript of any pending speech"""
+        self._last_partial = ""
+        text = json.loads(self._recognizer.FinalResult()).get("text", "").strip()
+        return text or None
+
+    def reset(self):
+        """Discard the current utterance"""
+        self._last_partial = ""
+        self._recognizer.Reset()
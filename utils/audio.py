@@ -2,111 +2,85 @@
 Audio recording and processing utilities
 """
 import os
+import uuid
 import base64
+import shutil
 import tempfile
-import pyaudio
-import wave
 from typing import Tuple, Optional
 
-def record_audio(duration: int = 5, sample_rate: int = 16000) -> Tuple[bytes, str]:
+from utils.audio_capture import CAPTURE_GRACE, get_capture_service
+
+# Directory for audio clips attached to saved messages
+AUDIO_DIR = "data/audio"
+
+def start_recording(duration: int = 5, sample_rate: int = 16000):
     """
-    Record audio from the microphone
+    Start recording from the microphone in the background
     
     Args:
         duration: Recording duration in seconds
         sample_rate: Audio sample rate (Hz)
         
     Returns:
-        Tuple of (audio_bytes, temp_file_path)
+        CaptureHandle; call cancel() on it to stop early and pass it to
+        finish_recording once it is done
         
     Raises:
-        Exception: If microphone hardware is not available or if there's a recording error
+        Exception: If microphone hardware is not available
     """
-    # Audio parameters
-    chunk = 1024  # Record in chunks of 1024 samples
-    sample_format = pyaudio.paInt16  # 16 bits per sample
-    channels = 1  # Mono
-    
-    # Create a temporary file
-    temp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-    temp_file_path = temp_file.name
-    temp_file.close()
-    
-    p = None
-    
     try:
-        # Initialize PyAudio
-        p = pyaudio.PyAudio()
-        
-        # Check if we can open the microphone
-        try:
-            stream = p.open(
-                format=sample_format,
-                channels=channels,
-                rate=sample_rate,
-                input=True,
-                frames_per_buffer=chunk,
-                start=False
-            )
-        except Exception as e:
-            # Close PyAudio if microphone couldn't be opened
-            if p:
-                p.terminate()
-            raise Exception(f"Could not access microphone. {str(e)}")
-        
-        # Open stream with error checking
-        stream = p.open(
-            format=sample_format,
-            channels=channels,
-            rate=sample_rate,
-            input=True,
-            frames_per_buffer=chunk
-        )
-        
-        # Record data
-        frames = []
-        seconds = int(sample_rate / chunk * duration)
-        
         print(f"Recording audio for {duration} seconds...")
-        for i in range(0, seconds):
-            data = stream.read(chunk, exception_on_overflow=False)
-            frames.append(data)
-            
-        # Stop and close the stream
-        stream.stop_stream()
-        stream.close()
-        
-        # Save as WAV file
-        with wave.open(temp_file_path, 'wb') as wf:
-            wf.setnchannels(channels)
-            wf.setsampwidth(p.get_sample_size(sample_format))
-            wf.setframerate(sample_rate)
-            wf.writeframes(b''.join(frames))
-            
-        # Read the file back as bytes
-        with open(temp_file_path, 'rb') as f:
-            audio_bytes = f.read()
-            
-        return audio_bytes, temp_file_path
-        
+        return get_capture_service().start(duration, sample_rate)
     except Exception as e:
-        # Clean up the temp file on error
-        if os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-            except:
-                pass
         raise Exception(f"Error recording audio: {str(e)}")
+
+
+def finish_recording(handle) -> Tuple[bytes, str]:
+    """
+    Collect a finished (or stopped) recording
+    
+    Args:
+        handle: CaptureHandle from start_recording
         
-    finally:
-        if p:
-            p.terminate()
+    Returns:
+        Tuple of (audio_bytes, temp_file_path)
+    """
+    audio_bytes = handle.result(timeout=CAPTURE_GRACE)
+    
+    # The app attaches clips by path, so write the WAV once
+    temp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
+    with temp_file:
+        temp_file.write(audio_bytes)
+        
+    return audio_bytes, temp_file.name
+
+
+def record_audio(duration: int = 5, sample_rate: int = 16000) -> Tuple[bytes, str]:
+    """
+    Record audio from the microphone, waiting until the recording ends
+    
+    Args:
+        duration: Recording duration in seconds
+        sample_rate: Audio sample rate (Hz)
+        
+    Returns:
+        Tuple of (audio_bytes, temp_file_path)
+        
+    Raises:
+        Exception: If microphone hardware is not available or if there's a recording error
+    """
+    handle = start_recording(duration, sample_rate)
+    handle.wait(duration + CAPTURE_GRACE)
+    return finish_recording(handle)
 
 
 def encode_audio(audio_bytes: bytes) -> str:
     """
     Encode audio bytes to base64 string
     
+    Only needed at boundaries that require text (e.g. data URLs); the app
+    itself passes audio around as bytes or file paths.
+    
     Args:
         audio_bytes: Raw audio bytes to encode
         
@@ -116,6 +90,26 @@ def encode_audio(audio_bytes: bytes) -> str:
     return base64.b64encode(audio_bytes).decode('utf-8')
 
 
+def store_audio_clip(file_path: str) -> str:
+    """
+    Move a recorded or uploaded clip into the audio directory
+    
+    Clips attached to messages are referenced by path, so they are moved out
+    of the temp directory where they would not survive a restart.
+    
+    Args:
+        file_path: Path to the temporary audio file
+        
+    Returns:
+        Path of the stored clip
+    """
+    os.makedirs(AUDIO_DIR, exist_ok=True)
+    extension = os.path.splitext(file_path)[1] or ".wav"
+    stored_path = os.path.join(AUDIO_DIR, f"{uuid.uuid4().hex}{extension}")
+    shutil.move(file_path, stored_path)
+    return stored_path
+
+
 def cleanup_audio_file(file_path: str) -> None:
     """
     Delete temporary audio file
@@ -0,0 +1,229 @@
+"""
+Shared microphone capture
+
+One PyAudio instance is kept for the whole process instead of initializing
+PortAudio for every recording. Streams run in callback mode: PortAudio's
+thread copies each buffer into memory while the caller simply waits (or
+cancels), and finished recordings are returned as WAV bytes without touching
+the disk.
+"""
+import io
+import wave
+import threading
+from typing import Callable, Optional
+
+import pyaudio
+
+# Default capture format: 16 kHz, 16-bit mono (what speech recognizers expect)
+DEFAULT_SAMPLE_RATE = 16000
+DEFAULT_CHANNELS = 1
+SAMPLE_FORMAT = pyaudio.paInt16
+SAMPLE_WIDTH = 2
+
+# Frames delivered per callback
+FRAMES_PER_BUFFER = 1024
+
+# Extra time allowed for a recording to finish before giving up (seconds)
+CAPTURE_GRACE = 2.0
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int, channels: int = DEFAULT_CHANNELS) -> bytes:
+    """
+    Wrap 16-bit PCM in a WAV container
+
+    Args:
+        pcm: Raw little-endian 16-bit samples
+        sample_rate: Sample rate in Hz
+        channels: Number of interleaved channels
+
+    Returns:
+        WAV file bytes
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(SAMPLE_WIDTH)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+    return buffer.getvalue()
+
+
+class CaptureHandle:
+    """A recording in progress"""
+
+    def __init__(self, stream, total_bytes: int, sample_rate: int, channels: int):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        # Full length of the recording in seconds
+        self.length = total_bytes / (SAMPLE_WIDTH * channels * sample_rate)
+        self._stream = stream
+        self._buffer = bytearray(total_bytes)
+        self._recorded = 0
+        self._done = threading.Event()
+        self._cancelled = False
+
+    def _on_audio(self, in_data, frame_count, time_info, status):
+        """PortAudio callback: copy the buffer in place, stop once full"""
+        if self._cancelled:
+            self._done.set()
+            return (None, pyaudio.paComplete)
+
+        count = min(len(in_data), len(self._buffer) - self._recorded)
+        self._buffer[self._recorded:self._recorded + count] = in_data[:count]
+        self._recorded += count
+
+        if self._recorded >= len(self._buffer):
+            self._done.set()
+            return (None, pyaudio.paComplete)
+        return (None, pyaudio.paContinue)
+
+    def cancel(self):
+        """Stop recording early; audio captured so far is kept"""
+        self._cancelled = True
+        self._done.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    @property
+    def duration(self) -> float:
+        """Seconds captured so far"""
+        return self._recorded / (SAMPLE_WIDTH * self.channels * self.sample_rate)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the recording to finish
+
+        Args:
+            timeout: Maximum seconds to wait
+
+        Returns:
+            True if the recording finished or was cancelled
+        """
+        return self._done.wait(timeout)
+
+    def result(self, timeout: Optional[float] = None) -> bytes:
+        """
+        Wait for the recording and return it as WAV bytes
+
+        Args:
+            timeout: Maximum seconds to wait (whatever was captured is returned on timeout)
+
+        Returns:
+            WAV file bytes
+        """
+        self.wait(timeout)
+        self.close()
+        return pcm_to_wav(bytes(self._buffer[:self._recorded]), self.sample_rate, self.channels)
+
+    def close(self):
+        """Stop and close the underlying stream"""
+        if self._stream is None:
+            return
+        try:
+            self._stream.stop_stream()
+            self._stream.close()
+        except Exception as e:
+            print(f"Error closing microphone stream: {str(e)}")
+        self._stream = None
+
+
+class AudioCaptureService:
+    """Process-wide microphone access through a single PyAudio instance"""
+
+    def __init__(self):
+        self._pyaudio: Optional[pyaudio.PyAudio] = None
+        self._lock = threading.Lock()
+
+    def _get_pyaudio(self) -> pyaudio.PyAudio:
+        with self._lock:
+            if self._pyaudio is None:
+                self._pyaudio = pyaudio.PyAudio()
+            return self._pyaudio
+
+    def open_stream(
+        self,
+        callback: Callable,
+        sample_rate: int = DEFAULT_SAMPLE_RATE,
+        channels: int = DEFAULT_CHANNELS,
+        frames_per_buffer: int = FRAMES_PER_BUFFER
+    ):
+        """
+        Open a callback-mode input stream
+
+        Args:
+            callback: PortAudio callback (in_data, frame_count, time_info, status)
+            sample_rate: Sample rate in Hz
+            channels: Number of channels
+            frames_per_buffer: Frames per callback
+
+        Returns:
+            The started PyAudio stream
+
+        Raises:
+            Exception: If the microphone cannot be opened
+        """
+        try:
+            return self._get_pyaudio().open(
+                format=SAMPLE_FORMAT,
+                channels=channels,
+                rate=sample_rate,
+                input=True,
+                frames_per_buffer=frames_per_buffer,
+                stream_callback=callback
+            )
+        except Exception as e:
+            raise Exception(f"Could not access microphone. {str(e)}")
+
+    def start(self, duration: float, sample_rate: int = DEFAULT_SAMPLE_RATE, channels: int = DEFAULT_CHANNELS) -> CaptureHandle:
+        """
+        Start a fixed-length recording in the background
+
+        Args:
+            duration: Recording length in seconds
+            sample_rate: Sample rate in Hz
+            channels: Number of channels
+
+        Returns:
+            Handle to wait for, cancel, or collect the recording
+        """
+        total_bytes = int(duration * sample_rate) * SAMPLE_WIDTH * channels
+        handle = CaptureHandle(None, total_bytes, sample_rate, channels)
+        handle._stream = self.open_stream(handle._on_audio, sample_rate, channels)
+        return handle
+
+    def record(self, duration: float, sample_rate: int = DEFAULT_SAMPLE_RATE, channels: int = DEFAULT_CHANNELS) -> bytes:
+        """
+        Record a fixed-length clip
+
+        Args:
+            duration: Recording length in seconds
+            sample_rate: Sample rate in Hz
+            channels: Number of channels
+
+        Returns:
+            WAV file bytes
+        """
+        handle = self.start(duration, sample_rate, channels)
+        return handle.result(timeout=duration + CAPTURE_GRACE)
+
+    def terminate(self):
+        """Release PortAudio (a later capture reinitializes it)"""
+        with self._lock:
+            if self._pyaudio is not None:
+                self._pyaudio.terminate()
+                self._pyaudio = None
+
+
+_service: Optional[AudioCaptureService] = None
+_service_lock = threading.Lock()
+
+
+def get_capture_service() -> AudioCaptureService:
+    """Get the process-wide capture service"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = AudioCaptureService()
+        return _service
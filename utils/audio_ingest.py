@@ -0,0 +1,277 @@
+"""
+Audio preparation before it is sent to model providers
+
+Recordings arrive as 16-48 kHz PCM WAV (and uploads in whatever format the
+user picked). Before a clip is attached to a request it is:
+- decoded and downmixed to mono
+- resampled to the provider's preferred rate (16 kHz for speech)
+- trimmed of leading and trailing silence with a frame-energy detector
+- encoded to Opus (or FLAC where libsndfile lacks Opus)
+
+Encoding runs in a small process pool so it does not hold up the Streamlit
+script, and results are cached on disk by content hash, so clips in the chat
+history are only processed once. Anything that cannot be decoded is passed
+through unchanged with a MIME type sniffed from its header.
+"""
+import io
+import os
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+import numpy as np
+
+from utils.tts_cache import AudioFileCache, get_audio_cache
+
+# Sample rate providers process speech at (Gemini downsamples to 16 kHz)
+PROVIDER_SAMPLE_RATE = 16000
+
+# Encoded format: "opus" or "flac"
+INGEST_FORMAT = os.environ.get("AUDIO_INGEST_FORMAT", "opus").lower()
+
+# Cache of prepared clips (every format in one directory)
+INGEST_CACHE_DIR = "data/audio_ingest"
+
+# Total size of prepared clips before least recently used ones are evicted
+INGEST_CACHE_MAX_BYTES = int(os.environ.get("AUDIO_INGEST_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+
+# Number of encoder processes
+INGEST_WORKERS = 2
+
+# Maximum seconds to wait for a clip to be prepared before sending it as is
+INGEST_TIMEOUT = 30
+
+# Silence detection: frame length (ms), threshold below the loudest frame (dB),
+# absolute floor (dBFS) and audio kept around detected speech (seconds)
+VAD_FRAME_MS = 30
+VAD_RELATIVE_DB = 35
+VAD_FLOOR_DB = -55
+SILENCE_PADDING = 0.25
+
+# Encoded formats: soundfile format, subtype, file extension and MIME type
+FORMATS = {
+    "opus": ("OGG", "OPUS", ".ogg", "audio/ogg"),
+    "flac": ("FLAC", "PCM_16", ".flac", "audio/flac"),
+}
+
+
+class StreamingResampler:
+    """
+    Resample audio chunk by chunk without gaps or clicks at chunk boundaries
+
+    Integer ratios (48 kHz -> 16 kHz) average each block of input samples,
+    which also low-passes the signal; other ratios interpolate linearly. Both
+    carry their state across calls, so feeding a stream in pieces gives the
+    same result as resampling it in one go.
+    """
+
+    def __init__(self, in_rate: int, out_rate: int):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self._factor = in_rate // out_rate if in_rate % out_rate == 0 else 0
+        self._carry: Optional[np.ndarray] = None
+        # Position of the next output sample, in input samples from the start of the carry
+        self._position = 0.0
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Resample a chunk
+
+        Args:
+            samples: float32 array of shape (samples, channels)
+
+        Returns:
+            The resampled chunk (may be empty for very short inputs)
+        """
+        if self.in_rate == self.out_rate:
+            return samples
+        if self._carry is not None and len(self._carry):
+            samples = np.concatenate([self._carry, samples])
+
+        if self._factor:
+            # Average whole blocks and keep the remainder for the next chunk
+            usable = len(samples) - len(samples) % self._factor
+            self._carry = samples[usable:]
+            return samples[:usable].reshape(-1, self._factor, samples.shape[1]).mean(axis=1)
+
+        if len(samples) < 2:
+            self._carry = samples
+            return samples[:0]
+
+        step = self.in_rate / self.out_rate
+        positions = np.arange(self._position, len(samples) - 1, step)
+        index = positions.astype(np.int64)
+        weight = (positions - index)[:, None].astype(np.float32)
+        output = samples[index] * (1 - weight) + samples[index + 1] * weight
+
+        # Keep the last sample to interpolate across the boundary
+        next_position = positions[-1] + step if len(positions) else self._position
+        self._position = next_position - (len(samples) - 1)
+        self._carry = samples[-1:]
+        return output
+
+
+def to_float32(samples: np.ndarray) -> np.ndarray:
+    """Convert integer PCM samples to float32 in [-1, 1]"""
+    if samples.dtype == np.float32:
+        return samples
+    if np.issubdtype(samples.dtype, np.integer):
+        return samples.astype(np.float32) / np.iinfo(samples.dtype).max
+    return samples.astype(np.float32)
+
+
+def trim_silence(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """
+    Cut leading and trailing silence
+
+    Frames are classified by RMS energy against a threshold relative to the
+    loudest frame (never below an absolute floor). Clips with no speech are
+    returned unchanged.
+
+    Args:
+        samples: Mono float32 samples of shape (samples, 1)
+        sample_rate: Sample rate of the samples
+
+    Returns:
+        The trimmed samples (a view)
+    """
+    frame_length = max(1, sample_rate * VAD_FRAME_MS // 1000)
+    frame_count = len(samples) // frame_length
+    if frame_count == 0:
+        return samples
+
+    frames = samples[:frame_count * frame_length, 0].reshape(frame_count, frame_length)
+    energy_db = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-12)
+    threshold = max(energy_db.max() - VAD_RELATIVE_DB, VAD_FLOOR_DB)
+    voiced = np.flatnonzero(energy_db > threshold)
+    if len(voiced) == 0:
+        return samples
+
+    padding = int(SILENCE_PADDING * sample_rate)
+    start = max(0, voiced[0] * frame_length - padding)
+    end = min(len(samples), (voiced[-1] + 1) * frame_length + padding)
+    return samples[start:end]
+
+
+def guess_audio_mime(data: bytes) -> str:
+    """
+    Guess the MIME type of encoded audio from its header
+
+    Args:
+        data: Encoded audio
+
+    Returns:
+        MIME type (audio/wav if unknown)
+    """
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        return "audio/wav"
+    if data[:4] == b"fLaC":
+        return "audio/flac"
+    if data[:4] == b"OggS":
+        return "audio/ogg"
+    if data[:3] == b"ID3" or (len(data) > 1 and data[0] == 0xFF and data[1] & 0xE0 == 0xE0):
+        return "audio/mp3"
+    if data[4:8] == b"ftyp":
+        return "audio/mp4"
+    if data[:4] == b"\x1aE\xdf\xa3":
+        return "audio/webm"
+    return "audio/wav"
+
+
+def _resolve_format(fmt: str) -> str:
+    """Fall back to FLAC when this libsndfile cannot write the requested format"""
+    import soundfile as sf
+    sf_format, subtype, _, _ = FORMATS.get(fmt, FORMATS["flac"])
+    if subtype not in sf.available_subtypes(sf_format):
+        return "flac"
+    return fmt if fmt in FORMATS else "flac"
+
+
+def normalize_audio(data: bytes, target_rate: int = PROVIDER_SAMPLE_RATE, fmt: str = INGEST_FORMAT) -> Tuple[bytes, str]:
+    """
+    Decode, downmix, resample, trim and re-encode a clip
+
+    Runs in the worker processes; can also be called directly.
+
+    Args:
+        data: Encoded audio in any format libsndfile reads
+        target_rate: Output sample rate
+        fmt: Output format ("opus" or "flac")
+
+    Returns:
+        Tuple of (encoded_audio, mime_type)
+    """
+    import soundfile as sf
+
+    samples, sample_rate = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    if samples.shape[1] > 1:
+        samples = samples.mean(axis=1, keepdims=True)
+    if sample_rate != target_rate:
+        samples = StreamingResampler(sample_rate, target_rate).process(samples)
+    samples = trim_silence(samples, target_rate)
+
+    fmt = _resolve_format(fmt)
+    sf_format, subtype, _, mime_type = FORMATS[fmt]
+    output = io.BytesIO()
+    sf.write(output, samples, target_rate, format=sf_format, subtype=subtype)
+    return output.getvalue(), mime_type
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_ingest_pool() -> ProcessPoolExecutor:
+    """Get the process-wide encoder pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawn rather than fork: the Streamlit server is multi-threaded
+            _pool = ProcessPoolExecutor(
+                max_workers=INGEST_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def get_ingest_cache() -> AudioFileCache:
+    """Get the cache of prepared clips (separate from the TTS cache and its budget)"""
+    return get_audio_cache(INGEST_CACHE_DIR, INGEST_CACHE_MAX_BYTES, FORMATS["flac"][2])
+
+
+def prepare_audio(data: bytes, target_rate: int = PROVIDER_SAMPLE_RATE) -> Tuple[bytes, str]:
+    """
+    Get a clip ready to send to a provider
+
+    Args:
+        data: Encoded audio as recorded or uploaded
+        target_rate: Provider's preferred sample rate
+
+    Returns:
+        Tuple of (audio_bytes, mime_type); the original bytes with a sniffed
+        MIME type if the clip could not be processed
+    """
+    fmt = INGEST_FORMAT if INGEST_FORMAT in FORMATS else "flac"
+    key = hashlib.sha256(data).hexdigest() + f"-{target_rate}"
+
+    cache = get_ingest_cache()
+    path = cache.get_path(key)
+    if path:
+        mime_type = next(spec[3] for spec in FORMATS.values() if path.endswith(spec[2]))
+        with open(path, "rb") as f:
+            return f.read(), mime_type
+
+    try:
+        encoded, mime_type = get_ingest_pool().submit(normalize_audio, data, target_rate, fmt).result(INGEST_TIMEOUT)
+    except Exception as e:
+        print(f"Audio preparation failed, sending original audio: {e}")
+        return data, guess_audio_mime(data)
+
+    extension = next(spec[2] for spec in FORMATS.values() if spec[3] == mime_type)
+    try:
+        cache.put(key, encoded, extension=extension)
+    except Exception as e:
+        print(f"Error caching prepared audio: {e}")
+    return encoded, mime_type
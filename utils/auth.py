@@ -1,46 +1,98 @@
 import streamlit as st
 import os
+import hmac
 import json
+import time
 import datetime
 import secrets
 import hashlib
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Optional, Dict, Tuple
 import psycopg2
-from urllib.parse import urlparse
+
+from utils.db_pool import get_db_connection, release_db_connection
+from utils.schema import ensure_schema
+from utils.session_store import enforce_session_cap, start_session_sweeper
+from utils.session_cache import get_session_cache, issue_signed_token, read_signed_token, session_id_of, signing_enabled
 
 # Secret key for session tokens - auto-generated on first run
 if "auth_secret_key" not in st.session_state:
     st.session_state.auth_secret_key = secrets.token_hex(32)
 
+# scrypt cost parameters (n=2^14, r=8 uses 16 MB per hash)
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_SALT_BYTES = 16
+SCRYPT_KEY_BYTES = 32
+
+# Concurrent password hashes; bounds CPU and memory during login bursts
+KDF_WORKERS = 2
+
+# Successful verifications are remembered this long so repeated logins skip the KDF (seconds)
+VERIFY_CACHE_TTL = 300
+VERIFY_CACHE_SIZE = 1024
+
+_kdf_pool = ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix="password-kdf")
+
+# Keys of verified (hash, password) pairs, derived with a per-process secret; never the password itself
+_verify_cache: Dict[str, float] = {}
+_verify_cache_key = secrets.token_bytes(32)
+_verify_cache_lock = threading.Lock()
+
+# Set once the schema and admin user exist
+_auth_initialized = False
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=2 * 128 * n * r * p, dklen=SCRYPT_KEY_BYTES)
+
+def _hash_password_now(password: str) -> str:
+    salt = secrets.token_bytes(SCRYPT_SALT_BYTES)
+    key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return "$".join([
+        "scrypt", str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P),
+        base64.b64encode(salt).decode(), base64.b64encode(key).decode()
+    ])
+
+def _verify_password_now(password: str, password_hash: str) -> bool:
+    if password_hash.startswith("scrypt$"):
+        try:
+            _, n, r, p, salt, key = password_hash.split("$")
+            expected = base64.b64decode(key)
+            actual = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+        except (ValueError, TypeError):
+            return False
+        return hmac.compare_digest(actual, expected)
+    
+    # Legacy unsalted SHA-256 hashes, upgraded on the next successful login
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), password_hash)
+
 # Define admin user
 ADMIN_USERNAME = "admin"
-ADMIN_PASSWORD_HASH = hashlib.sha256("adminpassword123".encode()).hexdigest()  # Default admin password
+ADMIN_PASSWORD = "adminpassword123"  # Default admin password
 
-def get_db_connection():
-    """Get a connection to the PostgreSQL database."""
-    try:
-        # Get DATABASE_URL from environment
-        db_url = os.environ.get("DATABASE_URL")
-        if not db_url:
-            return None
-            
-        # Parse the URL and create a connection
-        parsed_url = urlparse(db_url)
-        connection = psycopg2.connect(
-            dbname=parsed_url.path[1:],
-            user=parsed_url.username,
-            password=parsed_url.password,
-            host=parsed_url.hostname,
-            port=parsed_url.port
-        )
-        return connection
-    except Exception as e:
-        st.error(f"Database connection error: {str(e)}")
-        return None
+@lru_cache(maxsize=None)
+def _admin_password_hash() -> str:
+    """Hash of the default admin password, computed on first use rather than at import."""
+    return hash_password(ADMIN_PASSWORD)
+
+@lru_cache(maxsize=None)
+def _dummy_password_hash() -> str:
+    """Hash verified against when a username does not exist, so lookups take the same time either way."""
+    return hash_password(secrets.token_hex(16))
 
 def init_auth_tables():
-    """Initialize authentication tables in the database."""
+    """Create the schema (see utils/schema.py) and the default admin user."""
+    try:
+        if not ensure_schema(os.environ.get("DATABASE_URL")):
+            return False
+    except Exception as e:
+        st.error(f"Error initializing auth tables: {str(e)}")
+        return False
+    
     conn = get_db_connection()
     if not conn:
         return False
@@ -48,35 +100,12 @@ def init_auth_tables():
     try:
         cursor = conn.cursor()
         
-        # Create users table if it doesn't exist
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username VARCHAR(100) UNIQUE NOT NULL,
-            password_hash VARCHAR(255) NOT NULL,
-            email VARCHAR(255),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_admin BOOLEAN DEFAULT FALSE
-        )
-        """)
-        
-        # Create sessions table
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS sessions (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id),
-            session_token VARCHAR(255) UNIQUE NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expires_at TIMESTAMP NOT NULL
-        )
-        """)
-        
         # Check if admin user exists, if not create it
         cursor.execute("SELECT * FROM users WHERE username = %s", (ADMIN_USERNAME,))
         if cursor.fetchone() is None:
             cursor.execute(
                 "INSERT INTO users (username, password_hash, is_admin) VALUES (%s, %s, %s)",
-                (ADMIN_USERNAME, ADMIN_PASSWORD_HASH, True)
+                (ADMIN_USERNAME, _admin_password_hash(), True)
             )
             
         conn.commit()
@@ -85,21 +114,44 @@ def init_auth_tables():
         st.error(f"Error initializing auth tables: {str(e)}")
         return False
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def hash_password(password: str) -> str:
-    """Hash a password using SHA-256."""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash a password with scrypt and a random salt (runs on the bounded KDF pool)."""
+    return _kdf_pool.submit(_hash_password_now, password).result()
+
+def _verify_cache_entry(password: str, password_hash: str) -> str:
+    return hmac.new(_verify_cache_key, f"{password_hash}\0{password}".encode(), hashlib.sha256).hexdigest()
 
 def verify_password(password: str, password_hash: str) -> bool:
-    """Verify a password against its hash."""
-    return hash_password(password) == password_hash
+    """Verify a password against its hash (scrypt or legacy SHA-256)."""
+    entry = _verify_cache_entry(password, password_hash)
+    now = time.time()
+    with _verify_cache_lock:
+        if _verify_cache.get(entry, 0) > now:
+            return True
+    
+    verified = _kdf_pool.submit(_verify_password_now, password, password_hash).result()
+    if verified:
+        with _verify_cache_lock:
+            if len(_verify_cache) >= VERIFY_CACHE_SIZE:
+                for key in [key for key, expires in _verify_cache.items() if expires <= now] or list(_verify_cache)[:1]:
+                    del _verify_cache[key]
+            _verify_cache[entry] = now + VERIFY_CACHE_TTL
+    return verified
+
+def needs_rehash(password_hash: str) -> bool:
+    """Whether a stored hash uses an outdated scheme or cost parameters."""
+    return not password_hash.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
 
 def create_user(username: str, password: str, email: str = None, is_admin: bool = False) -> bool:
     """Create a new user in the database."""
     if not username or not password:
         return False
         
+    # Hash the password before taking a pooled connection
+    password_hash = hash_password(password)
+    
     conn = get_db_connection()
     if not conn:
         return False
@@ -112,9 +164,6 @@ def create_user(username: str, password: str, email: str = None, is_admin: bool
         if cursor.fetchone() is not None:
             return False
             
-        # Hash the password
-        password_hash = hash_password(password)
-        
         # Insert the new user
         cursor.execute(
             "INSERT INTO users (username, password_hash, email, is_admin) VALUES (%s, %s, %s, %s)",
@@ -127,7 +176,7 @@ def create_user(username: str, password: str, email: str = None, is_admin: bool
         st.error(f"Error creating user: {str(e)}")
         return False
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def authenticate_user(username: str, password: str) -> Tuple[bool, Optional[Dict]]:
     """Authenticate a user by username and password."""
@@ -137,7 +186,7 @@ def authenticate_user(username: str, password: str) -> Tuple[bool, Optional[Dict
     conn = get_db_connection()
     if not conn:
         # Fallback to check if it's the admin user with default credentials
-        if username == ADMIN_USERNAME and verify_password(password, ADMIN_PASSWORD_HASH):
+        if username == ADMIN_USERNAME and verify_password(password, _admin_password_hash()):
             return True, {"id": 0, "username": ADMIN_USERNAME, "is_admin": True}
         return False, None
         
@@ -147,23 +196,40 @@ def authenticate_user(username: str, password: str) -> Tuple[bool, Optional[Dict
         # Get the user
         cursor.execute("SELECT id, username, password_hash, is_admin FROM users WHERE username = %s", (username,))
         user = cursor.fetchone()
-        
-        if not user:
-            return False, None
-            
-        # Verify password
-        if verify_password(password, user[2]):
-            return True, {"id": user[0], "username": user[1], "is_admin": user[3]}
-        
-        return False, None
     except Exception as e:
         st.error(f"Authentication error: {str(e)}")
         return False, None
     finally:
-        conn.close()
+        # Return the connection before the slow password check
+        release_db_connection(conn)
+    
+    if not user:
+        # Spend the same time as a real check
+        verify_password(password, _dummy_password_hash())
+        return False, None
+        
+    # Verify password
+    if not verify_password(password, user[2]):
+        return False, None
+    
+    # Upgrade legacy hashes now that we have the password
+    if needs_rehash(user[2]):
+        password_hash = hash_password(password)
+        conn = get_db_connection()
+        if conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("UPDATE users SET password_hash = %s WHERE id = %s", (password_hash, user[0]))
+                conn.commit()
+            except Exception as e:
+                print(f"Error upgrading password hash: {str(e)}")
+            finally:
+                release_db_connection(conn)
+    
+    return True, {"id": user[0], "username": user[1], "is_admin": user[3]}
 
-def create_session(user_id: int, username: str) -> Optional[str]:
-    """Create a new session for a user."""
+def create_session(user_id: int, username: str, is_admin: bool = False) -> Optional[str]:
+    """Create a new session for a user (a signed token when SESSION_SIGNING_KEY is set)."""
     # Generate a session token
     session_token = secrets.token_hex(32)
     
@@ -181,6 +247,10 @@ def create_session(user_id: int, username: str) -> Optional[str]:
         # Set expiration to 30 days from now
         expires_at = datetime.datetime.now() + datetime.timedelta(days=30)
         
+        # Make room for the new session within the per-user cap
+        if enforce_session_cap(cursor, "sessions", user_id):
+            get_session_cache().invalidate_user(user_id)
+        
         # Insert the session
         cursor.execute(
             "INSERT INTO sessions (user_id, session_token, expires_at) VALUES (%s, %s, %s)",
@@ -188,17 +258,28 @@ def create_session(user_id: int, username: str) -> Optional[str]:
         )
         
         conn.commit()
+        if signing_enabled():
+            return issue_signed_token(
+                session_token,
+                {"id": user_id, "username": username, "is_admin": is_admin},
+                expires_at.astimezone()
+            )
         return session_token
     except Exception as e:
         st.error(f"Error creating session: {str(e)}")
         return None
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def validate_session(session_token: str) -> Tuple[bool, Optional[Dict]]:
     """Validate a session token."""
     if not session_token:
         return False, None
+    
+    # Signed tokens and recently validated sessions need no database round trip
+    user_info = read_signed_token(session_token) or get_session_cache().get(session_token)
+    if user_info:
+        return True, user_info
         
     conn = get_db_connection()
     if not conn:
@@ -216,7 +297,7 @@ def validate_session(session_token: str) -> Tuple[bool, Optional[Dict]]:
         FROM sessions s
         JOIN users u ON s.user_id = u.id
         WHERE s.session_token = %s
-        """, (session_token,))
+        """, (session_id_of(session_token),))
         
         session = cursor.fetchone()
         
@@ -230,17 +311,22 @@ def validate_session(session_token: str) -> Tuple[bool, Optional[Dict]]:
             conn.commit()
             return False, None
             
-        return True, {"id": session[1], "username": session[3], "is_admin": session[4]}
+        user_info = {"id": session[1], "username": session[3], "is_admin": session[4]}
+        # Session times are stored in local time
+        get_session_cache().put(session_token, session[1], user_info, session[2].astimezone())
+        return True, user_info
     except Exception as e:
         st.error(f"Session validation error: {str(e)}")
         return False, None
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def end_session(session_token: str) -> bool:
     """End a session."""
     if not session_token:
         return False
+    
+    get_session_cache().invalidate(session_token)
         
     conn = get_db_connection()
     if not conn:
@@ -254,24 +340,27 @@ def end_session(session_token: str) -> bool:
         cursor = conn.cursor()
         
         # Delete the session
-        cursor.execute("DELETE FROM sessions WHERE session_token = %s", (session_token,))
+        cursor.execute("DELETE FROM sessions WHERE session_token = %s", (session_id_of(session_token),))
         conn.commit()
         return True
     except Exception as e:
         st.error(f"Error ending session: {str(e)}")
         return False
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def check_login() -> None:
     """
     Checks if a user is logged in and handles the login process if not.
     Updates session state with user information.
     """
-    # Initialize auth tables on first run
-    if "auth_initialized" not in st.session_state:
-        init_auth_tables()
-        st.session_state.auth_initialized = True
+    # Initialize auth tables on the first run in this process
+    global _auth_initialized
+    if not _auth_initialized:
+        _auth_initialized = init_auth_tables()
+    
+    # Expired sessions are deleted in the background
+    start_session_sweeper()
     
     # Check if session token exists in cookies
     session_token = st.session_state.get("session_token")
@@ -306,7 +395,7 @@ def check_login() -> None:
                     
                     if authenticated:
                         # Create a session
-                        session_token = create_session(user_data["id"], user_data["username"])
+                        session_token = create_session(user_data["id"], user_data["username"], user_data["is_admin"])
                         
                         if session_token:
                             # Store in session state
@@ -364,7 +453,7 @@ def check_login() -> None:
             admin_password = st.text_input("Admin Password", type="password", key="admin_password")
             
             if st.button("Login as Admin", key="admin_login_submit"):
-                if admin_username == ADMIN_USERNAME and verify_password(admin_password, ADMIN_PASSWORD_HASH):
+                if admin_username == ADMIN_USERNAME and verify_password(admin_password, _admin_password_hash()):
                     # Create admin session
                     session_token = create_session(0, ADMIN_USERNAME)
                     
@@ -0,0 +1,144 @@
+"""
+Voice command matching
+
+Command phrases are compiled into an Aho-Corasick automaton over words, so a
+transcript (or a partial hypothesis) is scanned for every phrase in a single
+pass. Transcripts with no exact phrase fall back to fuzzy matching against
+word windows of the same length, accepted above a confidence threshold.
+"Dictate ..." is the only free-form command: the words after it are returned
+as the command's argument.
+
+The matcher also provides the phrase list used to constrain an offline
+recognizer to the command vocabulary.
+"""
+import re
+from collections import deque
+from difflib import SequenceMatcher
+from typing import Dict, List, NamedTuple, Optional
+
+# Minimum similarity for a fuzzy match (0-1)
+FUZZY_THRESHOLD = 0.8
+
+# Command word that introduces free-form dictation
+DICTATE_WORD = "dictate"
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words of a transcript, punctuation removed"""
+    return _WORD.findall(text.lower())
+
+
+class CommandMatch(NamedTuple):
+    """A command found in a transcript"""
+    action: str
+    phrase: str
+    confidence: float
+    argument: str = ""
+
+
+class CommandMatcher:
+    """Finds command phrases in transcripts"""
+
+    def __init__(self, mapping: Dict[str, str], threshold: float = FUZZY_THRESHOLD):
+        """
+        Compile the command phrases
+
+        Args:
+            mapping: Spoken phrase -> action name
+            threshold: Minimum similarity for fuzzy matches
+        """
+        self.threshold = threshold
+        self.phrases = {" ".join(tokenize(phrase)): action for phrase, action in mapping.items()}
+
+        # Trie over words: goto edges, failure links and phrases ending at each node
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[str]] = [[]]
+
+        for phrase in self.phrases:
+            node = 0
+            for word in phrase.split():
+                if word not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[node][word] = len(self._goto) - 1
+                node = self._goto[node][word]
+            self._output[node].append(phrase)
+
+        # Breadth-first pass to set failure links
+        pending = deque(self._goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for word, child in self._goto[node].items():
+                pending.append(child)
+                fallback = self._fail[node]
+                while fallback and word not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(word, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def _exact(self, words: List[str]) -> Optional[CommandMatch]:
+        """Longest (then earliest) phrase occurring in the words"""
+        best = None
+        best_key = None
+        node = 0
+        for end, word in enumerate(words):
+            while node and word not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(word, 0)
+            for phrase in self._output[node]:
+                length = len(phrase.split())
+                key = (-length, end - length)
+                if best_key is None or key < best_key:
+                    best, best_key = phrase, key
+        if best is None:
+            return None
+        return CommandMatch(self.phrases[best], best, 1.0)
+
+    def _fuzzy(self, words: List[str]) -> Optional[CommandMatch]:
+        """Most similar phrase over word windows of the phrase's length"""
+        best = None
+        for phrase, action in self.phrases.items():
+            length = len(phrase.split())
+            for start in range(max(1, len(words) - length + 1)):
+                window = " ".join(words[start:start + length])
+                score = SequenceMatcher(None, phrase, window).ratio()
+                if score >= self.threshold and (best is None or score > best.confidence):
+                    best = CommandMatch(action, phrase, score)
+        return best
+
+    def match(self, text: str, fuzzy: bool = True) -> Optional[CommandMatch]:
+        """
+        Find the command in a transcript
+
+        Args:
+            text: Transcript or partial hypothesis
+            fuzzy: Whether to try fuzzy matching when no phrase matches exactly
+
+        Returns:
+            The matched command, or None
+        """
+        words = tokenize(text)
+        if not words:
+            return None
+
+        if DICTATE_WORD in words:
+            start = words.index(DICTATE_WORD)
+            return CommandMatch(DICTATE_WORD, DICTATE_WORD, 1.0, " ".join(words[start + 1:]))
+
+        found = self._exact(words)
+        if found is None and fuzzy:
+            found = self._fuzzy(words)
+        return found
+
+    def grammar(self) -> List[str]:
+        """
+        Phrases for a constrained recognizer
+
+        Returns:
+            Every command phrase, the dictation keyword, and "[unk]" for other speech
+        """
+        return list(self.phrases) + [DICTATE_WORD, "[unk]"]
@@ -2,10 +2,17 @@ import streamlit as st
 import os
 import datetime
 import json
+import threading
 from typing import List, Dict, Any, Optional, Tuple
 import psycopg2
 import uuid
 
+from utils.schema import ensure_schema
+
+# Serializes read-modify-write cycles on the JSON conversation files, which
+# are also written from background threads (e.g. conversation summaries)
+_json_lock = threading.Lock()
+
 # Helper function to get the database URL from environment variables
 def get_db_url() -> Optional[str]:
     """Get the PostgreSQL connection string from environment variables."""
@@ -26,45 +33,8 @@ def init_db() -> None:
     
     if db_url and "db_initialized" not in st.session_state:
         try:
-            # Try to connect to PostgreSQL
-            conn = psycopg2.connect(db_url)
-            cursor = conn.cursor()
-            
-            # Check if the table exists first to avoid sequence conflicts
-            cursor.execute("SELECT EXISTS(SELECT 1 FROM information_schema.tables WHERE table_name = 'conversations')")
-            table_exists = cursor.fetchone()[0]
-            
-            if not table_exists:
-                # Create table with updated schema if it doesn't exist
-                cursor.execute('''
-                    CREATE TABLE conversations (
-                        id SERIAL PRIMARY KEY,
-                        user_id TEXT NOT NULL,
-                        model TEXT NOT NULL,
-                        timestamp TIMESTAMP NOT NULL,
-                        last_updated TIMESTAMP NOT NULL,
-                        messages JSONB NOT NULL
-                    )
-                ''')
-            
-            # Check if last_updated column exists, add it if not
-            try:
-                cursor.execute("""
-                    ALTER TABLE conversations 
-                    ADD COLUMN IF NOT EXISTS last_updated TIMESTAMP;
-                """)
-                
-                # Update any NULL last_updated values to match timestamp
-                cursor.execute("""
-                    UPDATE conversations 
-                    SET last_updated = timestamp 
-                    WHERE last_updated IS NULL;
-                """)
-            except Exception as column_e:
-                st.warning(f"Note: Unable to modify table schema: {str(column_e)}")
-            
-            conn.commit()
-            conn.close()
+            # Create or migrate the schema (once per process)
+            ensure_schema(db_url)
             
             st.session_state.db_type = "postgresql"
             st.session_state.db_initialized = True
@@ -85,16 +55,22 @@ def init_db() -> None:
         # Create data directory if it doesn't exist
         os.makedirs("data", exist_ok=True)
 
-def save_conversation(username: str, model: str, messages: List[Dict[str, str]]) -> None:
+def save_conversation(username: str, model: str, messages: List[Dict[str, str]],
+                      chat_key: str = "chat_id") -> Any:
     """
     Save the current conversation to the database.
-    If chat_id exists in session state, update that conversation.
-    Otherwise, create a new conversation.
+    If the session state key chat_key holds a conversation ID, update that
+    conversation. Otherwise, create a new conversation and store its ID there.
     
     Args:
         username: The user's username
         model: The AI model used for the conversation
         messages: The list of message objects in the conversation
+        chat_key: Session state key holding this conversation's ID (pages
+            with their own conversation, like Gemini Studio, pass their own key)
+        
+    Returns:
+        The ID of the conversation written, or None if saving failed
     """
     # Current timestamp
     now = datetime.datetime.now()
@@ -107,7 +83,8 @@ def save_conversation(username: str, model: str, messages: List[Dict[str, str]])
             cursor = conn.cursor()
             
             # Check if we're updating an existing conversation or creating a new one
-            if st.session_state.chat_id:
+            chat_id = st.session_state.get(chat_key)
+            if chat_id:
                 # Update existing conversation
                 cursor.execute(
                     """
@@ -115,7 +92,7 @@ def save_conversation(username: str, model: str, messages: List[Dict[str, str]])
                     SET messages = %s, last_updated = %s
                     WHERE id = %s AND user_id = %s
                     """,
-                    (json.dumps(messages), now, st.session_state.chat_id, username)
+                    (json.dumps(messages), now, chat_id, username)
                 )
             else:
                 # Insert new conversation
@@ -131,18 +108,22 @@ def save_conversation(username: str, model: str, messages: List[Dict[str, str]])
                 
                 # Get the new conversation ID and store it in session state
                 chat_id = cursor.fetchone()[0]
-                st.session_state.chat_id = chat_id
+                st.session_state[chat_key] = chat_id
             
             conn.commit()
             conn.close()
+            return chat_id
         except Exception as e:
             # If PostgreSQL fails, fall back to JSON
-            _save_to_json(username, model, messages)
+            with _json_lock:
+                return _save_to_json(username, model, messages, chat_key)
     else:
         # Save to JSON file
-        _save_to_json(username, model, messages)
+        with _json_lock:
+            return _save_to_json(username, model, messages, chat_key)
 
-def _save_to_json(username: str, model: str, messages: List[Dict[str, str]]) -> None:
+def _save_to_json(username: str, model: str, messages: List[Dict[str, str]],
+                  chat_key: str = "chat_id") -> Any:
     """
     Save conversation to a JSON file.
     
@@ -150,6 +131,10 @@ def _save_to_json(username: str, model: str, messages: List[Dict[str, str]]) ->
         username: The user's username
         model: The AI model used
         messages: The list of messages
+        chat_key: Session state key holding the conversation ID
+        
+    Returns:
+        The ID of the conversation written, or None if saving failed
     """
     # Create a unique filename for this user
     filename = f"data/{username}_conversations.json"
@@ -166,10 +151,11 @@ def _save_to_json(username: str, model: str, messages: List[Dict[str, str]]) ->
                 conversations = json.load(f)
         
         # Check if we're updating an existing conversation or creating a new one
-        if st.session_state.chat_id:
+        chat_id = st.session_state.get(chat_key)
+        if chat_id:
             # Find and update existing conversation
             for convo in conversations:
-                if convo.get("id") == st.session_state.chat_id:
+                if convo.get("id") == chat_id:
                     convo["messages"] = messages
                     convo["last_updated"] = timestamp
                     break
@@ -189,14 +175,16 @@ def _save_to_json(username: str, model: str, messages: List[Dict[str, str]]) ->
             conversations.append(conversation)
             
             # Store the new ID in session state
-            st.session_state.chat_id = new_id
+            st.session_state[chat_key] = new_id
+            chat_id = new_id
         
         # Write back to file
         with open(filename, "w") as f:
             json.dump(conversations, f, indent=2)
+        return chat_id
     except Exception as e:
         # Silent fail - logging would be better in production
-        pass
+        return None
 
 def load_conversations(username: str) -> List[Dict[str, Any]]:
     """
@@ -361,3 +349,94 @@ def _get_most_recent_chat_json(username: str, model: str) -> Tuple[Optional[str]
     except Exception as e:
         # If reading fails, return None
         return None, None
+
+def load_conversation_summary(username: str, chat_id: Any, db_type: str) -> Optional[Dict[str, Any]]:
+    """
+    Load the rolling summary stored with a conversation.
+    Safe to call from background threads (does not use session state).
+    
+    Args:
+        username: The user's username
+        chat_id: The conversation ID
+        db_type: "postgresql" or "json"
+        
+    Returns:
+        A dict with summary and summarized_count, or None if not found
+    """
+    if db_type == "postgresql":
+        try:
+            conn = psycopg2.connect(get_db_url())
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT summary, summary_upto FROM conversations WHERE id = %s AND user_id = %s",
+                (chat_id, username)
+            )
+            result = cursor.fetchone()
+            conn.close()
+            if result:
+                return {"summary": result[0] or "", "summarized_count": result[1] or 0}
+            return None
+        except Exception as e:
+            print(f"Error loading conversation summary: {str(e)}")
+            return None
+    
+    filename = f"data/{username}_conversations.json"
+    try:
+        if os.path.exists(filename):
+            with _json_lock, open(filename, "r") as f:
+                conversations = json.load(f)
+            for convo in conversations:
+                if str(convo.get("id")) == str(chat_id):
+                    return {
+                        "summary": convo.get("summary", ""),
+                        "summarized_count": convo.get("summary_upto", 0)
+                    }
+        return None
+    except Exception as e:
+        print(f"Error loading conversation summary: {str(e)}")
+        return None
+
+def save_conversation_summary(username: str, chat_id: Any, summary: str, summarized_count: int, db_type: str) -> None:
+    """
+    Store the rolling summary next to its conversation.
+    Safe to call from background threads (does not use session state).
+    
+    Args:
+        username: The user's username
+        chat_id: The conversation ID
+        summary: Summary of the first summarized_count messages
+        summarized_count: Number of leading messages covered by the summary
+        db_type: "postgresql" or "json"
+    """
+    if db_type == "postgresql":
+        try:
+            conn = psycopg2.connect(get_db_url())
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE conversations SET summary = %s, summary_upto = %s WHERE id = %s AND user_id = %s",
+                (summary, summarized_count, chat_id, username)
+            )
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"Error saving conversation summary: {str(e)}")
+        return
+    
+    filename = f"data/{username}_conversations.json"
+    try:
+        with _json_lock:
+            if not os.path.exists(filename):
+                return
+            with open(filename, "r") as f:
+                conversations = json.load(f)
+            for convo in conversations:
+                if str(convo.get("id")) == str(chat_id):
+                    convo["summary"] = summary
+                    convo["summary_upto"] = summarized_count
+                    break
+            else:
+                return
+            with open(filename, "w") as f:
+                json.dump(conversations, f, indent=2)
+    except Exception as e:
+        print(f"Error saving conversation summary: {str(e)}")
@@ -0,0 +1,92 @@
+"""
+Shared PostgreSQL connection pool
+
+Login and session checks run on every script run of every page, so they
+borrow connections from one process-wide pool instead of opening a new
+connection each time. ThreadedConnectionPool raises when every connection is
+in use; callers queue on a semaphore for a free one instead.
+"""
+import threading
+from typing import Optional
+
+import streamlit as st
+from psycopg2.pool import ThreadedConnectionPool
+
+from utils.database import get_db_url
+
+# Database connections kept open for authentication queries
+DB_POOL_MIN = 1
+DB_POOL_MAX = 8
+
+# How long to wait for a free pooled connection (seconds)
+DB_POOL_TIMEOUT = 30
+
+_db_pool: Optional[ThreadedConnectionPool] = None
+_db_pool_lock = threading.Lock()
+
+# Callers queue here for a free slot (ThreadedConnectionPool raises when exhausted)
+_db_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+
+def _get_db_pool() -> Optional[ThreadedConnectionPool]:
+    """Create the connection pool on first use"""
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            db_url = get_db_url()
+            if not db_url:
+                return None
+            _db_pool = ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, db_url)
+        return _db_pool
+
+
+def get_db_connection():
+    """
+    Borrow a pooled connection to the PostgreSQL database
+
+    Returns:
+        A connection (hand it back with release_db_connection), or None if
+        there is no database or no connection became free in time
+    """
+    try:
+        pool = _get_db_pool()
+        if pool is None:
+            st.error("Database connection error: No connection URL available")
+            return None
+    except Exception as e:
+        st.error(f"Database connection error: {str(e)}")
+        return None
+
+    if not _db_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        st.error("Database connection error: timed out waiting for a free connection")
+        return None
+    try:
+        return pool.getconn()
+    except Exception as e:
+        _db_slots.release()
+        st.error(f"Database connection error: {str(e)}")
+        return None
+
+
+def release_db_connection(conn) -> None:
+    """
+    Return a borrowed connection to the pool, discarding it if it is broken
+
+    Args:
+        conn: Connection from get_db_connection (None is ignored)
+    """
+    if conn is None or _db_pool is None:
+        return
+    try:
+        if not conn.closed:
+            # Leave no transaction open for the next user
+            conn.rollback()
+        _db_pool.putconn(conn, close=bool(conn.closed))
+    except Exception as e:
+        print(f"Error releasing database connection: {str(e)}")
+        try:
+            _db_pool.putconn(conn, close=True)
+        except Exception:
+            pass
+    finally:
+        _db_slots.release()
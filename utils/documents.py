@@ -0,0 +1,373 @@
+"""
+Document ingestion for AI Chat Studio
+
+Extracts text from uploaded PDF, DOCX and plain-text documents page by page in
+a worker process, streams the pages back as they are extracted and splits them
+into overlapping chunks. Large documents are not pasted whole into the prompt;
+only the chunks relevant to the current question are sent.
+"""
+import os
+import re
+import queue
+import tempfile
+import multiprocessing
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple
+
+# Supported upload extensions mapped to an extractor kind
+DOCUMENT_TYPES = {
+    "pdf": "pdf",
+    "docx": "docx",
+    "txt": "text",
+    "md": "text",
+}
+
+# Chunking parameters (in characters)
+CHUNK_SIZE = 1500
+CHUNK_OVERLAP = 200
+
+# Documents up to this size are sent whole; larger ones are retrieved per query
+MAX_INLINE_CHARS = 12000
+
+# DOCX and plain text have no pages, so paragraphs are grouped into pseudo-pages
+PSEUDO_PAGE_CHARS = 3000
+
+# Bounded queue between the worker and the app provides backpressure
+PAGE_QUEUE_SIZE = 8
+
+# Seconds to wait for the next page before giving up on the worker
+PAGE_TIMEOUT = 60
+
+_DONE = "__done__"
+_ERROR = "__error__"
+
+
+def get_document_kind(filename: str) -> Optional[str]:
+    """
+    Get the extractor kind for a file name
+
+    Args:
+        filename: Name of the uploaded file
+
+    Returns:
+        "pdf", "docx", "text" or None if the type is not supported
+    """
+    extension = os.path.splitext(filename)[1].lower().lstrip(".")
+    return DOCUMENT_TYPES.get(extension)
+
+
+def _group_paragraphs(paragraphs: Iterable[str]) -> Generator[str, None, None]:
+    """Group paragraphs into pseudo-pages of roughly PSEUDO_PAGE_CHARS"""
+    page, size = [], 0
+    for paragraph in paragraphs:
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        page.append(paragraph)
+        size += len(paragraph)
+        if size >= PSEUDO_PAGE_CHARS:
+            yield "\n\n".join(page)
+            page, size = [], 0
+    if page:
+        yield "\n\n".join(page)
+
+
+def _extract_pdf_pages(path: str) -> Generator[str, None, None]:
+    """Yield the text of each PDF page"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+
+def _extract_docx_pages(path: str) -> Generator[str, None, None]:
+    """Yield pseudo-pages of DOCX paragraph and table text"""
+    import docx
+
+    document = docx.Document(path)
+    paragraphs = [p.text for p in document.paragraphs]
+    for table in document.tables:
+        for row in table.rows:
+            paragraphs.append(" | ".join(cell.text for cell in row.cells))
+    yield from _group_paragraphs(paragraphs)
+
+
+def _extract_text_pages(path: str) -> Generator[str, None, None]:
+    """Yield pseudo-pages of a plain-text file"""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        yield from _group_paragraphs(f.read().split("\n\n"))
+
+
+_EXTRACTORS = {
+    "pdf": _extract_pdf_pages,
+    "docx": _extract_docx_pages,
+    "text": _extract_text_pages,
+}
+
+
+def _extraction_worker(path: str, kind: str, page_queue) -> None:
+    """Worker process entry point: push extracted pages onto the queue"""
+    try:
+        for page_number, text in enumerate(_EXTRACTORS[kind](path), start=1):
+            page_queue.put((page_number, text))
+        page_queue.put((_DONE, None))
+    except Exception as e:
+        page_queue.put((_ERROR, f"{type(e).__name__}: {e}"))
+
+
+def stream_document_pages(path: str, kind: str) -> Generator[Tuple[int, str], None, None]:
+    """
+    Extract a document in a worker process and yield pages as they arrive
+
+    Args:
+        path: Path to the document on disk
+        kind: Extractor kind ("pdf", "docx" or "text")
+
+    Yields:
+        Tuples of (page_number, page_text)
+
+    Raises:
+        Exception: If extraction fails or the worker stops responding
+    """
+    if kind not in _EXTRACTORS:
+        raise ValueError(f"Unsupported document type: {kind}")
+
+    # Spawn rather than fork: the Streamlit server process is multi-threaded
+    ctx = multiprocessing.get_context("spawn")
+    page_queue = ctx.Queue(maxsize=PAGE_QUEUE_SIZE)
+    worker = ctx.Process(target=_extraction_worker, args=(path, kind, page_queue), daemon=True)
+    worker.start()
+
+    try:
+        waited = 0.0
+        while True:
+            try:
+                page_number, text = page_queue.get(timeout=0.5)
+                waited = 0.0
+            except queue.Empty:
+                waited += 0.5
+                if not worker.is_alive():
+                    raise Exception("Document extraction worker exited unexpectedly")
+                if waited >= PAGE_TIMEOUT:
+                    raise Exception("Document extraction timed out")
+                continue
+
+            if page_number == _DONE:
+                break
+            if page_number == _ERROR:
+                raise Exception(f"Could not extract document text. {text}")
+            yield page_number, text
+    finally:
+        if worker.is_alive():
+            worker.terminate()
+        worker.join(timeout=1)
+
+
+def chunk_pages(
+    pages: Iterable[Tuple[int, str]],
+    chunk_size: int = CHUNK_SIZE,
+    overlap: int = CHUNK_OVERLAP
+) -> Generator[Dict[str, Any], None, None]:
+    """
+    Split streamed pages into overlapping chunks
+
+    Chunks are cut at whitespace where possible and may span page boundaries;
+    each chunk records the page it starts on.
+
+    Args:
+        pages: Iterable of (page_number, page_text) tuples
+        chunk_size: Target chunk length in characters
+        overlap: Number of characters shared between consecutive chunks
+
+    Yields:
+        Chunk dictionaries with index, page and text
+    """
+    buffer = ""
+    # (offset in buffer, page number) markers for page starts
+    page_starts: List[Tuple[int, int]] = []
+    index = 0
+
+    def page_at(offset: int) -> int:
+        page = page_starts[0][1] if page_starts else 1
+        for start, number in page_starts:
+            if start > offset:
+                break
+            page = number
+        return page
+
+    def cut(final: bool):
+        nonlocal buffer, page_starts, index
+        while len(buffer) >= chunk_size or (final and buffer.strip()):
+            end = min(chunk_size, len(buffer))
+            if end < len(buffer):
+                space = buffer.rfind(" ", chunk_size // 2, end)
+                if space != -1:
+                    end = space
+            text = buffer[:end].strip()
+            if text:
+                yield {"index": index, "page": page_at(0), "text": text}
+                index += 1
+            if end >= len(buffer):
+                buffer, page_starts = "", []
+                break
+            # Keep the overlap and shift page markers accordingly
+            consumed = max(end - overlap, 1)
+            buffer = buffer[consumed:]
+            page_starts = [(max(start - consumed, 0), number) for start, number in page_starts]
+            # Only the last marker at offset 0 is still relevant
+            while len(page_starts) > 1 and page_starts[1][0] == 0:
+                page_starts.pop(0)
+
+    for page_number, text in pages:
+        text = re.sub(r"[ \t]+", " ", text or "").strip()
+        if not text:
+            continue
+        page_starts.append((len(buffer), page_number))
+        buffer = f"{buffer} {text}" if buffer else text
+        yield from cut(final=False)
+
+    yield from cut(final=True)
+
+
+def ingest_document(
+    filename: str,
+    data: bytes,
+    progress_callback: Optional[Callable[[int], None]] = None
+) -> Dict[str, Any]:
+    """
+    Extract and chunk an uploaded document
+
+    Args:
+        filename: Name of the uploaded file
+        data: Raw file bytes
+        progress_callback: Optional function called with the number of pages extracted so far
+
+    Returns:
+        Dictionary with name, page count, character count, full text (for
+        documents small enough to send whole) and chunks
+
+    Raises:
+        Exception: If the type is unsupported or extraction fails
+    """
+    kind = get_document_kind(filename)
+    if not kind:
+        raise Exception(f"Unsupported document type: {filename}")
+
+    # The worker process reads from disk, so spill the upload to a temp file
+    suffix = os.path.splitext(filename)[1]
+    fd, temp_path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+        page_count = 0
+        page_texts: List[str] = []
+
+        def tracked_pages():
+            nonlocal page_count
+            for page_number, text in stream_document_pages(temp_path, kind):
+                page_count = page_number
+                if text and text.strip():
+                    page_texts.append(text.strip())
+                if progress_callback:
+                    progress_callback(page_number)
+                yield page_number, text
+
+        chunks = list(chunk_pages(tracked_pages()))
+    finally:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+    text = "\n\n".join(page_texts)
+    return {
+        "name": filename,
+        "pages": page_count,
+        "char_count": len(text),
+        # Only small documents are sent whole, so only their text is kept
+        "text": text if len(text) <= MAX_INLINE_CHARS else None,
+        "chunks": chunks,
+    }
+
+
+def _terms(text: str) -> set:
+    """Lower-cased word set used for lexical matching"""
+    return {term for term in re.findall(r"\w+", text.lower()) if len(term) > 2}
+
+
+def select_relevant_chunks(chunks: List[Dict[str, Any]], query: str, max_chars: int) -> List[Dict[str, Any]]:
+    """
+    Pick the chunks that best match a query, within a character budget
+
+    Args:
+        chunks: Document chunks
+        query: The user's question
+        max_chars: Maximum total characters of the selected chunks
+
+    Returns:
+        Selected chunks in document order
+    """
+    query_terms = _terms(query)
+    scored = []
+    for chunk in chunks:
+        overlap = len(query_terms & _terms(chunk["text"]))
+        scored.append((overlap, -chunk["index"], chunk))
+    scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+
+    selected, total = [], 0
+    for _, _, chunk in scored:
+        if total + len(chunk["text"]) > max_chars:
+            continue
+        selected.append(chunk)
+        total += len(chunk["text"])
+    return sorted(selected, key=lambda chunk: chunk["index"])
+
+
+def build_document_prompt(
+    document: Dict[str, Any],
+    query: str,
+    max_chars: int = MAX_INLINE_CHARS,
+    relevant_chunks: Optional[List[Dict[str, Any]]] = None
+) -> str:
+    """
+    Build a prompt that grounds the user's question in an ingested document
+
+    Small documents are included whole; for larger ones only the chunks most
+    relevant to the question are included, labelled with their page numbers.
+
+    Args:
+        document: Result of ingest_document
+        query: The user's question
+        max_chars: Character budget for document text
+        relevant_chunks: Chunks already retrieved for the question (e.g. from
+            the vector index); lexical matching is used when not provided
+
+    Returns:
+        The prompt text
+    """
+    chunks = document.get("chunks", [])
+    query = query.strip() or "Please analyze this content."
+
+    if document.get("text") and document.get("char_count", 0) <= max_chars:
+        excerpt = document["text"]
+        return (
+            f"I'm sharing the document '{document['name']}' with you:\n\n"
+            f"{excerpt}\n\n{query}"
+        )
+
+    if relevant_chunks:
+        # Keep the retrieval ranking when applying the budget, then restore document order
+        relevant, total = [], 0
+        for chunk in relevant_chunks:
+            if total + len(chunk["text"]) <= max_chars:
+                relevant.append(chunk)
+                total += len(chunk["text"])
+        relevant.sort(key=lambda chunk: chunk["index"])
+    else:
+        relevant = select_relevant_chunks(chunks, query, max_chars)
+    excerpts = "\n\n".join(f"[Page {chunk['page']}] {chunk['text']}" for chunk in relevant)
+    return (
+        f"Relevant excerpts from the document '{document['name']}' "
+        f"({document['pages']} pages):\n\n{excerpts}\n\n{query}"
+    )
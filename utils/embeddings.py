@@ -0,0 +1,464 @@
+"""
+Text embeddings for retrieval in AI Chat Studio
+
+All embedding requests go through a process-wide EmbeddingService that:
+- batches requests from every session, flushing every few milliseconds
+- dedupes texts by content hash, within a batch and across time
+- persists vectors in a memory-mapped float32 cache on disk
+- records throughput metrics
+
+Vectors come from a CPU-local model (sentence-transformers when installed,
+otherwise a dependency-free hashing embedding) or from a provider embedding
+API (Gemini or OpenAI), selected with the EMBEDDING_BACKEND variable. Texts
+are embedded either as documents (stored items) or as queries (searches);
+backends with asymmetric models, like Gemini, embed the two differently.
+"""
+import os
+import re
+import time
+import zlib
+import hashlib
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Embedding backend: "local", "gemini" or "openai"
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "local").lower()
+
+# Local sentence-transformers model used when available
+LOCAL_MODEL_NAME = os.environ.get("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+# Provider embedding models
+GEMINI_EMBEDDING_MODEL = "models/text-embedding-004"
+OPENAI_EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Embedding tasks: stored items and the searches run against them
+TASK_DOCUMENT = "document"
+TASK_QUERY = "query"
+
+# Gemini task types for each embedding task
+GEMINI_TASK_TYPES = {TASK_DOCUMENT: "retrieval_document", TASK_QUERY: "retrieval_query"}
+
+# Dimension of the hashing fallback embedding
+HASHING_DIM = 384
+
+# Texts embedded per model call
+DEFAULT_BATCH_SIZE = 32
+
+# How long the service waits to collect more requests into a batch (seconds)
+FLUSH_INTERVAL = 0.02
+
+# Flush early once this many unique texts are waiting
+MAX_PENDING_TEXTS = 256
+
+# On-disk vector cache
+CACHE_DIR = "data/embedding_cache"
+
+# Initial number of rows reserved in the cache file
+INITIAL_CACHE_ROWS = 1024
+
+_model = None
+_model_checked = False
+_model_lock = threading.Lock()
+_warm_up_started = False
+
+
+def _get_local_model():
+    """Load the sentence-transformers model once, or None if unavailable"""
+    global _model, _model_checked
+    if _model_checked:
+        return _model
+    with _model_lock:
+        if not _model_checked:
+            try:
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(LOCAL_MODEL_NAME, device="cpu")
+            except Exception as e:
+                print(f"Local embedding model unavailable, using hashing embeddings: {e}")
+                _model = None
+            _model_checked = True
+    return _model
+
+
+def warm_up_embeddings():
+    """Load the local embedding model on a background thread, once per process"""
+    global _warm_up_started
+    with _model_lock:
+        if _warm_up_started or _model_checked:
+            return
+        _warm_up_started = True
+    threading.Thread(target=get_embedding_model_name, name="embedding-warm-up", daemon=True).start()
+
+
+def embedding_model_ready() -> bool:
+    """Whether embedding texts can start without first loading a local model"""
+    return _model_checked or _provider_backend() is not None
+
+
+def _provider_backend() -> Optional[str]:
+    """The configured provider backend, if its API key is available"""
+    if EMBEDDING_BACKEND == "gemini" and os.environ.get("GEMINI_API_KEY"):
+        return "gemini"
+    if EMBEDDING_BACKEND == "openai" and os.environ.get("OPENAI_API_KEY"):
+        return "openai"
+    return None
+
+
+def get_embedding_model_name() -> str:
+    """
+    Get the name of the active embedding model
+
+    Stores record this so vectors from different models are never mixed.
+
+    Returns:
+        Model identifier string
+    """
+    provider = _provider_backend()
+    if provider == "gemini":
+        return f"gemini:{GEMINI_EMBEDDING_MODEL}"
+    if provider == "openai":
+        return f"openai:{OPENAI_EMBEDDING_MODEL}"
+    if _get_local_model() is not None:
+        return f"st:{LOCAL_MODEL_NAME}"
+    return f"hashing:{HASHING_DIM}"
+
+
+def _hashing_embed(texts: List[str]) -> np.ndarray:
+    """Embed texts with signed feature hashing of words and word pairs"""
+    vectors = np.zeros((len(texts), HASHING_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = re.findall(r"\w+", text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        if not features:
+            continue
+        hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint32, count=len(features))
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+        np.add.at(vectors[row], hashes % HASHING_DIM, signs)
+    # Sublinear term weighting keeps long texts from dominating
+    return np.sign(vectors) * np.log1p(np.abs(vectors))
+
+
+def _gemini_embed(texts: List[str], task: str = TASK_DOCUMENT) -> np.ndarray:
+    """Embed texts with the Gemini embedding API"""
+    import google.generativeai as genai
+
+    genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+    result = genai.embed_content(model=GEMINI_EMBEDDING_MODEL, content=texts, task_type=GEMINI_TASK_TYPES[task])
+    return np.asarray(result["embedding"], dtype=np.float32)
+
+
+def _openai_embed(texts: List[str]) -> np.ndarray:
+    """Embed texts with the OpenAI embedding API"""
+    from openai import OpenAI
+
+    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    response = client.embeddings.create(model=OPENAI_EMBEDDING_MODEL, input=texts)
+    return np.asarray([item.embedding for item in response.data], dtype=np.float32)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so a dot product is cosine similarity"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+def _compute_embeddings(texts: List[str], task: str = TASK_DOCUMENT, batch_size: int = DEFAULT_BATCH_SIZE) -> np.ndarray:
+    """Embed texts with the active backend, one model call per batch"""
+    provider = _provider_backend()
+    model = _get_local_model() if provider is None else None
+
+    batches = []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        if provider == "gemini":
+            batches.append(_gemini_embed(batch, task))
+        elif provider == "openai":
+            batches.append(_openai_embed(batch))
+        elif model is not None:
+            batches.append(np.asarray(model.encode(batch, batch_size=batch_size), dtype=np.float32))
+        else:
+            batches.append(_hashing_embed(batch))
+    return _normalize(np.vstack(batches))
+
+
+def content_hash(text: str, model_name: str, task: str = TASK_DOCUMENT) -> str:
+    """
+    Cache key for a text under a given embedding model and task
+
+    Args:
+        text: Text to embed
+        model_name: Result of get_embedding_model_name
+        task: TASK_DOCUMENT or TASK_QUERY
+
+    Returns:
+        Hex digest
+    """
+    if task != TASK_DOCUMENT:
+        model_name = f"{model_name}\x00{task}"
+    return hashlib.sha1(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Memory-mapped float32 vector cache keyed by content hash
+
+    Files in the cache directory:
+        vectors.f32 - preallocated float32 rows, grown by doubling
+        keys.txt    - one content hash per written row, appended
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dim: Optional[int] = None
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        self._vectors: Optional[np.memmap] = None
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    @property
+    def _keys_path(self) -> str:
+        return os.path.join(self.path, "keys.txt")
+
+    @property
+    def _dim_path(self) -> str:
+        return os.path.join(self.path, "dim")
+
+    def _load(self):
+        """Open an existing cache, if any"""
+        try:
+            with open(self._dim_path, "r") as f:
+                self.dim = int(f.read().strip())
+            with open(self._keys_path, "r") as f:
+                keys = [line.strip() for line in f if line.strip()]
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+").reshape(-1, self.dim)
+        except Exception:
+            self.dim, self._vectors = None, None
+            return
+        # Rows past the end of the file were never fully written
+        for row, key in enumerate(keys[:len(self._vectors)]):
+            self._rows[key] = row
+
+    def _open(self, dim: int):
+        """Create the cache files for vectors of a given dimension"""
+        self.dim = dim
+        with open(self._dim_path, "w") as f:
+            f.write(str(dim))
+        open(self._keys_path, "w").close()
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="w+", shape=(INITIAL_CACHE_ROWS, dim))
+
+    def _grow(self, rows: int):
+        """Extend the backing file and remap it"""
+        capacity = len(self._vectors)
+        while capacity < rows:
+            capacity *= 2
+        self._vectors.flush()
+        with open(self._vectors_path, "r+b") as f:
+            f.truncate(capacity * self.dim * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+").reshape(-1, self.dim)
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Look up cached vectors (copies, safe to keep after the cache grows)"""
+        with self._lock:
+            if self._vectors is None:
+                return {}
+            return {key: np.array(self._vectors[self._rows[key]]) for key in keys if key in self._rows}
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        """Store vectors for keys not yet in the cache"""
+        with self._lock:
+            if self._vectors is None:
+                self._open(vectors.shape[1])
+            if vectors.shape[1] != self.dim:
+                return
+
+            new = [(key, vector) for key, vector in zip(keys, vectors) if key not in self._rows]
+            if not new:
+                return
+            start = len(self._rows)
+            if start + len(new) > len(self._vectors):
+                self._grow(start + len(new))
+
+            for offset, (_, vector) in enumerate(new):
+                self._vectors[start + offset] = vector
+            self._vectors.flush()
+            # Keys are appended only after their vectors are on disk
+            with open(self._keys_path, "a") as f:
+                for offset, (key, _) in enumerate(new):
+                    f.write(key + "\n")
+                    self._rows[key] = start + offset
+
+
+class EmbeddingService:
+    """
+    Process-wide embedding service
+
+    Callers on any thread submit texts and block on a future; a single flush
+    thread collects requests for FLUSH_INTERVAL, dedupes them by content
+    hash, serves cache hits and embeds the misses in one batched call.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._requests: List[Tuple[List[str], str, Future]] = []
+        self._pending_texts = 0
+        self._thread: Optional[threading.Thread] = None
+        self._caches: Dict[str, EmbeddingCache] = {}
+        self._metrics = {
+            "requests": 0,
+            "texts": 0,
+            "unique_texts": 0,
+            "cache_hits": 0,
+            "computed": 0,
+            "batches": 0,
+            "compute_seconds": 0.0,
+        }
+
+    def _cache_for(self, model_name: str) -> EmbeddingCache:
+        if model_name not in self._caches:
+            slug = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+            self._caches[model_name] = EmbeddingCache(os.path.join(CACHE_DIR, slug))
+        return self._caches[model_name]
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+            self._thread.start()
+
+    def submit(self, texts: List[str], task: str = TASK_DOCUMENT) -> Future:
+        """
+        Queue texts for embedding
+
+        Args:
+            texts: Texts to embed
+            task: TASK_DOCUMENT for stored items, TASK_QUERY for searches
+
+        Returns:
+            Future resolving to a float32 array of shape (len(texts), dim)
+        """
+        future: Future = Future()
+        with self._condition:
+            self._ensure_thread()
+            self._requests.append((list(texts), task, future))
+            self._pending_texts += len(texts)
+            self._condition.notify()
+        return future
+
+    def embed(self, texts: List[str], task: str = TASK_DOCUMENT, timeout: Optional[float] = None) -> np.ndarray:
+        """Embed texts, blocking until the batch containing them is flushed"""
+        return self.submit(texts, task).result(timeout=timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._requests:
+                    self._condition.wait()
+                # Give other sessions a moment to add to this batch
+                deadline = time.monotonic() + FLUSH_INTERVAL
+                while self._pending_texts < MAX_PENDING_TEXTS:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                requests, self._requests = self._requests, []
+                self._pending_texts = 0
+
+            # One backend call per task: documents and queries embed differently
+            by_task: Dict[str, List[Tuple[List[str], Future]]] = {}
+            for texts, task, future in requests:
+                by_task.setdefault(task, []).append((texts, future))
+            for task, task_requests in by_task.items():
+                try:
+                    self._flush(task_requests, task)
+                except Exception as e:
+                    for _, future in task_requests:
+                        if not future.done():
+                            future.set_exception(e)
+
+    def _flush(self, requests: List[Tuple[List[str], Future]], task: str = TASK_DOCUMENT):
+        """Resolve a batch of requests for one task from the cache and one backend call"""
+        model_name = get_embedding_model_name()
+        cache = self._cache_for(model_name)
+
+        keys_by_request = [[content_hash(text, model_name, task) for text in texts] for texts, _ in requests]
+        unique: Dict[str, str] = {}
+        for (texts, _), keys in zip(requests, keys_by_request):
+            for text, key in zip(texts, keys):
+                unique.setdefault(key, text)
+
+        vectors = cache.get_many(list(unique))
+        misses = [key for key in unique if key not in vectors]
+
+        if misses:
+            started = time.perf_counter()
+            computed = _compute_embeddings([unique[key] for key in misses], task)
+            elapsed = time.perf_counter() - started
+            cache.put_many(misses, computed)
+            vectors.update(zip(misses, computed))
+            self._metrics["batches"] += 1
+            self._metrics["compute_seconds"] += elapsed
+
+        self._metrics["requests"] += len(requests)
+        self._metrics["texts"] += sum(len(keys) for keys in keys_by_request)
+        self._metrics["unique_texts"] += len(unique)
+        self._metrics["cache_hits"] += len(unique) - len(misses)
+        self._metrics["computed"] += len(misses)
+
+        dim = cache.dim or (next(iter(vectors.values())).shape[0] if vectors else HASHING_DIM)
+        for (_, future), keys in zip(requests, keys_by_request):
+            if keys:
+                future.set_result(np.vstack([vectors[key] for key in keys]).astype(np.float32, copy=False))
+            else:
+                future.set_result(np.zeros((0, dim), dtype=np.float32))
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get throughput metrics
+
+        Returns:
+            Counters plus cache hit rate and texts embedded per second of compute
+        """
+        metrics = dict(self._metrics)
+        metrics["cache_hit_rate"] = metrics["cache_hits"] / metrics["unique_texts"] if metrics["unique_texts"] else 0.0
+        metrics["texts_per_second"] = metrics["computed"] / metrics["compute_seconds"] if metrics["compute_seconds"] else 0.0
+        metrics["model"] = get_embedding_model_name()
+        return metrics
+
+
+_service: Optional[EmbeddingService] = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    """Get the process-wide embedding service"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = EmbeddingService()
+        return _service
+
+
+def embed_texts(texts: List[str], task: str = TASK_DOCUMENT) -> np.ndarray:
+    """
+    Embed a list of texts through the shared embedding service
+
+    Args:
+        texts: Texts to embed
+        task: TASK_DOCUMENT for items being stored, TASK_QUERY for search queries
+
+    Returns:
+        Float32 array of shape (len(texts), dim) with L2-normalized rows
+    """
+    return get_embedding_service().embed(texts, task)
+
+
+def get_embedding_metrics() -> Dict[str, Any]:
+    """Get throughput metrics of the shared embedding service"""
+    return get_embedding_service().get_metrics()
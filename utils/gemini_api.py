@@ -4,16 +4,39 @@ Supports multimodal inputs (text, images, audio) and streaming responses.
 """
 import os
 import base64
-from typing import List, Dict, Any, Generator, Optional
+from typing import List, Dict, Any, Generator, Optional, Union
 import google.generativeai as genai
 from PIL import Image
 from io import BytesIO
 import streamlit as st
 
+from utils.audio_ingest import prepare_audio
+
 # Constants
 DEFAULT_MODEL = "gemini-1.5-pro"
 DEFAULT_TEMPERATURE = 0.7
 
+# Audio may be passed as raw bytes, a file path, or (in older saved messages) base64 text
+AudioInput = Union[bytes, bytearray, memoryview, str]
+
+
+def load_audio_bytes(audio: AudioInput) -> bytes:
+    """
+    Get raw audio bytes from any supported audio input
+    
+    Args:
+        audio: Raw bytes, a path to an audio file, or base64-encoded audio
+        
+    Returns:
+        Audio bytes
+    """
+    if isinstance(audio, (bytes, bytearray, memoryview)):
+        return bytes(audio)
+    if os.path.isfile(audio):
+        with open(audio, "rb") as f:
+            return f.read()
+    return base64.b64decode(audio)
+
 def initialize_gemini():
     """
     Initialize the Gemini API with the provided API key.
@@ -48,7 +71,7 @@ def get_gemini_models() -> List[Dict[str, Any]]:
 def prepare_content_parts(
     prompt: str, 
     image_data: Optional[str] = None, 
-    audio_data: Optional[str] = None,
+    audio_data: Optional[AudioInput] = None,
     screen_data: Optional[str] = None
 ) -> List[Any]:
     """
@@ -57,7 +80,7 @@ def prepare_content_parts(
     Args:
         prompt: User's text input
         image_data: Base64-encoded image data
-        audio_data: Base64-encoded audio data
+        audio_data: Audio bytes or file path
         screen_data: Base64-encoded screenshot data
         
     Returns:
@@ -83,11 +106,11 @@ def prepare_content_parts(
         except Exception as e:
             st.error(f"Error processing screenshot: {str(e)}")
     
-    # Add audio if provided (Gemini handles audio via similar mechanism as images)
+    # Add audio if provided, normalized and compressed with its real MIME type
     if audio_data:
         try:
-            audio_bytes = base64.b64decode(audio_data)
-            content_parts.append({"mime_type": "audio/mp3", "data": audio_bytes})
+            audio_bytes, mime_type = prepare_audio(load_audio_bytes(audio_data))
+            content_parts.append({"mime_type": mime_type, "data": audio_bytes})
         except Exception as e:
             st.error(f"Error processing audio: {str(e)}")
     
@@ -128,10 +151,10 @@ def prepare_chat_history(conversation_history: List[Dict[str, Any]]) -> List[Dic
                             parts.append(image)
                         except Exception as e:
                             st.error(f"Error processing image in history: {str(e)}")
-                    elif part["type"] == "audio" and "data" in part:
+                    elif part["type"] == "audio" and (part.get("path") or part.get("data")):
                         try:
-                            audio_bytes = base64.b64decode(part["data"])
-                            parts.append({"mime_type": "audio/mp3", "data": audio_bytes})
+                            audio_bytes, mime_type = prepare_audio(load_audio_bytes(part.get("path") or part["data"]))
+                            parts.append({"mime_type": mime_type, "data": audio_bytes})
                         except Exception as e:
                             st.error(f"Error processing audio in history: {str(e)}")
             
@@ -143,7 +166,7 @@ def get_gemini_response(
     prompt: str, 
     conversation_history: List[Dict[str, Any]], 
     image_data: Optional[str] = None, 
-    audio_data: Optional[str] = None, 
+    audio_data: Optional[AudioInput] = None, 
     screen_data: Optional[str] = None,
     temperature: float = DEFAULT_TEMPERATURE, 
     model_name: str = DEFAULT_MODEL
@@ -155,7 +178,7 @@ def get_gemini_response(
         prompt: User's text input
         conversation_history: List of message dictionaries
         image_data: Base64-encoded image data
-        audio_data: Base64-encoded audio data
+        audio_data: Audio bytes or file path
         screen_data: Base64-encoded screenshot data
         temperature: Temperature for response generation
         model_name: Gemini model version to use
@@ -191,7 +214,7 @@ def get_gemini_streaming_response(
     prompt: str, 
     conversation_history: List[Dict[str, Any]], 
     image_data: Optional[str] = None, 
-    audio_data: Optional[str] = None, 
+    audio_data: Optional[AudioInput] = None, 
     screen_data: Optional[str] = None,
     temperature: float = DEFAULT_TEMPERATURE, 
     model_name: str = DEFAULT_MODEL
@@ -203,7 +226,7 @@ def get_gemini_streaming_response(
         prompt: User's text input
         conversation_history: List of message dictionaries
         image_data: Base64-encoded image data
-        audio_data: Base64-encoded audio data
+        audio_data: Audio bytes or file path
         screen_data: Base64-encoded screenshot data
         temperature: Temperature for response generation
         model_name: Gemini model version to use
@@ -5,16 +5,24 @@ Provides secure authentication using Google's OAuth 2.0 service
 
 import os
 import json
+import time
 import hashlib
 import base64
 import secrets
+import threading
+from functools import lru_cache
 import streamlit as st
 from google_auth_oauthlib.flow import Flow
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from google.auth import jwt
+import google.auth.transport.requests
 import requests
 from pathlib import Path
 from utils.database import get_db_url
+from utils.db_pool import get_db_connection, release_db_connection
+from utils.schema import ensure_schema
+from utils.session_store import enforce_session_cap, start_session_sweeper
+from utils.session_cache import get_session_cache, issue_signed_token, read_signed_token, session_id_of, signing_enabled
 
 # Directory for secure token storage
 TOKEN_DIR = Path("./secure_tokens")
@@ -45,87 +53,71 @@ APPROVED_EMAILS = [email.strip() for email in APPROVED_EMAILS.split(",")] if APP
 ADMIN_EMAILS = os.environ.get("ADMIN_EMAILS", "")
 ADMIN_EMAILS = [email.strip() for email in ADMIN_EMAILS.split(",")] if ADMIN_EMAILS else []
 
-def get_db_connection():
-    """Get a connection to the PostgreSQL database."""
-    import psycopg2
-    
-    db_url = get_db_url()
-    if not db_url:
-        st.error("Database connection error: No connection URL available")
-        return None
-    
-    try:
-        conn = psycopg2.connect(db_url)
-        return conn
-    except Exception as e:
-        st.error(f"Database connection error: {str(e)}")
-        return None
+# Google endpoints used at login (fixed, so no discovery document is fetched)
+GOOGLE_AUTH_URI = "https://accounts.google.com/o/oauth2/auth"
+GOOGLE_TOKEN_URI = "https://oauth2.googleapis.com/token"
+GOOGLE_USERINFO_URI = "https://www.googleapis.com/oauth2/v2/userinfo"
+GOOGLE_CERTS_URI = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+# Timeout for requests to Google (seconds)
+GOOGLE_HTTP_TIMEOUT = 10
+
+# Google's ID token signing certificates are cached this long unless the response says otherwise (seconds)
+GOOGLE_CERTS_TTL = 3600
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+_google_certs = None
+_google_certs_expiry = 0.0
+_google_certs_lock = threading.Lock()
 
 def init_auth_tables():
-    """Initialize authentication tables in the database."""
-    conn = get_db_connection()
-    if conn is None:
-        return
-    
+    """Make sure the authentication tables exist (created once per process, see utils/schema.py)."""
     try:
-        with conn.cursor() as cur:
-            # Create user table if not exists
-            cur.execute('''
-                CREATE TABLE IF NOT EXISTS google_users (
-                    id SERIAL PRIMARY KEY,
-                    email VARCHAR(255) UNIQUE NOT NULL,
-                    name VARCHAR(255),
-                    picture TEXT,
-                    is_admin BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Create sessions table if not exists
-            cur.execute('''
-                CREATE TABLE IF NOT EXISTS google_sessions (
-                    id SERIAL PRIMARY KEY,
-                    email VARCHAR(255) NOT NULL,
-                    token VARCHAR(255) UNIQUE NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    expires_at TIMESTAMP NOT NULL,
-                    FOREIGN KEY (email) REFERENCES google_users(email) ON DELETE CASCADE
-                )
-            ''')
-            
-            conn.commit()
+        ensure_schema(get_db_url())
     except Exception as e:
         st.error(f"Database initialization error: {str(e)}")
-    finally:
-        conn.close()
 
-def create_oauth_flow():
-    """Create an OAuth2 flow instance to manage the OAuth 2.0 Authorization Flow."""
-    if not CLIENT_ID or not CLIENT_SECRET:
-        st.error("Google OAuth credentials not configured. Please set GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET environment variables.")
-        return None
+def get_http_session():
+    """Get the process-wide HTTP session for Google requests (keeps connections alive between logins)."""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            _http_session = requests.Session()
+        return _http_session
 
-    # Create OAuth flow configuration with hardcoded redirect URI
-    hardcoded_redirect_uri = "https://dartopia.uk"
-    client_config = {
+@lru_cache(maxsize=1)
+def get_oauth_client_config():
+    """OAuth client configuration, built once per process."""
+    return {
         "web": {
             "client_id": CLIENT_ID,
             "client_secret": CLIENT_SECRET,
-            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": "https://oauth2.googleapis.com/token",
-            "redirect_uris": [hardcoded_redirect_uri]
+            "auth_uri": GOOGLE_AUTH_URI,
+            "token_uri": GOOGLE_TOKEN_URI,
+            "redirect_uris": [REDIRECT_URI]
         }
     }
-    
+
+def create_oauth_flow():
+    """Create an OAuth2 flow instance to manage the OAuth 2.0 Authorization Flow."""
+    if not CLIENT_ID or not CLIENT_SECRET:
+        st.error("Google OAuth credentials not configured. Please set GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET environment variables.")
+        return None
+
     try:
-        # Create flow using client config with the hardcoded redirect URI
+        # Flows hold per-login state, so only the configuration is shared
         flow = Flow.from_client_config(
-            client_config,
+            get_oauth_client_config(),
             scopes=SCOPES,
-            redirect_uri=hardcoded_redirect_uri
+            redirect_uri=REDIRECT_URI
         )
         # Explicitly set the redirect_uri to ensure it's correct
-        flow.redirect_uri = hardcoded_redirect_uri
+        flow.redirect_uri = REDIRECT_URI
+        # Exchange tokens over the shared connection pool
+        flow.oauth2session.mount("https://", get_http_session().get_adapter("https://"))
         return flow
     except Exception as e:
         st.error(f"Failed to create OAuth flow: {str(e)}")
@@ -231,7 +223,7 @@ def validate_oauth_callback(callback_url, state):
         store_user_info(user_info)
         
         # Create a session
-        session_token = create_session(email)
+        session_token = create_session(email, user_info)
         
         return {
             "email": email,
@@ -245,15 +237,69 @@ def validate_oauth_callback(callback_url, state):
         st.write(f"Debug - Error details: {type(e).__name__}: {str(e)}")
         return None
 
+def _get_google_certs(refresh=False):
+    """Get Google's ID token signing certificates, cached for as long as Google allows."""
+    global _google_certs, _google_certs_expiry
+    with _google_certs_lock:
+        if refresh or _google_certs is None or time.time() >= _google_certs_expiry:
+            response = get_http_session().get(GOOGLE_CERTS_URI, timeout=GOOGLE_HTTP_TIMEOUT)
+            response.raise_for_status()
+            max_age = GOOGLE_CERTS_TTL
+            for directive in response.headers.get("Cache-Control", "").split(","):
+                name, _, value = directive.strip().partition("=")
+                if name == "max-age" and value.isdigit():
+                    max_age = int(value)
+            _google_certs = response.json()
+            _google_certs_expiry = time.time() + max_age
+        return _google_certs
+
+def _verify_id_token(token):
+    """Verify a Google ID token and return its claims."""
+    try:
+        claims = jwt.decode(token, certs=_get_google_certs(), audience=CLIENT_ID, clock_skew_in_seconds=10)
+    except ValueError:
+        # Google may have rotated its keys since the certificates were cached
+        claims = jwt.decode(token, certs=_get_google_certs(refresh=True), audience=CLIENT_ID, clock_skew_in_seconds=10)
+    if claims.get("iss") not in GOOGLE_ISSUERS:
+        raise ValueError(f"Wrong ID token issuer: {claims.get('iss')}")
+    return claims
+
 def get_user_info(credentials):
-    """Get user information from Google API."""
+    """
+    Get user information for the signed-in user.
+    
+    Read from the ID token returned with the access token when possible, so
+    no further request is needed; otherwise fetched from the userinfo endpoint.
+    """
+    if credentials.id_token:
+        try:
+            claims = _verify_id_token(credentials.id_token)
+            if claims.get("email"):
+                return {
+                    "id": claims.get("sub"),
+                    "email": claims["email"],
+                    "verified_email": claims.get("email_verified", False),
+                    "name": claims.get("name", ""),
+                    "given_name": claims.get("given_name", ""),
+                    "family_name": claims.get("family_name", ""),
+                    "picture": claims.get("picture", ""),
+                    "locale": claims.get("locale", "")
+                }
+        except Exception as e:
+            print(f"Could not read user info from ID token, using userinfo endpoint: {str(e)}")
+    
     try:
-        # Build the service
-        service = build('oauth2', 'v2', credentials=credentials)
-        
-        # Get user info
-        user_info = service.userinfo().get().execute()
-        return user_info
+        # Call the endpoint directly over the shared session
+        request = google.auth.transport.requests.Request(session=get_http_session())
+        if not credentials.valid:
+            credentials.refresh(request)
+        response = get_http_session().get(
+            GOOGLE_USERINFO_URI,
+            headers={"Authorization": f"Bearer {credentials.token}"},
+            timeout=GOOGLE_HTTP_TIMEOUT
+        )
+        response.raise_for_status()
+        return response.json()
     except Exception as e:
         st.error(f"Error getting user info: {str(e)}")
         return None
@@ -300,10 +346,10 @@ def store_user_info(user_info):
     except Exception as e:
         st.error(f"Error storing user info: {str(e)}")
     finally:
-        conn.close()
+        release_db_connection(conn)
 
-def create_session(email):
-    """Create a new session for a user."""
+def create_session(email, user_info=None):
+    """Create a new session for a user (a signed token when SESSION_SIGNING_KEY is set)."""
     conn = get_db_connection()
     if conn is None:
         return None
@@ -317,8 +363,8 @@ def create_session(email):
     
     try:
         with conn.cursor() as cur:
-            # Delete any existing sessions for this user
-            cur.execute('DELETE FROM google_sessions WHERE email = %s', (email,))
+            # Make room for the new session within the per-user cap
+            enforce_session_cap(cur, "google_sessions", email)
             
             # Create new session
             cur.execute('''
@@ -326,18 +372,35 @@ def create_session(email):
                 VALUES (%s, %s, %s)
             ''', (email, token, expires_at))
             conn.commit()
-            return token
+        
+        # Sessions over the cap are gone, so drop them from the cache too
+        get_session_cache().invalidate_user(email)
+        
+        if signing_enabled():
+            user_info = user_info or {}
+            return issue_signed_token(token, {
+                "email": email,
+                "name": user_info.get("name", ""),
+                "picture": user_info.get("picture", ""),
+                "is_admin": email in ADMIN_EMAILS
+            }, expires_at)
+        return token
     except Exception as e:
         st.error(f"Error creating session: {str(e)}")
         return None
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def validate_session(token):
     """Validate a session token and return user info if valid."""
     if not token:
         return False, None
     
+    # Signed tokens and recently validated sessions need no database round trip
+    user_info = read_signed_token(token) or get_session_cache().get(token)
+    if user_info:
+        return True, user_info
+    
     conn = get_db_connection()
     if conn is None:
         return False, None
@@ -350,7 +413,7 @@ def validate_session(token):
                 FROM google_sessions s
                 JOIN google_users u ON s.email = u.email
                 WHERE s.token = %s
-            ''', (token,))
+            ''', (session_id_of(token),))
             
             result = cur.fetchone()
             if not result:
@@ -362,42 +425,46 @@ def validate_session(token):
             from datetime import datetime
             if expires_at < datetime.utcnow():
                 # Delete expired session
-                cur.execute('DELETE FROM google_sessions WHERE token = %s', (token,))
+                cur.execute('DELETE FROM google_sessions WHERE token = %s', (session_id_of(token),))
                 conn.commit()
                 return False, None
             
             # Return user info
-            return True, {
+            user_info = {
                 "email": email,
                 "name": name,
                 "picture": picture,
                 "is_admin": is_admin
             }
+            get_session_cache().put(token, email, user_info, expires_at)
+            return True, user_info
     except Exception as e:
         st.error(f"Error validating session: {str(e)}")
         return False, None
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def end_session(token):
     """End a session."""
     if not token:
         return False
     
+    get_session_cache().invalidate(token)
+    
     conn = get_db_connection()
     if conn is None:
         return False
     
     try:
         with conn.cursor() as cur:
-            cur.execute('DELETE FROM google_sessions WHERE token = %s', (token,))
+            cur.execute('DELETE FROM google_sessions WHERE token = %s', (session_id_of(token),))
             conn.commit()
             return True
     except Exception as e:
         st.error(f"Error ending session: {str(e)}")
         return False
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def check_login():
     """
@@ -416,9 +483,12 @@ def check_login():
             }
         return  # Skip the rest of the auth flow
     
-    # Initialize auth tables in DB
+    # Create auth tables in DB (a no-op after the first run in this process)
     init_auth_tables()
     
+    # Expired sessions are deleted in the background
+    start_session_sweeper()
+    
     # Initialize session state variables if they don't exist
     if "user" not in st.session_state:
         st.session_state.user = None
@@ -579,9 +649,10 @@ def show_login_page():
 
 def logout_user():
     """Log out the current user by clearing the session state and ending the session."""
+    token = None
     if "user" in st.session_state and st.session_state.user:
-        if "token" in st.session_state.user:
-            end_session(st.session_state.user["token"])
+        token = st.session_state.user.get("token")
+    end_session(token or st.session_state.get("google_session_token"))
     
     # Clear session state
     st.session_state.user = None
@@ -0,0 +1,264 @@
+"""
+Rolling summary memory for AI Chat Studio conversations
+
+Long conversations are not re-sent whole. Older turns are folded into a
+running summary stored with the conversation, and each request sends that
+summary plus the most recent turns. Summaries are updated incrementally on a
+background thread once a conversation nears the limit, so they never delay
+the user's answer and short chats never pay for a summarizer call.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set
+
+from utils.database import load_conversation_summary, save_conversation_summary
+
+# Optional exact tokenizer; without it tokens are estimated from length
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Histories up to this many (estimated) tokens are sent unchanged
+TOKEN_LIMIT = 3000
+
+# Summaries are prepared once a history reaches this many tokens, so one is
+# ready by the time TOKEN_LIMIT is crossed
+SUMMARIZE_FROM_TOKENS = TOKEN_LIMIT * 3 // 4
+
+# Number of most recent messages always sent verbatim
+RECENT_MESSAGES = 6
+
+# Don't call the summarizer for fewer than this many new tokens
+MIN_TOKENS_TO_SUMMARIZE = 400
+
+# Model used to write summaries
+SUMMARY_MODEL = "gemini-1.5-flash"
+
+# Maximum length of a summary in characters
+MAX_SUMMARY_CHARS = 4000
+
+# Conversations summarized at the same time (one slow summarizer call doesn't
+# hold up other users)
+SUMMARY_WORKERS = 4
+
+_summary_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="chat-summary")
+
+# (username, chat_id) -> {"summary": str, "summarized_count": int}
+_summaries: Dict[tuple, Dict[str, Any]] = {}
+# Conversations with an update queued, and the latest messages to summarize
+_pending: Dict[tuple, List[Dict[str, Any]]] = {}
+# Conversations with a worker queued or running; each conversation has at most
+# one, which keeps its updates strictly ordered
+_active: Set[tuple] = set()
+_lock = threading.Lock()
+
+# tiktoken encoding, loaded on first use (None if unavailable)
+_encoding = None
+_encoding_failed = False
+
+
+def message_text(message: Dict[str, Any]) -> str:
+    """Get the text of a message, ignoring image and audio parts"""
+    content = message.get("content", "")
+    if isinstance(content, list):
+        return "\n".join(part for part in content if isinstance(part, str))
+    return content or ""
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in a text
+
+    Uses tiktoken when installed, otherwise ~4 characters per token.
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        Estimated token count
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def _get_encoding():
+    """Load the tiktoken encoding once; None if tiktoken can't be used"""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"tiktoken unavailable, estimating tokens from length: {e}")
+            _encoding_failed = True
+    return _encoding
+
+
+def _history_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(estimate_tokens(message_text(message)) for message in messages)
+
+
+def _fold_boundary(messages: List[Dict[str, Any]]) -> int:
+    """
+    Index of the first message kept verbatim
+
+    The boundary falls on a user message so the remaining history still
+    alternates user/assistant after the summary pair.
+    """
+    boundary = max(len(messages) - RECENT_MESSAGES, 0)
+    while boundary > 0 and messages[boundary]["role"] != "user":
+        boundary -= 1
+    return boundary
+
+
+def get_summary(username: str, chat_id: Any, db_type: str) -> Dict[str, Any]:
+    """
+    Get the stored summary of a conversation
+
+    Args:
+        username: The user's username
+        chat_id: Conversation ID
+        db_type: "postgresql" or "json"
+
+    Returns:
+        Dictionary with "summary" and "summarized_count"
+    """
+    empty = {"summary": "", "summarized_count": 0}
+    if chat_id is None:
+        return empty
+
+    key = (username, str(chat_id))
+    with _lock:
+        if key in _summaries:
+            return dict(_summaries[key])
+
+    state = load_conversation_summary(username, chat_id, db_type) or empty
+    with _lock:
+        _summaries.setdefault(key, state)
+        return dict(_summaries[key])
+
+
+def build_memory_history(messages: List[Dict[str, Any]], summary_state: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Build the history sent to a model from the summary and the unsummarized turns
+
+    Args:
+        messages: Full conversation history, ending with the current prompt
+        summary_state: Result of get_summary
+
+    Returns:
+        The full history if it fits in TOKEN_LIMIT, otherwise a summary
+        exchange followed by every message not yet covered by the summary
+    """
+    summary = summary_state.get("summary", "")
+    summarized_count = summary_state.get("summarized_count", 0)
+
+    if not summary or summarized_count <= 0 or summarized_count >= len(messages):
+        return messages
+    if _history_tokens(messages) <= TOKEN_LIMIT:
+        return messages
+
+    return [
+        {"role": "user", "content": f"Summary of our conversation so far:\n{summary}"},
+        {"role": "assistant", "content": "Thanks, I have the context of our earlier conversation."},
+    ] + list(messages[summarized_count:])
+
+
+def _summarize(previous_summary: str, messages: List[Dict[str, Any]]) -> str:
+    """Fold messages into the previous summary with an LLM, or extractively as a fallback"""
+    transcript = "\n".join(
+        f"{message['role'].title()}: {message_text(message)}" for message in messages
+    )
+
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if api_key:
+        try:
+            import google.generativeai as genai
+
+            genai.configure(api_key=api_key)
+            model = genai.GenerativeModel(SUMMARY_MODEL, generation_config={"temperature": 0.2})
+            prompt = (
+                "Update the running summary of a conversation between a user and an AI assistant. "
+                "Keep facts, decisions, names, numbers and open questions; drop pleasantries. "
+                f"Answer with the updated summary only, at most {MAX_SUMMARY_CHARS // 5} words.\n\n"
+                f"Current summary:\n{previous_summary or '(none)'}\n\n"
+                f"New messages:\n{transcript}"
+            )
+            return model.generate_content(prompt).text.strip()[:MAX_SUMMARY_CHARS]
+        except Exception as e:
+            print(f"Error generating conversation summary, using extractive fallback: {e}")
+
+    # Extractive fallback: keep the opening of each message
+    lines = [previous_summary] if previous_summary else []
+    for message in messages:
+        text = " ".join(message_text(message).split())
+        lines.append(f"{message['role'].title()}: {text[:200]}")
+    return "\n".join(lines)[-MAX_SUMMARY_CHARS:]
+
+
+def _update_summary(key: tuple, db_type: str) -> None:
+    """Worker: fold newly aged-out messages of a conversation into its summary"""
+    try:
+        while True:
+            with _lock:
+                messages = _pending.pop(key, None)
+                if messages is None:
+                    _active.discard(key)
+                    return
+            _fold_messages(key, messages, db_type)
+    except Exception:
+        with _lock:
+            _pending.pop(key, None)
+            _active.discard(key)
+        raise
+
+
+def _fold_messages(key: tuple, messages: List[Dict[str, Any]], db_type: str) -> None:
+    """Fold the aged-out part of messages into the conversation's summary"""
+    username, chat_id = key
+    state = get_summary(username, chat_id, db_type)
+    boundary = _fold_boundary(messages)
+    new_messages = messages[state["summarized_count"]:boundary]
+    if not new_messages or _history_tokens(new_messages) < MIN_TOKENS_TO_SUMMARIZE:
+        return
+
+    summary = _summarize(state["summary"], new_messages)
+    new_state = {"summary": summary, "summarized_count": boundary}
+    with _lock:
+        _summaries[key] = new_state
+    save_conversation_summary(username, chat_id, summary, boundary, db_type)
+
+
+def schedule_summary_update(username: str, chat_id: Any, messages: List[Dict[str, Any]], db_type: str) -> None:
+    """
+    Queue a background summary update after a turn
+
+    Nothing is queued while the history is under SUMMARIZE_FROM_TOKENS.
+    Repeated calls for the same conversation before its worker gets to them
+    are coalesced; only the latest messages are summarized.
+
+    Args:
+        username: The user's username
+        chat_id: Conversation ID
+        messages: Full conversation history
+        db_type: "postgresql" or "json"
+    """
+    if chat_id is None:
+        return
+
+    snapshot = [{"role": m["role"], "content": message_text(m)} for m in messages]
+    if _history_tokens(snapshot) < SUMMARIZE_FROM_TOKENS:
+        return
+
+    key = (username, str(chat_id))
+    with _lock:
+        _pending[key] = snapshot
+        if key in _active:
+            return
+        _active.add(key)
+
+    future = _summary_executor.submit(_update_summary, key, db_type)
+    future.add_done_callback(lambda f: f.exception() and print(f"Error updating conversation summary: {f.exception()}"))
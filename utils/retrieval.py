@@ -0,0 +1,479 @@
+"""
+Local retrieval index for AI Chat Studio
+
+Keeps a persistent vector store per user under data/vector_store/ holding chat
+messages and uploaded document chunks. New items are upserted incrementally
+(vectors are appended to a float32 file and records to a JSONL log), and the
+chat path asks for the top-k most relevant items instead of re-sending whole
+histories.
+"""
+import os
+import re
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from utils.embeddings import TASK_QUERY, embed_texts, get_embedding_model_name
+
+# Root directory for per-user vector stores
+VECTOR_STORE_DIR = "data/vector_store"
+
+# Number of results returned by default
+DEFAULT_TOP_K = 4
+
+# Results below this cosine similarity are not considered relevant
+MIN_SCORE = 0.2
+
+# Rewrite the store once this fraction of rows has been superseded
+COMPACT_RATIO = 0.5
+
+# Metadata fields kept in an inverted index for where/exclude filters
+INDEXED_FIELDS = ("source", "document", "chat_id")
+
+# Background indexing so saving a reply never waits on embeddings
+_index_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="retrieval-index")
+
+_stores: Dict[str, "VectorStore"] = {}
+_stores_lock = threading.Lock()
+
+
+class VectorStore:
+    """
+    Append-only on-disk vector store with an in-memory index
+
+    Files in the store directory:
+        vectors.f32   - float32 rows, appended on every upsert
+        records.jsonl - one record (id, text, metadata) per vector row
+        meta.json     - embedding model and dimension of the vectors
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.model_name = get_embedding_model_name()
+        self.dim: Optional[int] = None
+        self._lock = threading.RLock()
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._live = np.zeros(0, dtype=bool)
+        self._size = 0
+        self._records: List[Optional[Dict[str, Any]]] = []
+        self._id_to_row: Dict[str, int] = {}
+        # (field, value) -> rows of live records with that metadata value
+        self._postings: Dict[Tuple[str, Any], Set[int]] = {}
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    @property
+    def _records_path(self) -> str:
+        return os.path.join(self.path, "records.jsonl")
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.path, "meta.json")
+
+    def _load(self):
+        """Load the store from disk, discarding it if it was built with another model"""
+        try:
+            with open(self._meta_path, "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if meta.get("model") != self.model_name:
+            print(f"Embedding model changed ({meta.get('model')} -> {self.model_name}), rebuilding {self.path}")
+            self._reset_files()
+            return
+
+        try:
+            self.dim = int(meta["dim"])
+            vectors = np.fromfile(self._vectors_path, dtype=np.float32).reshape(-1, self.dim)
+            with open(self._records_path, "r", encoding="utf-8") as f:
+                records = [json.loads(line) for line in f if line.strip()]
+        except Exception as e:
+            print(f"Could not load vector store {self.path}: {e}")
+            self._reset_files()
+            return
+
+        # A crash between the two appends can leave them out of step; keep the common prefix
+        count = min(len(vectors), len(records))
+        self._vectors = np.array(vectors[:count], dtype=np.float32)
+        self._size = count
+        self._records = records[:count]
+        for row, record in enumerate(self._records):
+            previous = self._id_to_row.get(record["id"])
+            if previous is not None:
+                self._records[previous] = None
+            self._id_to_row[record["id"]] = row
+        self._rebuild_index()
+
+    def _reset_files(self):
+        """Remove all store files"""
+        for path in (self._vectors_path, self._records_path, self._meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.dim = None
+
+    def _rebuild_index(self):
+        """Recompute the live-row mask and metadata postings from the records"""
+        self._live = np.fromiter((record is not None for record in self._records), dtype=bool, count=len(self._records))
+        self._postings = {}
+        for row, record in enumerate(self._records):
+            if record is not None:
+                self._index_row(row, record)
+
+    def _index_row(self, row: int, record: Dict[str, Any]):
+        """Add a live record to the metadata postings (caller holds the lock)"""
+        metadata = record.get("metadata", {})
+        for field in INDEXED_FIELDS:
+            if field in metadata:
+                self._postings.setdefault((field, metadata[field]), set()).add(row)
+
+    def _drop_row(self, row: int):
+        """Mark a row superseded and remove it from the postings (caller holds the lock)"""
+        metadata = self._records[row].get("metadata", {})
+        for field in INDEXED_FIELDS:
+            rows = self._postings.get((field, metadata.get(field)))
+            if rows is not None:
+                rows.discard(row)
+                if not rows:
+                    del self._postings[(field, metadata.get(field))]
+        self._records[row] = None
+        self._live[row] = False
+
+    def _ensure_capacity(self, extra: int):
+        """Grow the in-memory matrix geometrically"""
+        needed = self._size + extra
+        if needed <= len(self._vectors):
+            return
+        capacity = max(needed, 2 * len(self._vectors), 64)
+        grown = np.zeros((capacity, self.dim), dtype=np.float32)
+        grown[:self._size] = self._vectors[:self._size]
+        self._vectors = grown
+        live = np.zeros(capacity, dtype=bool)
+        live[:self._size] = self._live[:self._size]
+        self._live = live
+
+    def upsert(self, items: List[Dict[str, Any]]) -> int:
+        """
+        Insert or replace items
+
+        Args:
+            items: Dictionaries with "id", "text" and optional "metadata"
+
+        Returns:
+            Number of items written
+        """
+        with self._lock:
+            # Skip items whose text is unchanged
+            pending = []
+            for item in items:
+                row = self._id_to_row.get(item["id"])
+                if row is not None and self._records[row]["text"] == item["text"]:
+                    continue
+                if item["text"].strip():
+                    pending.append(item)
+            if not pending:
+                return 0
+
+        vectors = embed_texts([item["text"] for item in pending])
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self._meta_path, "w") as f:
+                    json.dump({"model": self.model_name, "dim": self.dim}, f)
+                self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+
+            self._ensure_capacity(len(pending))
+            records = []
+            for offset, item in enumerate(pending):
+                row = self._size + offset
+                previous = self._id_to_row.get(item["id"])
+                if previous is not None:
+                    self._drop_row(previous)
+                record = {"id": item["id"], "text": item["text"], "metadata": item.get("metadata", {})}
+                self._records.append(record)
+                self._id_to_row[item["id"]] = row
+                self._live[row] = True
+                self._index_row(row, record)
+                records.append(record)
+            self._vectors[self._size:self._size + len(pending)] = vectors
+            self._size += len(pending)
+
+            # Append-only persistence: vectors first, then the records that describe them
+            with open(self._vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            with open(self._records_path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+
+            if self._size and len(self._id_to_row) / self._size < 1 - COMPACT_RATIO:
+                self._compact()
+
+        return len(pending)
+
+    def ids(self, prefix: str = "") -> List[str]:
+        """IDs of the live items starting with a prefix"""
+        with self._lock:
+            return [item_id for item_id in self._id_to_row if item_id.startswith(prefix)]
+
+    def delete(self, ids: List[str]) -> int:
+        """
+        Remove items
+
+        The store is append-only, so removals are persisted by compacting it.
+
+        Args:
+            ids: IDs of the items to remove
+
+        Returns:
+            Number of items removed
+        """
+        with self._lock:
+            removed = 0
+            for item_id in ids:
+                row = self._id_to_row.pop(item_id, None)
+                if row is not None:
+                    self._drop_row(row)
+                    removed += 1
+            if removed:
+                self._compact()
+            return removed
+
+    def _compact(self):
+        """Rewrite the store without superseded rows"""
+        live_rows = [row for row in range(self._size) if self._records[row] is not None]
+        vectors = self._vectors[live_rows]
+        records = [self._records[row] for row in live_rows]
+
+        vectors_tmp = self._vectors_path + ".tmp"
+        records_tmp = self._records_path + ".tmp"
+        vectors.tofile(vectors_tmp)
+        with open(records_tmp, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        os.replace(vectors_tmp, self._vectors_path)
+        os.replace(records_tmp, self._records_path)
+
+        self._vectors = np.array(vectors, dtype=np.float32)
+        self._size = len(records)
+        self._records = records
+        self._id_to_row = {record["id"]: row for row, record in enumerate(records)}
+        self._rebuild_index()
+
+    def _filter_mask(self, where: Optional[Dict[str, Any]], exclude: Optional[Dict[str, Any]]) -> np.ndarray:
+        """Rows of live records matching the metadata filters (caller holds the lock)"""
+        mask = self._live[:self._size].copy()
+        for key, value in (where or {}).items():
+            if key in INDEXED_FIELDS:
+                matching = np.zeros(self._size, dtype=bool)
+                matching[self._rows_with(key, value)] = True
+                mask &= matching
+            else:
+                for row in np.flatnonzero(mask):
+                    if self._records[row]["metadata"].get(key) != value:
+                        mask[row] = False
+        for key, value in (exclude or {}).items():
+            if key in INDEXED_FIELDS:
+                mask[self._rows_with(key, value)] = False
+            else:
+                for row in np.flatnonzero(mask):
+                    if self._records[row]["metadata"].get(key) == value:
+                        mask[row] = False
+        return mask
+
+    def _rows_with(self, field: str, value: Any) -> np.ndarray:
+        """Rows whose indexed metadata field has a value (caller holds the lock)"""
+        rows = self._postings.get((field, value), ())
+        return np.fromiter(rows, dtype=np.intp, count=len(rows))
+
+    def search(
+        self,
+        query: str,
+        k: int = DEFAULT_TOP_K,
+        where: Optional[Dict[str, Any]] = None,
+        exclude: Optional[Dict[str, Any]] = None,
+        min_score: float = MIN_SCORE
+    ) -> List[Dict[str, Any]]:
+        """
+        Find the items most similar to a query
+
+        Args:
+            query: Query text
+            k: Maximum number of results
+            where: Metadata values that results must match
+            exclude: Metadata values that results must not match
+            min_score: Minimum cosine similarity
+
+        Returns:
+            Records with an added "score", best first
+        """
+        if not query.strip():
+            return []
+        with self._lock:
+            if not self._size or not self._filter_mask(where, exclude).any():
+                return []
+
+        # Embed outside the lock so upserts and other searches don't wait on the model
+        query_vector = embed_texts([query], TASK_QUERY)[0]
+
+        with self._lock:
+            mask = self._filter_mask(where, exclude)
+            if not mask.any() or query_vector.shape[0] != self.dim:
+                return []
+
+            scores = self._vectors[:self._size] @ query_vector
+            scores[~mask] = -np.inf
+
+            k = min(k, int(mask.sum()))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            return [
+                {**self._records[row], "score": float(scores[row])}
+                for row in top
+                if scores[row] >= min_score
+            ]
+
+
+def _store_dir(username: str) -> str:
+    """Filesystem-safe store directory for a user"""
+    safe_name = re.sub(r"[^A-Za-z0-9_.@-]", "_", username or "anonymous")
+    return os.path.join(VECTOR_STORE_DIR, safe_name)
+
+
+def get_vector_store(username: str) -> VectorStore:
+    """
+    Get the process-wide vector store for a user
+
+    Args:
+        username: The user's username or email
+
+    Returns:
+        The user's VectorStore
+    """
+    path = _store_dir(username)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = VectorStore(path)
+        return _stores[path]
+
+
+def index_messages(username: str, chat_id: Any, messages: List[Dict[str, Any]], start: int = 0) -> int:
+    """
+    Upsert chat messages into the user's store
+
+    Args:
+        username: The user's username
+        chat_id: Conversation the messages belong to
+        messages: Conversation messages
+        start: Index of the first message that still needs indexing
+
+    Returns:
+        Number of messages written
+    """
+    items = []
+    for index, message in enumerate(messages[start:], start=start):
+        if not isinstance(message.get("content"), str):
+            continue
+        items.append({
+            "id": f"msg:{chat_id}:{index}",
+            "text": message["content"],
+            "metadata": {"source": "chat", "chat_id": str(chat_id), "role": message["role"], "index": index}
+        })
+    return get_vector_store(username).upsert(items)
+
+
+def index_messages_async(username: str, chat_id: Any, messages: List[Dict[str, Any]], start: int = 0):
+    """Index chat messages on a background thread"""
+    snapshot = [dict(message) for message in messages]
+    future = _index_executor.submit(index_messages, username, chat_id, snapshot, start)
+    future.add_done_callback(lambda f: f.exception() and print(f"Error indexing messages: {f.exception()}"))
+    return future
+
+
+def index_document(username: str, document: Dict[str, Any]) -> int:
+    """
+    Upsert the chunks of an ingested document into the user's store
+
+    Chunks left over from an earlier, longer upload with the same name are
+    removed.
+
+    Args:
+        username: The user's username
+        document: Result of utils.documents.ingest_document
+
+    Returns:
+        Number of chunks written
+    """
+    store = get_vector_store(username)
+    items = [
+        {
+            "id": f"doc:{document['name']}:{chunk['index']}",
+            "text": chunk["text"],
+            "metadata": {"source": "document", "document": document["name"], "page": chunk["page"], "index": chunk["index"]}
+        }
+        for chunk in document.get("chunks", [])
+    ]
+    current_ids = {item["id"] for item in items}
+    store.delete([item_id for item_id in store.ids(f"doc:{document['name']}:") if item_id not in current_ids])
+    return store.upsert(items)
+
+
+def retrieve_context(
+    username: str,
+    query: str,
+    k: int = DEFAULT_TOP_K,
+    where: Optional[Dict[str, Any]] = None,
+    exclude: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Retrieve the stored items most relevant to a query
+
+    Args:
+        username: The user's username
+        query: Query text
+        k: Maximum number of results
+        where: Metadata values that results must match
+        exclude: Metadata values that results must not match
+
+    Returns:
+        Matching records with scores, best first (empty on error)
+    """
+    try:
+        return get_vector_store(username).search(query, k=k, where=where, exclude=exclude)
+    except Exception as e:
+        print(f"Error retrieving context: {e}")
+        return []
+
+
+def format_context(results: List[Dict[str, Any]], max_chars: int = 4000) -> str:
+    """
+    Format retrieved items as a context block for a prompt
+
+    Args:
+        results: Records returned by retrieve_context
+        max_chars: Maximum length of the context block
+
+    Returns:
+        Context text, or an empty string if there is nothing relevant
+    """
+    lines, total = [], 0
+    for result in results:
+        metadata = result.get("metadata", {})
+        if metadata.get("source") == "document":
+            label = f"{metadata.get('document')} (page {metadata.get('page')})"
+        else:
+            label = f"earlier {metadata.get('role', 'message')}"
+        line = f"- [{label}] {result['text']}"
+        if total + len(line) > max_chars:
+            break
+        lines.append(line)
+        total += len(line)
+    return "\n".join(lines)
@@ -0,0 +1,197 @@
+"""
+Database schema bootstrap
+
+All tables, columns and indexes are created here, once per process, before
+the first query. Page loads and logins do no DDL. Schema changes are an
+ordered list of migrations, and the number applied is recorded in
+schema_version, so a started process with an up-to-date database runs one
+SELECT, without taking the advisory lock or issuing any DDL. Only when
+migrations are pending is the lock taken: several server processes can start
+at once, and the lock ensures only one of them migrates while the others wait
+and then find nothing left to do.
+"""
+import threading
+from typing import Callable, List, Optional, Set
+
+import psycopg2
+import psycopg2.errors
+
+# Advisory lock key held while migrating (any constant shared by all processes)
+SCHEMA_LOCK_KEY = 4_210_873_501
+
+
+def _create_conversations(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS conversations (
+            id SERIAL PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            model TEXT NOT NULL,
+            timestamp TIMESTAMP NOT NULL,
+            last_updated TIMESTAMP NOT NULL,
+            messages JSONB NOT NULL
+        )
+    """)
+    # Tables created before last_updated existed
+    cur.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_updated TIMESTAMP")
+    cur.execute("UPDATE conversations SET last_updated = timestamp WHERE last_updated IS NULL")
+
+
+def _add_conversation_summary(cur):
+    # Rolling summary of older turns (see utils/memory.py)
+    cur.execute("""
+        ALTER TABLE conversations
+        ADD COLUMN IF NOT EXISTS summary TEXT,
+        ADD COLUMN IF NOT EXISTS summary_upto INTEGER NOT NULL DEFAULT 0
+    """)
+
+
+def _create_google_auth_tables(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS google_users (
+            id SERIAL PRIMARY KEY,
+            email VARCHAR(255) UNIQUE NOT NULL,
+            name VARCHAR(255),
+            picture TEXT,
+            is_admin BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS google_sessions (
+            id SERIAL PRIMARY KEY,
+            email VARCHAR(255) NOT NULL,
+            token VARCHAR(255) UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL,
+            FOREIGN KEY (email) REFERENCES google_users(email) ON DELETE CASCADE
+        )
+    """)
+
+
+def _create_password_auth_tables(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(100) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            email VARCHAR(255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_admin BOOLEAN DEFAULT FALSE
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id),
+            session_token VARCHAR(255) UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL
+        )
+    """)
+
+
+def _index_session_tables(cur):
+    from utils.session_store import ensure_session_indexes
+    ensure_session_indexes(cur, "google_sessions")
+    ensure_session_indexes(cur, "sessions")
+
+
+# Migrations in the order they are applied; only ever append to this list.
+# Each must be safe on databases created before schema_version existed.
+MIGRATIONS: List[Callable] = [
+    _create_conversations,
+    _add_conversation_summary,
+    _create_google_auth_tables,
+    _create_password_auth_tables,
+    _index_session_tables,
+]
+
+# Database URLs whose schema is up to date in this process
+_ready: Set[str] = set()
+_ready_lock = threading.Lock()
+
+
+def _read_version(conn) -> int:
+    """Applied schema version, read without locking (0 if schema_version doesn't exist yet)"""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT version FROM schema_version")
+            row = cur.fetchone()
+        conn.commit()
+        return row[0] if row else 0
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        return 0
+
+
+def _applied_version(cur) -> int:
+    cur.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    cur.execute("SELECT version FROM schema_version")
+    row = cur.fetchone()
+    if row is None:
+        cur.execute("INSERT INTO schema_version (version) VALUES (0)")
+        return 0
+    return row[0]
+
+
+def migrate(conn) -> int:
+    """
+    Apply pending migrations under the advisory lock
+
+    Args:
+        conn: Open connection (not in autocommit mode)
+
+    Returns:
+        Number of migrations applied
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_LOCK_KEY,))
+    try:
+        with conn.cursor() as cur:
+            version = _applied_version(cur)
+            for migration in MIGRATIONS[version:]:
+                migration(cur)
+            if version < len(MIGRATIONS):
+                cur.execute("UPDATE schema_version SET version = %s", (len(MIGRATIONS),))
+        conn.commit()
+        return max(0, len(MIGRATIONS) - version)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_LOCK_KEY,))
+        conn.commit()
+
+
+def ensure_schema(db_url: Optional[str]) -> bool:
+    """
+    Bring a database's schema up to date, once per process
+
+    Args:
+        db_url: PostgreSQL connection string
+
+    Returns:
+        True if the schema is ready, False if there is no database URL
+
+    Raises:
+        Exception: If the database cannot be reached or a migration failed
+            (the next call tries again)
+    """
+    if not db_url:
+        return False
+    if db_url in _ready:
+        return True
+
+    with _ready_lock:
+        if db_url in _ready:
+            return True
+        conn = psycopg2.connect(db_url)
+        try:
+            applied = migrate(conn) if _read_version(conn) < len(MIGRATIONS) else 0
+        finally:
+            conn.close()
+        if applied:
+            print(f"Database schema: applied {applied} migration(s)")
+        _ready.add(db_url)
+    return True
@@ -0,0 +1,224 @@
+"""
+Fast session validation
+
+Validating a session used to cost a database round trip on every script run.
+This module offers two ways to avoid it:
+- an in-process TTL cache of token -> user, filled on the first database
+  validation and invalidated when a session ends or is replaced
+- optional HMAC-signed tokens (enabled by setting SESSION_SIGNING_KEY) that
+  carry the user's claims and expiry, so they validate without any lookup
+
+Signed tokens wrap the random session ID stored in the database, so sessions
+can still be listed, capped and deleted there. Revocation of signed tokens is
+tracked in memory, which is enough for a single server process.
+"""
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+# Secret for signed session tokens; signed tokens are disabled when unset
+SESSION_SIGNING_KEY = os.environ.get("SESSION_SIGNING_KEY", "")
+
+# How long a database validation is trusted (seconds)
+SESSION_CACHE_TTL = 60
+
+# Maximum number of cached sessions
+SESSION_CACHE_SIZE = 4096
+
+# Prefix identifying signed tokens
+SIGNED_TOKEN_PREFIX = "s1."
+
+
+def _timestamp(expires_at: Any) -> float:
+    """Epoch seconds of a naive UTC datetime, an aware datetime or a number"""
+    if isinstance(expires_at, datetime):
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        return expires_at.timestamp()
+    return float(expires_at)
+
+
+class SessionCache:
+    """Bounded TTL cache of validated sessions"""
+
+    def __init__(self, ttl: float = SESSION_CACHE_TTL, max_entries: int = SESSION_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # token -> (user key, user info, cache expiry)
+        self._entries: "OrderedDict[str, Tuple[str, Dict[str, Any], float]]" = OrderedDict()
+        # Signed session IDs that were ended -> their expiry
+        self._revoked: Dict[str, float] = {}
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a validated session
+
+        Args:
+            token: Session token
+
+        Returns:
+            A copy of the user info, or None if not cached or stale
+        """
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if entry[2] <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return dict(entry[1])
+
+    def put(self, token: str, user_key: str, user_info: Dict[str, Any], expires_at: Any = None) -> None:
+        """
+        Remember a session validated against the database
+
+        Args:
+            token: Session token
+            user_key: Identifies the user (email or user ID) for invalidate_user
+            user_info: User details returned by validation
+            expires_at: Session expiry; the entry never outlives it
+        """
+        cache_expiry = time.time() + self.ttl
+        if expires_at is not None:
+            cache_expiry = min(cache_expiry, _timestamp(expires_at))
+        with self._lock:
+            self._entries[token] = (str(user_key), dict(user_info), cache_expiry)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token: str) -> None:
+        """Forget a session (and revoke it if it is a signed token)"""
+        with self._lock:
+            self._entries.pop(token, None)
+        claims = _decode_signed(token)
+        if claims:
+            self.revoke(claims["sid"], claims["exp"])
+
+    def revoke(self, session_id: str, expires_at: Any) -> None:
+        """
+        Reject signed tokens for a session ID deleted from the database
+
+        Args:
+            session_id: Database session ID wrapped by the tokens
+            expires_at: Session expiry; the revocation is forgotten after it
+        """
+        with self._lock:
+            self._entries.pop(session_id, None)
+            self._revoked[session_id] = _timestamp(expires_at)
+
+    def invalidate_user(self, user_key: str) -> None:
+        """Forget every cached session of a user"""
+        user_key = str(user_key)
+        with self._lock:
+            for token in [token for token, entry in self._entries.items() if entry[0] == user_key]:
+                del self._entries[token]
+
+    def is_revoked(self, session_id: str) -> bool:
+        with self._lock:
+            now = time.time()
+            for sid in [sid for sid, expiry in self._revoked.items() if expiry <= now]:
+                del self._revoked[sid]
+            return session_id in self._revoked
+
+
+_cache: Optional[SessionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_session_cache() -> SessionCache:
+    """Get the process-wide session cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SessionCache()
+        return _cache
+
+
+def signing_enabled() -> bool:
+    """Whether new sessions get signed tokens"""
+    return bool(SESSION_SIGNING_KEY)
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _signature(payload: str) -> str:
+    return _b64encode(hmac.new(SESSION_SIGNING_KEY.encode(), payload.encode(), hashlib.sha256).digest())
+
+
+def issue_signed_token(session_id: str, user_info: Dict[str, Any], expires_at: Any) -> str:
+    """
+    Wrap a session ID and the user's details in a signed token
+
+    Args:
+        session_id: Random session ID stored in the database
+        user_info: User details returned when the token is validated
+        expires_at: Session expiry
+
+    Returns:
+        The signed token
+    """
+    claims = {"sid": session_id, "exp": int(_timestamp(expires_at)), "user": user_info}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{SIGNED_TOKEN_PREFIX}{payload}.{_signature(payload)}"
+
+
+def _decode_signed(token: str) -> Optional[Dict[str, Any]]:
+    """Claims of a signed token with a valid signature, regardless of expiry"""
+    if not SESSION_SIGNING_KEY or not token or not token.startswith(SIGNED_TOKEN_PREFIX):
+        return None
+    try:
+        payload, signature = token[len(SIGNED_TOKEN_PREFIX):].rsplit(".", 1)
+        if not hmac.compare_digest(signature, _signature(payload)):
+            return None
+        return json.loads(_b64decode(payload))
+    except (ValueError, TypeError):
+        return None
+
+
+def read_signed_token(token: str) -> Optional[Dict[str, Any]]:
+    """
+    Validate a signed token without touching the database
+
+    Args:
+        token: Session token
+
+    Returns:
+        The user details, or None if the token is not signed, invalid,
+        expired or revoked
+    """
+    claims = _decode_signed(token)
+    if not claims or claims.get("exp", 0) <= time.time():
+        return None
+    if get_session_cache().is_revoked(claims["sid"]):
+        return None
+    return claims.get("user")
+
+
+def session_id_of(token: str) -> str:
+    """
+    Database session ID behind a token
+
+    Args:
+        token: Signed or plain session token
+
+    Returns:
+        The wrapped session ID for signed tokens, otherwise the token itself
+    """
+    claims = _decode_signed(token)
+    return claims["sid"] if claims else token
@@ -0,0 +1,163 @@
+"""
+Session table maintenance
+
+Both login systems keep sessions in PostgreSQL (google_sessions for Google
+OAuth, sessions for username/password). This module owns what they share:
+- indexes on expiry and owner, so lookups, sweeps and per-user deletes stay
+  O(log n) as the tables grow
+- a cap on concurrent sessions per user (the oldest are deleted first, and
+  signed tokens for them are revoked)
+- a background sweeper that deletes expired sessions in small batches, so
+  abandoned sessions do not pile up and no sweep holds locks for long
+"""
+import time
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from utils.database import get_db_url
+from utils.session_cache import get_session_cache
+
+# Session tables: owner column, session ID column and whether expiry times are stored in UTC (else local time)
+SESSION_TABLES: Dict[str, Dict[str, Any]] = {
+    "google_sessions": {"owner": "email", "token": "token", "utc": True},
+    "sessions": {"owner": "user_id", "token": "session_token", "utc": False},
+}
+
+# Concurrent sessions kept per user
+MAX_SESSIONS_PER_USER = 5
+
+# How often expired sessions are swept (seconds)
+SWEEP_INTERVAL = 600
+
+# Rows deleted per sweep statement
+SWEEP_BATCH_SIZE = 500
+
+
+def ensure_session_indexes(cur, table: str) -> None:
+    """
+    Create the indexes a session table needs
+
+    Args:
+        cur: Open cursor
+        table: Session table name
+    """
+    owner = SESSION_TABLES[table]["owner"]
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires_at_idx ON {table} (expires_at)")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_{owner}_created_at_idx ON {table} ({owner}, created_at)")
+
+
+def enforce_session_cap(cur, table: str, owner_value: Any, keep: int = MAX_SESSIONS_PER_USER - 1) -> int:
+    """
+    Delete a user's oldest sessions beyond a limit
+
+    Call before inserting a new session with keep = limit - 1. Signed tokens
+    wrapping the deleted sessions are revoked, since they are otherwise
+    validated without the database.
+
+    Args:
+        cur: Open cursor (the caller commits)
+        table: Session table name
+        owner_value: The user's email or ID
+        keep: Number of newest sessions to keep
+
+    Returns:
+        Number of sessions deleted
+    """
+    spec = SESSION_TABLES[table]
+    owner = spec["owner"]
+    cur.execute(f"""
+        DELETE FROM {table}
+        WHERE {owner} = %s AND id NOT IN (
+            SELECT id FROM {table} WHERE {owner} = %s ORDER BY created_at DESC LIMIT %s
+        )
+        RETURNING {spec["token"]}, expires_at
+    """, (owner_value, owner_value, keep))
+    deleted = cur.fetchall()
+
+    cache = get_session_cache()
+    for session_id, expires_at in deleted:
+        # Local-time expiries are made aware; naive ones are read as UTC
+        cache.revoke(session_id, expires_at if spec["utc"] else expires_at.astimezone())
+    return len(deleted)
+
+
+def sweep_expired_sessions(conn, batch_size: int = SWEEP_BATCH_SIZE) -> int:
+    """
+    Delete expired sessions from every session table in batches
+
+    Args:
+        conn: Open connection
+        batch_size: Rows deleted per statement (each batch is its own transaction)
+
+    Returns:
+        Number of sessions deleted
+    """
+    deleted = 0
+    for table, spec in SESSION_TABLES.items():
+        now = datetime.utcnow() if spec["utc"] else datetime.now()
+        while True:
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass(%s)", (table,))
+                if cur.fetchone()[0] is None:
+                    break
+                cur.execute(f"""
+                    DELETE FROM {table} WHERE id IN (
+                        SELECT id FROM {table} WHERE expires_at < %s LIMIT %s
+                    )
+                """, (now, batch_size))
+                count = cur.rowcount
+            conn.commit()
+            deleted += count
+            if count < batch_size:
+                break
+    return deleted
+
+
+class SessionSweeper:
+    """Background thread that periodically deletes expired sessions"""
+
+    def __init__(self, interval: float = SWEEP_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="session-sweeper", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop sweeping and wait for the thread to exit"""
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            db_url = get_db_url()
+            if db_url:
+                started = time.time()
+                try:
+                    import psycopg2
+                    conn = psycopg2.connect(db_url)
+                    try:
+                        deleted = sweep_expired_sessions(conn)
+                    finally:
+                        conn.close()
+                    if deleted:
+                        print(f"Session sweeper removed {deleted} expired sessions in {time.time() - started:.2f}s")
+                except Exception as e:
+                    print(f"Error sweeping expired sessions: {e}")
+            self._stop.wait(self.interval)
+
+
+_sweeper: Optional[SessionSweeper] = None
+_sweeper_lock = threading.Lock()
+
+
+def start_session_sweeper() -> SessionSweeper:
+    """Start the process-wide sweeper (once)"""
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = SessionSweeper()
+            _sweeper.start()
+        return _sweeper
@@ -1,8 +1,26 @@
 """
 Color themes for AI Chat Studio
+
+The stylesheet is split in two. The base (the theme rules, written against
+CSS variables, plus the static app styles in assets/styles/app.css) is
+compiled and minified once per process and is byte-for-byte the same on every
+rerun and for every theme, so Streamlit's message cache can send it as a hash
+reference once the browser has it (see global.minCachedMessageSize in
+.streamlit/config.toml). The theme itself is a few hundred bytes of color
+variables sent on each run.
 """
+import os
+import re
+import hashlib
+from functools import lru_cache
 import streamlit as st
 
+# Static (theme-independent) styles shared by the main app
+APP_STYLESHEET_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "assets", "styles", "app.css"
+)
+
 # Available themes
 THEMES = {
     "Default Blue": {
@@ -57,151 +75,225 @@ THEMES = {
     }
 }
 
+# Theme-independent stylesheet; colors come from the variables in THEME_VARIABLES_TEMPLATE
+BASE_CSS = """
+/* Main container styling */
+.main {
+    background-color: var(--theme-background);
+    color: var(--theme-text);
+}
+
+/* Chat container styling */
+.chat-container {
+    border-radius: 8px;
+    padding: 10px;
+    margin-bottom: 10px;
+    max-height: 85vh;
+    overflow-y: auto;
+}
+
+/* Make chat messages more visible and expandable */
+.message-container {
+    margin-bottom: 15px;
+    border-radius: 8px;
+    border: 1px solid #444;
+    overflow-y: auto;
+    max-height: 600px;
+}
+
+/* User message styling */
+.user-message {
+    background-color: var(--theme-message-user-bg);
+    color: var(--theme-text);
+    border-radius: 8px;
+    padding: 15px;
+    margin-bottom: 8px;
+    overflow-wrap: break-word;
+}
+
+/* AI message styling */
+.ai-message {
+    background-color: var(--theme-message-ai-bg);
+    color: var(--theme-text);
+    border-radius: 8px;
+    padding: 15px;
+    margin-bottom: 8px;
+    overflow-wrap: break-word;
+}
+
+/* Sidebar styling */
+.css-1d391kg {
+    background-color: var(--theme-secondary-bg);
+}
+
+/* Input box styling */
+.stChatInputContainer {
+    background-color: var(--theme-secondary-bg);
+    border-radius: 20px;
+    padding: 5px;
+}
+
+/* Improve scrollable areas */
+[data-testid="stVerticalBlock"] {
+    max-height: 100vh;
+}
+
+/* Make chat container fill available height */
+.block-container {
+    max-width: 100%;
+    padding-top: 2rem;
+    padding-bottom: 1rem;
+}
+
+/* Style expandable message containers */
+.expandable-container {
+    border: 1px solid #444;
+    border-radius: 8px;
+    margin-bottom: 12px;
+}
+
+.expandable-header {
+    padding: 10px 15px;
+    background-color: var(--theme-secondary-bg);
+    cursor: pointer;
+    border-radius: 8px 8px 0 0;
+    font-weight: 500;
+}
+
+.expandable-content {
+    padding: 15px;
+    border-top: 1px solid #444;
+    max-height: 500px;
+    overflow-y: auto;
+}
+
+/* Button styling */
+.stButton > button {
+    background-color: var(--theme-primary);
+    color: white;
+    border-radius: 4px;
+    border: none;
+    padding: 8px 16px;
+}
+
+/* Dropdown styling */
+.stSelectbox > div > div {
+    background-color: var(--theme-secondary-bg);
+    color: var(--theme-text);
+    border: 1px solid var(--theme-primary);
+    border-radius: 4px;
+}
+
+/* Header styling */
+h1, h2, h3 {
+    color: var(--theme-text);
+}
+
+/* Accent colors for headings */
+.accent-text {
+    color: var(--theme-accent);
+}
+
+/* Basic chat styling - keep it simple but effective */
+.stChatMessage {
+    margin-bottom: 10px;
+}
+
+/* Chat input container */
+.stChatInputContainer {
+    border-top: 1px solid #444;
+    padding-top: 15px;
+}
+"""
+
+# Per-theme rules: the color variables used by BASE_CSS
+THEME_VARIABLES_TEMPLATE = (
+    ":root{{--theme-primary:{primary};--theme-background:{background};--theme-secondary-bg:{secondary_bg};"
+    "--theme-text:{text};--theme-accent:{accent};--theme-header-color:{header_color};"
+    "--theme-message-user-bg:{message_user_bg};--theme-message-ai-bg:{message_ai_bg}}}"
+)
+
+
 def get_theme(theme_name):
     """Get a specific theme by name, defaulting to Default Blue if not found"""
     return THEMES.get(theme_name, THEMES["Default Blue"])
 
+
+def _minify_css(css: str) -> str:
+    """Strip comments and redundant whitespace from a stylesheet"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
+
+
+@lru_cache(maxsize=None)
+def _read_app_stylesheet() -> str:
+    """Read the static app styles from disk (once per process)"""
+    try:
+        with open(APP_STYLESHEET_PATH, "r", encoding="utf-8") as f:
+            return f.read()
+    except Exception as e:
+        print(f"Could not read app stylesheet: {e}")
+        return ""
+
+
+@lru_cache(maxsize=None)
+def _build_base(include_app_styles: bool) -> str:
+    """
+    Compile the theme-independent stylesheet
+    
+    Args:
+        include_app_styles: Whether to append the static app styles
+        
+    Returns:
+        A <style> tag identical for every theme and rerun
+    """
+    css = BASE_CSS
+    if include_app_styles:
+        css += _read_app_stylesheet()
+    css = _minify_css(css)
+    
+    # Content hash identifies the stylesheet so the frontend can tell versions apart
+    digest = hashlib.sha1(css.encode("utf-8")).hexdigest()[:12]
+    return f'<style data-stylesheet="{digest}">{css}</style>'
+
+
+@lru_cache(maxsize=None)
+def _build_theme_rules(theme_name: str) -> str:
+    """
+    Compile the color variables of a theme
+    
+    Args:
+        theme_name: Name of a theme in THEMES
+        
+    Returns:
+        A small <style> tag setting the theme's CSS variables
+    """
+    return f'<style data-theme="{theme_name}">{THEME_VARIABLES_TEMPLATE.format(**THEMES[theme_name])}</style>'
+
+
 def apply_theme(theme_name):
     """Apply a theme to the current session"""
     theme = get_theme(theme_name)
     
-    # Update the theme in session state
-    if "theme" not in st.session_state:
-        st.session_state.theme = theme
-    else:
+    # Only touch session state when the theme actually changes
+    if st.session_state.get("theme") is not theme:
         st.session_state.theme = theme
     
-    # Generate and apply custom CSS
-    css = f"""
-    <style>
-        /* Main container styling */
-        .main {{
-            background-color: {theme["background"]};
-            color: {theme["text"]};
-        }}
-        
-        /* Chat container styling */
-        .chat-container {{
-            border-radius: 8px;
-            padding: 10px;
-            margin-bottom: 10px;
-            max-height: 85vh;
-            overflow-y: auto;
-        }}
-        
-        /* Make chat messages more visible and expandable */
-        .message-container {{
-            margin-bottom: 15px;
-            border-radius: 8px;
-            border: 1px solid #444;
-            overflow-y: auto;
-            max-height: 600px;
-        }}
-        
-        /* User message styling */
-        .user-message {{
-            background-color: {theme["message_user_bg"]};
-            color: {theme["text"]};
-            border-radius: 8px;
-            padding: 15px;
-            margin-bottom: 8px;
-            overflow-wrap: break-word;
-        }}
-        
-        /* AI message styling */
-        .ai-message {{
-            background-color: {theme["message_ai_bg"]};
-            color: {theme["text"]};
-            border-radius: 8px;
-            padding: 15px;
-            margin-bottom: 8px;
-            overflow-wrap: break-word;
-        }}
-        
-        /* Sidebar styling */
-        .css-1d391kg {{
-            background-color: {theme["secondary_bg"]};
-        }}
-        
-        /* Input box styling */
-        .stChatInputContainer {{
-            background-color: {theme["secondary_bg"]};
-            border-radius: 20px;
-            padding: 5px;
-        }}
-        
-        /* Improve scrollable areas */
-        [data-testid="stVerticalBlock"] {{
-            max-height: 100vh;
-        }}
-        
-        /* Make chat container fill available height */
-        .block-container {{
-            max-width: 100%;
-            padding-top: 2rem;
-            padding-bottom: 1rem;
-        }}
-        
-        /* Style expandable message containers */
-        .expandable-container {{
-            border: 1px solid #444;
-            border-radius: 8px;
-            margin-bottom: 12px;
-        }}
-        
-        .expandable-header {{
-            padding: 10px 15px;
-            background-color: {theme["secondary_bg"]};
-            cursor: pointer;
-            border-radius: 8px 8px 0 0;
-            font-weight: 500;
-        }}
-        
-        .expandable-content {{
-            padding: 15px;
-            border-top: 1px solid #444;
-            max-height: 500px;
-            overflow-y: auto;
-        }}
-        
-        /* Button styling */
-        .stButton > button {{
-            background-color: {theme["primary"]};
-            color: white;
-            border-radius: 4px;
-            border: none;
-            padding: 8px 16px;
-        }}
-        
-        /* Dropdown styling */
-        .stSelectbox > div > div {{
-            background-color: {theme["secondary_bg"]};
-            color: {theme["text"]};
-            border: 1px solid {theme["primary"]};
-            border-radius: 4px;
-        }}
-        
-        /* Header styling */
-        h1, h2, h3 {{
-            color: {theme["text"]};
-        }}
-        
-        /* Accent colors for headings */
-        .accent-text {{
-            color: {theme["accent"]};
-        }}
-        
-        /* Basic chat styling - keep it simple but effective */
-        .stChatMessage {{
-            margin-bottom: 10px;
-        }}
-        
-        /* Chat input container */
-        .stChatInputContainer {{
-            border-top: 1px solid #444;
-            padding-top: 15px;
-        }}
-    </style>
+    return _build_base(False) + _build_theme_rules(theme_name if theme_name in THEMES else "Default Blue")
+
+
+def get_app_stylesheet(theme_name: str) -> str:
     """
+    Apply a theme and return it with the static app styles
     
-    return css
\ No newline at end of file
+    Args:
+        theme_name: Name of the theme
+        
+    Returns:
+        The shared base <style> tag followed by the theme's variables
+    """
+    apply_theme(theme_name)
+    return _build_base(True) + _build_theme_rules(theme_name if theme_name in THEMES else "Default Blue")
@@ -0,0 +1,293 @@
+"""
+Batch transcription of uploaded and recorded audio
+
+Clips are decoded to 16 kHz mono and split at the quietest points into
+chunks of at most MAX_CHUNK_SECONDS, and the chunks of every clip in a batch
+are transcribed in parallel across a process pool with a local model
+(faster-whisper when installed, otherwise the Vosk model used for voice
+commands). Results are timestamped segments relative to the start of each
+clip, cached on disk by content hash so the same clip is never transcribed
+twice.
+"""
+import os
+import io
+import json
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from utils.audio_ingest import StreamingResampler
+from utils.asr import ASR_SAMPLE_RATE, is_available as vosk_available
+
+# faster-whisper model size or path ("tiny", "base", "small", ...)
+WHISPER_MODEL = os.environ.get("WHISPER_MODEL", "base")
+
+# Cached transcripts (one JSON file per clip)
+TRANSCRIPT_CACHE_DIR = "data/transcripts"
+
+# Number of transcription processes
+TRANSCRIBE_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+
+# Chunks are cut at the quietest point between these lengths (seconds)
+MIN_CHUNK_SECONDS = 10
+MAX_CHUNK_SECONDS = 30
+
+# Frame length used to find quiet points (ms)
+SPLIT_FRAME_MS = 30
+
+# Chunks quieter than this throughout are skipped (dBFS)
+SILENT_CHUNK_DB = -50
+
+# Audio may be passed as encoded bytes or a file path
+AudioSource = Union[bytes, str]
+
+
+class TranscriptSegment(NamedTuple):
+    """Transcribed speech with its position in the clip (seconds)"""
+    start: float
+    end: float
+    text: str
+
+
+def _whisper_installed() -> bool:
+    try:
+        import faster_whisper  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_transcription_backend() -> Optional[str]:
+    """Name of the local model used for transcription, or None if none is available"""
+    if _whisper_installed():
+        return f"whisper-{WHISPER_MODEL}"
+    if vosk_available():
+        return "vosk"
+    return None
+
+
+def is_available() -> bool:
+    """Whether audio can be transcribed locally"""
+    return get_transcription_backend() is not None
+
+
+def load_samples(audio: AudioSource) -> np.ndarray:
+    """
+    Decode a clip to 16 kHz mono float32
+
+    Args:
+        audio: Encoded audio bytes or a file path
+
+    Returns:
+        1-D array of samples
+    """
+    import soundfile as sf
+
+    samples, sample_rate = sf.read(io.BytesIO(audio) if isinstance(audio, bytes) else audio,
+                                   dtype="float32", always_2d=True)
+    samples = samples.mean(axis=1, keepdims=True)
+    if sample_rate != ASR_SAMPLE_RATE:
+        samples = StreamingResampler(sample_rate, ASR_SAMPLE_RATE).process(samples)
+    return samples[:, 0]
+
+
+def split_at_silence(samples: np.ndarray, sample_rate: int = ASR_SAMPLE_RATE) -> List[Tuple[int, int]]:
+    """
+    Split audio into chunks at the quietest points
+
+    Args:
+        samples: 1-D float32 samples
+        sample_rate: Sample rate of the samples
+
+    Returns:
+        (start, end) sample ranges of the chunks that contain sound
+    """
+    frame = sample_rate * SPLIT_FRAME_MS // 1000
+    frame_count = len(samples) // frame
+    if frame_count == 0:
+        return [(0, len(samples))] if len(samples) else []
+
+    frames = samples[:frame_count * frame].reshape(frame_count, frame)
+    levels = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+
+    min_frames = MIN_CHUNK_SECONDS * 1000 // SPLIT_FRAME_MS
+    max_frames = MAX_CHUNK_SECONDS * 1000 // SPLIT_FRAME_MS
+    cuts = [0]
+    while frame_count - cuts[-1] > max_frames:
+        window = levels[cuts[-1] + min_frames:cuts[-1] + max_frames]
+        cuts.append(cuts[-1] + min_frames + int(np.argmin(window)))
+    cuts.append(frame_count)
+
+    chunks = []
+    for start, end in zip(cuts, cuts[1:]):
+        if levels[start:end].max() > SILENT_CHUNK_DB:
+            chunks.append((start * frame, len(samples) if end == frame_count else end * frame))
+    return chunks
+
+
+# Model loaded in each worker process
+_worker_model = None
+
+
+def _transcribe_chunk(samples: np.ndarray, offset: float, backend: str) -> List[TranscriptSegment]:
+    """Transcribe one chunk (runs in the worker processes)"""
+    global _worker_model
+
+    if backend.startswith("whisper"):
+        if _worker_model is None:
+            from faster_whisper import WhisperModel
+            _worker_model = WhisperModel(WHISPER_MODEL, device="cpu", compute_type="int8")
+        segments, _ = _worker_model.transcribe(samples, beam_size=1)
+        return [
+            TranscriptSegment(round(offset + s.start, 2), round(offset + s.end, 2), s.text.strip())
+            for s in segments if s.text.strip()
+        ]
+
+    from utils.asr import StreamingRecognizer
+    if _worker_model is None:
+        _worker_model = StreamingRecognizer()
+    pcm = (np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes()
+    final, _ = _worker_model.accept(pcm)
+    text = " ".join(part for part in (final, _worker_model.finish()) if part)
+    if not text:
+        return []
+    return [TranscriptSegment(round(offset, 2), round(offset + len(samples) / ASR_SAMPLE_RATE, 2), text)]
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_transcription_pool() -> ProcessPoolExecutor:
+    """Get the process-wide transcription pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawn rather than fork: the Streamlit server is multi-threaded
+            _pool = ProcessPoolExecutor(
+                max_workers=TRANSCRIBE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def _cache_path(key: str) -> str:
+    return os.path.join(TRANSCRIPT_CACHE_DIR, f"{key}.json")
+
+
+def _load_cached(key: str) -> Optional[List[TranscriptSegment]]:
+    try:
+        with open(_cache_path(key), "r") as f:
+            return [TranscriptSegment(*segment) for segment in json.load(f)]
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _store_cached(key: str, segments: List[TranscriptSegment]):
+    """Write a transcript atomically"""
+    os.makedirs(TRANSCRIPT_CACHE_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=TRANSCRIPT_CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump([list(segment) for segment in segments], f)
+        os.replace(temp_path, _cache_path(key))
+    except Exception as e:
+        print(f"Error caching transcript: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def transcribe_batch(clips: Sequence[AudioSource]) -> List[Optional[List[TranscriptSegment]]]:
+    """
+    Transcribe several clips, sharing the process pool across all their chunks
+
+    Args:
+        clips: Encoded audio bytes or file paths
+
+    Returns:
+        Segments per clip, in input order (None for clips that failed)
+    """
+    backend = get_transcription_backend()
+    if backend is None:
+        raise Exception("No local speech recognition model is available")
+
+    results: List[Optional[List[TranscriptSegment]]] = [None] * len(clips)
+    pending = []
+    for index, clip in enumerate(clips):
+        try:
+            if isinstance(clip, bytes):
+                data = clip
+            else:
+                with open(clip, "rb") as f:
+                    data = f.read()
+        except OSError as e:
+            print(f"Error reading audio for transcription: {e}")
+            continue
+
+        key = f"{hashlib.sha256(data).hexdigest()}-{backend}"
+        cached = _load_cached(key)
+        if cached is not None:
+            results[index] = cached
+            continue
+
+        try:
+            samples = load_samples(data)
+        except Exception as e:
+            print(f"Error decoding audio for transcription: {e}")
+            continue
+        futures = [
+            get_transcription_pool().submit(_transcribe_chunk, samples[start:end], start / ASR_SAMPLE_RATE, backend)
+            for start, end in split_at_silence(samples)
+        ]
+        pending.append((index, key, futures))
+
+    for index, key, futures in pending:
+        try:
+            segments = [segment for future in futures for segment in future.result()]
+        except Exception as e:
+            print(f"Error transcribing audio: {e}")
+            continue
+        _store_cached(key, segments)
+        results[index] = segments
+    return results
+
+
+def transcribe_audio(audio: AudioSource) -> List[TranscriptSegment]:
+    """
+    Transcribe one clip of any length
+
+    Args:
+        audio: Encoded audio bytes or a file path
+
+    Returns:
+        Timestamped segments
+
+    Raises:
+        Exception: If no local model is available or transcription failed
+    """
+    segments = transcribe_batch([audio])[0]
+    if segments is None:
+        raise Exception("Audio could not be transcribed")
+    return segments
+
+
+def format_transcript(segments: List[TranscriptSegment]) -> str:
+    """
+    Render segments as timestamped lines
+
+    Args:
+        segments: Transcript segments
+
+    Returns:
+        Lines like "[01:05 - 01:12] text"
+    """
+    def timestamp(seconds: float) -> str:
+        minutes, seconds = divmod(int(seconds), 60)
+        return f"{minutes:02d}:{seconds:02d}"
+
+    return "\n".join(f"[{timestamp(s.start)} - {timestamp(s.end)}] {s.text}" for s in segments)
@@ -2,15 +2,17 @@
 Text-to-Speech utilities using ElevenLabs API
 """
 import os
-import base64
+import re
+import json
+import time
+import threading
 import tempfile
 import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
 import streamlit as st
 from typing import Optional, Dict, List, Tuple, Any
 
-# Cache directory for storing generated audio
-CACHE_DIR = "data/tts_cache"
-os.makedirs(CACHE_DIR, exist_ok=True)
+from utils.tts_cache import get_tts_cache
 
 # ElevenLabs API key
 ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY")
@@ -22,6 +24,23 @@ DEFAULT_MODEL = "eleven_multilingual_v2"  # Using the recommended model from doc
 STABILITY = 0.5
 CLARITY = 0.5
 
+# Voice and model catalogs are shared by all sessions and persisted for warm restarts
+CATALOG_PATH = "data/tts_catalogs.json"
+CATALOG_TTL = 6 * 60 * 60  # seconds
+CATALOG_RETRY_INTERVAL = 60  # seconds the default list is used after a failed first fetch
+
+# Streaming playback: sentences synthesized in parallel per reply
+MAX_TTS_WORKERS = 3
+
+# Sentences shorter than this are merged with the next one
+MIN_SENTENCE_CHARS = 40
+
+# Bit rate of the mp3_44100_128 output format, used to estimate clip durations
+MP3_BITRATE = 128000
+
+# Sentence boundaries: terminal punctuation (plus closing quotes/brackets) or a blank line
+SENTENCE_END = re.compile(r'(?<=[.!?…])["\')\]]*\s+|\n\s*\n')
+
 # Default voices to use when API is not available
 DEFAULT_VOICES = [
     ("21m00Tcm4TlvDq8ikWAM", "Rachel"),
@@ -44,6 +63,135 @@ DEFAULT_MODELS = [
 ]
 
 
+def _get_client():
+    """Get the shared ElevenLabs client"""
+    from elevenlabs.client import ElevenLabs
+    
+    # Create a reusable client or reuse existing
+    if "eleven_client" not in globals():
+        globals()["eleven_client"] = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+    
+    return globals()["eleven_client"]
+
+
+def _fetch_voices() -> List[Tuple[str, str]]:
+    """Fetch the voice catalog from ElevenLabs"""
+    response = _get_client().voices.get_all()
+    
+    # Sort voices by name for better UX
+    voices_list = [(voice.voice_id, voice.name) for voice in response.voices]
+    voices_list.sort(key=lambda x: x[1])  # Sort by name
+    return voices_list
+
+
+def _fetch_models() -> List[Tuple[str, str]]:
+    """Fetch the text-to-speech model catalog from ElevenLabs"""
+    models = _get_client().models.get_all()
+    
+    # Filter for models that can do text-to-speech
+    tts_models = [(model.model_id, model.name) for model in models if getattr(model, 'can_do_text_to_speech', True)]
+    
+    # Sort by name
+    tts_models.sort(key=lambda x: x[1])
+    return tts_models
+
+
+_CATALOG_FETCHERS = {
+    "voices": _fetch_voices,
+    "models": _fetch_models,
+}
+
+# name -> {"items": [(id, name), ...], "fetched_at": unix time}
+_catalogs: Dict[str, Dict[str, Any]] = {}
+_catalogs_loaded = False
+_refreshing: set = set()
+_catalog_lock = threading.Lock()
+
+
+def _load_catalogs():
+    """Load catalogs persisted by a previous process (caller holds the lock)"""
+    global _catalogs_loaded
+    if _catalogs_loaded:
+        return
+    _catalogs_loaded = True
+    try:
+        with open(CATALOG_PATH, "r") as f:
+            stored = json.load(f)
+        for name, entry in stored.items():
+            _catalogs[name] = {
+                "items": [tuple(item) for item in entry["items"]],
+                "fetched_at": float(entry["fetched_at"])
+            }
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+
+def _save_catalogs():
+    """Persist catalogs atomically (caller holds the lock)"""
+    try:
+        os.makedirs(os.path.dirname(CATALOG_PATH), exist_ok=True)
+        temp_path = f"{CATALOG_PATH}.tmp"
+        with open(temp_path, "w") as f:
+            # Default lists stored after failed fetches are not persisted
+            json.dump({name: entry for name, entry in _catalogs.items() if not entry.get("fallback")}, f)
+        os.replace(temp_path, CATALOG_PATH)
+    except Exception as e:
+        print(f"Could not save TTS catalogs: {e}")
+
+
+def _refresh_catalog(name: str, default: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """Fetch a catalog and store it; returns the current or default list if the fetch failed"""
+    try:
+        items = _CATALOG_FETCHERS[name]()
+    except Exception as e:
+        print(f"Error fetching {name}: {e}")
+        items = None
+    
+    with _catalog_lock:
+        _refreshing.discard(name)
+        if items:
+            _catalogs[name] = {"items": items, "fetched_at": time.time()}
+            _save_catalogs()
+            return items
+        if name not in _catalogs:
+            # Serve the default list for a while so callers do not each wait on the network
+            _catalogs[name] = {
+                "items": default,
+                "fetched_at": time.time() - CATALOG_TTL + CATALOG_RETRY_INTERVAL,
+                "fallback": True
+            }
+        return _catalogs[name]["items"]
+
+
+def _get_catalog(name: str, default: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """
+    Get a catalog from the process-wide cache
+    
+    Fresh entries are returned directly. Stale entries are returned as well
+    while a background thread refreshes them. Only a cold start (nothing in
+    memory or on disk) fetches synchronously, in one thread while the others
+    get the default list. After a failed fetch the default list is served
+    and the fetch is retried in the background every CATALOG_RETRY_INTERVAL.
+    """
+    if not ELEVENLABS_API_KEY:
+        return default
+    
+    with _catalog_lock:
+        _load_catalogs()
+        entry = _catalogs.get(name)
+        if entry is not None:
+            if time.time() - entry["fetched_at"] > CATALOG_TTL and name not in _refreshing:
+                _refreshing.add(name)
+                threading.Thread(target=_refresh_catalog, args=(name, default), name=f"tts-{name}-refresh", daemon=True).start()
+            return entry["items"]
+        if name in _refreshing:
+            # Another thread is already fetching it
+            return default
+        _refreshing.add(name)
+    
+    return _refresh_catalog(name, default)
+
+
 def get_available_voices() -> List[Tuple[str, str]]:
     """
     Get available ElevenLabs voices
@@ -51,27 +199,7 @@ def get_available_voices() -> List[Tuple[str, str]]:
     Returns:
         List of (voice_id, voice_name) tuples
     """
-    if not ELEVENLABS_API_KEY:
-        return DEFAULT_VOICES
-        
-    try:
-        from elevenlabs.client import ElevenLabs
-        
-        # Create a reusable client
-        if "eleven_client" not in globals():
-            globals()["eleven_client"] = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-        
-        client = globals()["eleven_client"]
-        response = client.voices.get_all()
-        
-        # Sort voices by name for better UX
-        voices_list = [(voice.voice_id, voice.name) for voice in response.voices]
-        voices_list.sort(key=lambda x: x[1])  # Sort by name
-        
-        return voices_list
-    except Exception as e:
-        print(f"Error fetching voices: {e}")
-        return DEFAULT_VOICES
+    return _get_catalog("voices", DEFAULT_VOICES)
 
 
 def get_available_models() -> List[Tuple[str, str]]:
@@ -81,29 +209,7 @@ def get_available_models() -> List[Tuple[str, str]]:
     Returns:
         List of (model_id, model_name) tuples
     """
-    if not ELEVENLABS_API_KEY:
-        return DEFAULT_MODELS
-    
-    try:
-        from elevenlabs.client import ElevenLabs
-        
-        # Create a reusable client or reuse existing
-        if "eleven_client" not in globals():
-            globals()["eleven_client"] = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-        
-        client = globals()["eleven_client"]
-        models = client.models.get_all()
-        
-        # Filter for models that can do text-to-speech
-        tts_models = [(model.model_id, model.name) for model in models if getattr(model, 'can_do_text_to_speech', True)]
-        
-        # Sort by name
-        tts_models.sort(key=lambda x: x[1])
-        
-        return tts_models if tts_models else DEFAULT_MODELS
-    except Exception as e:
-        print(f"Error fetching models: {e}")
-        return DEFAULT_MODELS
+    return _get_catalog("models", DEFAULT_MODELS)
 
 
 def generate_audio_hash(text: str, voice_id: str, model_id: str) -> str:
@@ -122,90 +228,330 @@ def generate_audio_hash(text: str, voice_id: str, model_id: str) -> str:
     return hashlib.md5(params_str.encode()).hexdigest()
 
 
+def synthesize_speech(text: str, voice_id: str, model_id: str) -> bytes:
+    """
+    Synthesize text with ElevenLabs
+    
+    Args:
+        text: Text to convert to speech
+        voice_id: ElevenLabs voice ID
+        model_id: ElevenLabs model ID
+        
+    Returns:
+        MP3 audio bytes
+    """
+    audio_iterator = _get_client().text_to_speech.convert(
+        text=text,
+        voice_id=voice_id,
+        model_id=model_id,
+        output_format="mp3_44100_128"
+    )
+    return b"".join(audio_iterator)
+
+
 def text_to_speech(
     text: str,
     voice_id: Optional[str] = None,
     model_id: Optional[str] = None,
-    use_cache: bool = True
-) -> Tuple[Optional[str], Optional[str]]:
+    use_cache: bool = True,
+    latency_budget: Optional[float] = None,
+    backend: Optional[str] = None
+) -> Optional[str]:
     """
-    Convert text to speech using ElevenLabs API
+    Convert text to speech with the best available engine
     
     Args:
         text: Text to convert to speech
         voice_id: ElevenLabs voice ID (defaults to Rachel if None)
         model_id: ElevenLabs model ID (defaults to eleven_multilingual_v2 if None)
         use_cache: Whether to use cache for previously generated audio
+        latency_budget: Maximum acceptable synthesis time in seconds, if any
+        backend: Engine to use ("elevenlabs", "piper"), or None/"auto" to route
+            by text length and latency budget
         
     Returns:
-        Tuple of (file_path, base64_audio) if successful, or (None, None) if failed
+        Path to the audio file (MP3 or WAV) if successful, or None if failed
     """
+    from utils.tts_backends import select_backend
+    
     # Use default values if not provided
     voice_id = voice_id or DEFAULT_VOICE_ID
     model_id = model_id or DEFAULT_MODEL
     
-    # Check if API key is set
-    if not ELEVENLABS_API_KEY:
-        st.error("ElevenLabs API key is not set. Please add it to your environment variables.")
-        return None, None
+    engine = select_backend(text, latency_budget=latency_budget, preferred=backend)
+    if engine is None:
+        st.error("No text-to-speech engine is available. Set ELEVENLABS_API_KEY or install a local Piper voice.")
+        return None
     
-    # Generate cache key
-    cache_key = generate_audio_hash(text, voice_id, model_id)
-    cache_path = os.path.join(CACHE_DIR, f"{cache_key}.mp3")
+    cache = engine.cache
+    cache_key = engine.cache_key(text, voice_id, model_id)
     
-    # Check cache if enabled
-    if use_cache and os.path.exists(cache_path):
-        try:
-            with open(cache_path, 'rb') as f:
-                audio_bytes = f.read()
-                base64_audio = base64.b64encode(audio_bytes).decode('utf-8')
-                return cache_path, base64_audio
-        except Exception as e:
-            print(f"Cache read error: {e}")
-            # Continue to generate if cache read failed
+    # Serve cache hits by path
+    if use_cache:
+        cache_path = cache.get_path(cache_key)
+        if cache_path:
+            return cache_path
     
     # Generate audio
     try:
-        # Use the client-based API from documentation
-        from elevenlabs.client import ElevenLabs
-        
-        # Create a reusable client or reuse existing
-        if "eleven_client" not in globals():
-            globals()["eleven_client"] = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-        
-        client = globals()["eleven_client"]
-        
-        # Generate audio
-        audio_iterator = client.text_to_speech.convert(
-            text=text,
-            voice_id=voice_id,
-            model_id=model_id,
-            output_format="mp3_44100_128"
-        )
+        audio_bytes = engine.synthesize(text, voice_id, model_id)
         
-        # Convert iterator to bytes
-        audio_bytes = b"".join(audio_iterator)
-        
-        # Determine output path (cache or temporary)
         if use_cache:
-            output_path = cache_path
+            output_path = cache.put(
+                cache_key, audio_bytes,
+                voice_id=voice_id, model_id=f"{engine.name}:{model_id}", extension=engine.extension
+            )
         else:
-            temp_file = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False)
+            temp_file = tempfile.NamedTemporaryFile(suffix=engine.extension, delete=False)
             output_path = temp_file.name
+            temp_file.write(audio_bytes)
             temp_file.close()
         
-        # Save the audio file
-        with open(output_path, 'wb') as f:
-            f.write(audio_bytes)
-        
-        # Encode to base64
-        base64_audio = base64.b64encode(audio_bytes).decode('utf-8')
-        
-        return output_path, base64_audio
+        return output_path
         
     except Exception as e:
         st.error(f"Error generating speech: {e}")
-        return None, None
+        return None
+
+
+def speakable_text(text: str) -> str:
+    """
+    Strip markdown that should not be read aloud
+    
+    Code blocks are dropped, links keep their label and emphasis markers,
+    headings and list bullets are removed.
+    
+    Args:
+        text: Markdown text
+        
+    Returns:
+        Plain text for speech synthesis
+    """
+    text = re.sub(r"```.*?(```|$)", " ", text, flags=re.DOTALL)
+    text = re.sub(r"`([^`]*)`", r"\1", text)
+    text = re.sub(r"!?\[([^\]]*)\]\([^)]*\)", r"\1", text)
+    text = re.sub(r"^\s*(#{1,6}|[-*+]|\d+\.)\s+", "", text, flags=re.MULTILINE)
+    text = re.sub(r"[*_~]{1,3}", "", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def split_sentences(text: str, min_chars: int = MIN_SENTENCE_CHARS) -> List[str]:
+    """
+    Split text into sentences for speech synthesis
+    
+    Args:
+        text: Text to split
+        min_chars: Sentences shorter than this are merged with the next one
+        
+    Returns:
+        List of sentences
+    """
+    chunker = SentenceChunker(min_chars=min_chars)
+    return chunker.feed(text) + chunker.flush()
+
+
+class SentenceChunker:
+    """
+    Incrementally cut streamed text into complete sentences
+    
+    Text is fed as it arrives from the model; complete sentences are returned
+    as soon as their boundary has been seen. Text inside an unterminated code
+    block is held back until the block closes.
+    """
+    
+    def __init__(self, min_chars: int = MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ""
+    
+    def feed(self, delta: str) -> List[str]:
+        """
+        Add streamed text
+        
+        Args:
+            delta: Newly received text
+            
+        Returns:
+            Sentences completed by this text
+        """
+        self._buffer += delta
+        
+        # Don't cut inside an open code fence
+        limit = len(self._buffer)
+        if self._buffer.count("```") % 2:
+            limit = self._buffer.rfind("```")
+        
+        sentences, start = [], 0
+        for match in SENTENCE_END.finditer(self._buffer, 0, limit):
+            sentence = speakable_text(self._buffer[start:match.end()])
+            if len(sentence) < self.min_chars:
+                continue
+            sentences.append(sentence)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+    
+    def flush(self) -> List[str]:
+        """
+        Return whatever text remains once the stream has ended
+        
+        Returns:
+            The final sentence, if any
+        """
+        sentence = speakable_text(self._buffer)
+        self._buffer = ""
+        return [sentence] if sentence else []
+
+
+def _estimate_duration(audio_bytes: bytes) -> float:
+    """Estimate the playing time of constant bit rate MP3 audio in seconds"""
+    return len(audio_bytes) * 8 / MP3_BITRATE
+
+
+class StreamingSpeaker:
+    """
+    Speak a reply sentence by sentence while it is being generated
+    
+    Sentences are synthesized concurrently (at most MAX_TTS_WORKERS at a
+    time) and played back in order as soon as each is ready. Streamlit cannot
+    queue audio in the browser, so clips are paced by their estimated
+    duration: a new autoplaying clip is only rendered once the previous one
+    has finished.
+    """
+    
+    def __init__(
+        self,
+        voice_id: Optional[str] = None,
+        model_id: Optional[str] = None,
+        use_cache: bool = True,
+        container=None
+    ):
+        self.voice_id = voice_id or DEFAULT_VOICE_ID
+        self.model_id = model_id or DEFAULT_MODEL
+        self.use_cache = use_cache
+        self._container = container if container is not None else st.container()
+        self._chunker = SentenceChunker()
+        self._executor = ThreadPoolExecutor(max_workers=MAX_TTS_WORKERS, thread_name_prefix="tts-stream")
+        self._clips: List[Future] = []
+        self._played = 0
+        self._playing_until = 0.0
+    
+    def _synthesize(self, sentence: str) -> bytes:
+        """Worker: synthesize one sentence, using the cache when enabled"""
+        cache = get_tts_cache()
+        cache_key = generate_audio_hash(sentence, self.voice_id, self.model_id)
+        if self.use_cache:
+            cache_path = cache.get_path(cache_key)
+            if cache_path:
+                with open(cache_path, 'rb') as f:
+                    return f.read()
+        
+        audio_bytes = synthesize_speech(sentence, self.voice_id, self.model_id)
+        if self.use_cache:
+            cache.put(cache_key, audio_bytes, voice_id=self.voice_id, model_id=self.model_id)
+        return audio_bytes
+    
+    def _submit(self, sentences: List[str]):
+        for sentence in sentences:
+            self._clips.append(self._executor.submit(self._synthesize, sentence))
+    
+    def _play(self, audio_bytes: bytes):
+        """Render an autoplaying clip and record when it will end"""
+        with self._container:
+            st.audio(audio_bytes, format="audio/mp3", autoplay=True)
+        self._playing_until = max(time.monotonic(), self._playing_until) + _estimate_duration(audio_bytes)
+    
+    def _play_ready(self):
+        """Play finished clips in order while nothing else is playing"""
+        while self._played < len(self._clips) and time.monotonic() >= self._playing_until:
+            clip = self._clips[self._played]
+            if not clip.done():
+                break
+            self._played += 1
+            try:
+                self._play(clip.result())
+            except Exception as e:
+                print(f"Error synthesizing sentence: {e}")
+    
+    def feed(self, delta: str):
+        """
+        Add streamed reply text; call this for every chunk from the model
+        
+        Args:
+            delta: Newly received text
+        """
+        self._submit(self._chunker.feed(delta))
+        self._play_ready()
+    
+    def finish(self) -> Optional[bytes]:
+        """
+        Finish the reply once the model stream has ended
+        
+        Waits for the clip that is currently playing, then returns the audio
+        that has not been played yet as one MP3 so the caller can autoplay it
+        after the next rerun (see queue_autoplay).
+        
+        Returns:
+            MP3 bytes of the unplayed sentences, or None if everything was played
+        """
+        self._submit(self._chunker.flush())
+        
+        remaining = []
+        try:
+            for clip in self._clips[self._played:]:
+                try:
+                    remaining.append(clip.result())
+                except Exception as e:
+                    print(f"Error synthesizing sentence: {e}")
+        finally:
+            self._executor.shutdown(wait=False)
+        
+        # A rerun would cut off the sentence that is still playing
+        delay = self._playing_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        
+        # MP3 frames can be concatenated directly
+        return b"".join(remaining) or None
+
+
+def queue_autoplay(audio_bytes: Optional[bytes]):
+    """
+    Play audio once on the next script run
+    
+    Args:
+        audio_bytes: MP3 audio, or None to do nothing
+    """
+    if audio_bytes:
+        st.session_state.tts_autoplay = audio_bytes
+
+
+def render_autoplay():
+    """Render audio queued with queue_autoplay, if any"""
+    audio_bytes = st.session_state.pop("tts_autoplay", None)
+    if audio_bytes:
+        st.audio(audio_bytes, format="audio/mp3", autoplay=True)
+
+
+def create_streaming_speaker(container=None) -> Optional[StreamingSpeaker]:
+    """
+    Create a speaker for the current reply if spoken replies are enabled
+    
+    Args:
+        container: Streamlit container for the audio players
+        
+    Returns:
+        A StreamingSpeaker, or None if speech is disabled or unavailable
+    """
+    tts_settings = st.session_state.get('tts_settings', {})
+    if not ELEVENLABS_API_KEY or not tts_settings.get("speak_replies"):
+        return None
+    
+    return StreamingSpeaker(
+        voice_id=tts_settings.get("voice_id"),
+        model_id=tts_settings.get("model_id"),
+        use_cache=tts_settings.get("use_cache", True),
+        container=container
+    )
 
 
 def render_tts_controls(default_voice: str = DEFAULT_VOICE, default_model: str = DEFAULT_MODEL) -> Dict[str, Any]:
@@ -268,10 +614,33 @@ def render_tts_controls(default_voice: str = DEFAULT_VOICE, default_model: str =
         use_cache = st.checkbox("Cache generated audio", value=True,
                               help="Save generated audio to avoid redundant API calls")
         
+        # Streaming playback option
+        speak_replies = st.checkbox("Speak replies as they stream", value=False,
+                                  help="Read streamed replies aloud sentence by sentence while they are generated")
+        
+        # Engine selection (only engines usable here are offered)
+        from utils.tts_backends import available_backends
+        backend_labels = {"auto": "Auto (local for short text)", "elevenlabs": "ElevenLabs", "piper": "Local (Piper)"}
+        backend_options = ["auto"] + list(available_backends())
+        backend = st.selectbox(
+            "Engine",
+            options=backend_options,
+            format_func=lambda name: backend_labels.get(name, name),
+            help="Auto uses the local voice for short text and ElevenLabs for longer replies"
+        )
+        
+        # Background synthesis option
+        prefetch = st.checkbox("Prepare audio for new replies", value=False,
+                             help="Generate speech for each new reply in the background so playback starts instantly",
+                             disabled=not use_cache)
+        
         return {
             "voice_id": selected_voice_id,
             "model_id": selected_model_id,
-            "use_cache": use_cache
+            "use_cache": use_cache,
+            "speak_replies": speak_replies,
+            "prefetch": prefetch and use_cache,
+            "backend": backend
         }
 
 
@@ -283,8 +652,10 @@ def render_play_button(message_text: str, key: str):
         message_text: Text to convert to speech
         key: Unique key for this button instance
     """
-    if not ELEVENLABS_API_KEY:
-        # Don't show the button if API key is not set
+    from utils.tts_backends import available_backends
+    
+    if not available_backends():
+        # Don't show the button if no engine is available
         return
     
     # Get TTS settings from session state or use defaults
@@ -308,11 +679,20 @@ def render_play_button(message_text: str, key: str):
     # Play button
     if st.button("🔊", key=button_key, help="Play this message (Text-to-Speech)"):
         with st.spinner("Generating audio..."):
-            audio_path, _ = text_to_speech(
+            # Reuse a background job for this clip instead of synthesizing it twice
+            from utils.tts_prefetch import claim_clip
+            claim_clip(
+                message_text,
+                tts_settings.get("voice_id") or DEFAULT_VOICE_ID,
+                tts_settings.get("model_id") or DEFAULT_MODEL
+            )
+            
+            audio_path = text_to_speech(
                 text=message_text,
                 voice_id=tts_settings.get("voice_id"),
                 model_id=tts_settings.get("model_id"),
-                use_cache=tts_settings.get("use_cache", True)
+                use_cache=tts_settings.get("use_cache", True),
+                backend=tts_settings.get("backend")
             )
             
             if audio_path:
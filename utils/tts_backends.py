@@ -0,0 +1,180 @@
+"""
+Pluggable text-to-speech backends
+
+Two engines are available behind a common interface:
+- ElevenLabs: high quality, network round trip per request
+- Piper: a small ONNX voice running on the CPU, no network and no API key
+
+select_backend routes each request by text length and latency budget. Both
+backends store their audio in the shared TTS cache, under one byte budget.
+"""
+import io
+import os
+import wave
+import threading
+from typing import Dict, Optional
+
+from utils.tts import ELEVENLABS_API_KEY, generate_audio_hash, synthesize_speech
+from utils.tts_cache import get_tts_cache
+
+# Piper voice model (.onnx, with its .onnx.json config next to it)
+PIPER_VOICE_PATH = os.environ.get("PIPER_VOICE_PATH", "models/piper/en_US-lessac-low.onnx")
+
+# Texts up to this many characters are synthesized locally when possible
+LOCAL_MAX_CHARS = 200
+
+# Rough synthesis speeds used to estimate latency
+ELEVENLABS_BASE_LATENCY = 0.6  # seconds per request
+ELEVENLABS_CHARS_PER_SECOND = 400
+LOCAL_CHARS_PER_SECOND = 1500
+
+
+class TTSBackend:
+    """Base class for speech synthesis engines"""
+
+    name = ""
+    extension = ".mp3"
+    mime_type = "audio/mp3"
+
+    def is_available(self) -> bool:
+        """Whether the engine can be used in this environment"""
+        raise NotImplementedError
+
+    def estimate_latency(self, text: str) -> float:
+        """Estimated seconds to synthesize a text"""
+        raise NotImplementedError
+
+    def cache_key(self, text: str, voice_id: str, model_id: str) -> str:
+        """Key of a clip in this backend's cache"""
+        raise NotImplementedError
+
+    def synthesize(self, text: str, voice_id: str, model_id: str) -> bytes:
+        """Synthesize text and return encoded audio"""
+        raise NotImplementedError
+
+    @property
+    def cache(self):
+        """The shared TTS cache (store clips with extension=self.extension)"""
+        return get_tts_cache()
+
+
+class ElevenLabsBackend(TTSBackend):
+    """ElevenLabs API (MP3)"""
+
+    name = "elevenlabs"
+    extension = ".mp3"
+    mime_type = "audio/mp3"
+
+    def is_available(self) -> bool:
+        return bool(ELEVENLABS_API_KEY)
+
+    def estimate_latency(self, text: str) -> float:
+        return ELEVENLABS_BASE_LATENCY + len(text) / ELEVENLABS_CHARS_PER_SECOND
+
+    def cache_key(self, text: str, voice_id: str, model_id: str) -> str:
+        return generate_audio_hash(text, voice_id, model_id)
+
+    def synthesize(self, text: str, voice_id: str, model_id: str) -> bytes:
+        return synthesize_speech(text, voice_id, model_id)
+
+
+class PiperBackend(TTSBackend):
+    """Local Piper ONNX voice (WAV); ElevenLabs voice and model IDs are ignored"""
+
+    name = "piper"
+    extension = ".wav"
+    mime_type = "audio/wav"
+
+    def __init__(self, voice_path: str = PIPER_VOICE_PATH):
+        self.voice_path = voice_path
+        self._voice = None
+        self._load_failed = False
+        self._lock = threading.Lock()
+
+    def _get_voice(self):
+        """Load the voice model once"""
+        if self._voice is None and not self._load_failed:
+            with self._lock:
+                if self._voice is None and not self._load_failed:
+                    try:
+                        from piper.voice import PiperVoice
+                        self._voice = PiperVoice.load(self.voice_path)
+                    except Exception as e:
+                        print(f"Local TTS voice unavailable: {e}")
+                        self._load_failed = True
+        return self._voice
+
+    def is_available(self) -> bool:
+        if self._load_failed or not os.path.exists(self.voice_path):
+            return False
+        try:
+            import piper  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def estimate_latency(self, text: str) -> float:
+        return len(text) / LOCAL_CHARS_PER_SECOND
+
+    def cache_key(self, text: str, voice_id: str, model_id: str) -> str:
+        return generate_audio_hash(text, os.path.basename(self.voice_path), self.name)
+
+    def synthesize(self, text: str, voice_id: str, model_id: str) -> bytes:
+        voice = self._get_voice()
+        if voice is None:
+            raise Exception("Local TTS voice could not be loaded")
+
+        buffer = io.BytesIO()
+        with self._lock, wave.open(buffer, "wb") as wav_file:
+            # piper-tts >= 1.3 renamed synthesize() to synthesize_wav()
+            if hasattr(voice, "synthesize_wav"):
+                voice.synthesize_wav(text, wav_file)
+            else:
+                voice.synthesize(text, wav_file)
+        return buffer.getvalue()
+
+
+BACKENDS: Dict[str, TTSBackend] = {
+    "elevenlabs": ElevenLabsBackend(),
+    "piper": PiperBackend(),
+}
+
+
+def available_backends() -> Dict[str, TTSBackend]:
+    """Backends usable in this environment"""
+    return {name: backend for name, backend in BACKENDS.items() if backend.is_available()}
+
+
+def select_backend(
+    text: str,
+    latency_budget: Optional[float] = None,
+    preferred: Optional[str] = None
+) -> Optional[TTSBackend]:
+    """
+    Choose the engine for a request
+
+    Short texts, and texts that ElevenLabs could not synthesize within the
+    latency budget, go to the local engine; everything else goes to
+    ElevenLabs. Whichever engine is available is used if the other is not.
+
+    Args:
+        text: Text to synthesize
+        latency_budget: Maximum acceptable synthesis time in seconds, if any
+        preferred: Backend name to use when available ("auto" or None to route)
+
+    Returns:
+        The chosen backend, or None if no engine is available
+    """
+    backends = available_backends()
+    if preferred in backends:
+        return backends[preferred]
+
+    remote, local = backends.get("elevenlabs"), backends.get("piper")
+    if remote is None or local is None:
+        return remote or local
+
+    if len(text) <= LOCAL_MAX_CHARS:
+        return local
+    if latency_budget is not None and remote.estimate_latency(text) > latency_budget:
+        return local
+    return remote
@@ -0,0 +1,245 @@
+"""
+Bounded on-disk caches for audio files
+
+Each cache directory is indexed in a SQLite database recording each entry's
+size, voice, model, file extension and last access time, and is kept under
+its own byte budget by evicting the least recently used entries. Generated
+speech lives in data/tts_cache/, where clips from every TTS backend (MP3 and
+WAV) share one index and one budget; other audio (such as prepared
+recordings, see utils/audio_ingest.py) uses its own directory and budget.
+Files are written atomically (temporary file + rename) and checked against
+their recorded size before being served, so a crash mid-write never yields a
+truncated clip.
+"""
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+
+# Cache directory for storing generated speech
+CACHE_DIR = "data/tts_cache"
+
+# Total size of cached speech before least recently used entries are evicted
+MAX_CACHE_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", 500 * 1024 * 1024))
+
+# Last-access updates closer together than this are skipped to save writes (seconds)
+TOUCH_INTERVAL = 60
+
+# Audio file types a cache directory may hold
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".ogg", ".flac")
+
+_caches: Dict[str, "AudioFileCache"] = {}
+_caches_lock = threading.Lock()
+
+
+class AudioFileCache:
+    """
+    LRU cache of audio files with a SQLite index
+
+    Safe to share across threads and sessions; one instance per directory.
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES, extension: str = ".mp3"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                voice_id TEXT,
+                model_id TEXT,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        # Indexes created before entries recorded their extension
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(entries)")}
+        if "extension" not in columns:
+            self._conn.execute("ALTER TABLE entries ADD COLUMN extension TEXT")
+        self._conn.commit()
+        self._reconcile()
+
+    def path_for(self, key: str, extension: Optional[str] = None) -> str:
+        """Path of the audio file for a cache key"""
+        return os.path.join(self.directory, f"{key}{extension or self.extension}")
+
+    def _reconcile(self):
+        """Bring the index in line with the files on disk"""
+        with self._lock:
+            indexed = {key: size for key, size in self._conn.execute("SELECT key, size FROM entries")}
+            on_disk = set()
+
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                # Leftovers of interrupted writes
+                if name.endswith(".tmp"):
+                    os.remove(path)
+                    continue
+                key, extension = os.path.splitext(name)
+                if extension not in AUDIO_EXTENSIONS and extension != self.extension:
+                    continue
+
+                on_disk.add(key)
+                if key not in indexed:
+                    # Files written before the index existed
+                    stat = os.stat(path)
+                    self._conn.execute(
+                        "INSERT INTO entries (key, size, extension, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                        (key, stat.st_size, extension, stat.st_mtime, stat.st_mtime)
+                    )
+
+            missing = [(key,) for key in indexed if key not in on_disk]
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", missing)
+            self._conn.commit()
+            self._evict()
+
+    def get_path(self, key: str) -> Optional[str]:
+        """
+        Look up a cached clip
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Path to the audio file, or None on a miss or a failed integrity check
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT size, last_access, extension FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            size, last_access, extension = row
+            path = self.path_for(key, extension)
+            try:
+                actual_size = os.path.getsize(path)
+            except OSError:
+                actual_size = -1
+            if actual_size != size:
+                print(f"Discarding corrupt audio cache entry {key} in {self.directory}")
+                self._delete(key)
+                self._conn.commit()
+                return None
+
+            now = time.time()
+            if now - last_access >= TOUCH_INTERVAL:
+                self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+            return path
+
+    def put(
+        self,
+        key: str,
+        data: bytes,
+        voice_id: Optional[str] = None,
+        model_id: Optional[str] = None,
+        extension: Optional[str] = None
+    ) -> str:
+        """
+        Store a clip
+
+        Args:
+            key: Cache key
+            data: Audio bytes
+            voice_id: Voice the clip was generated with
+            model_id: Model the clip was generated with
+            extension: File extension of the audio (defaults to the cache's)
+
+        Returns:
+            Path to the cached audio file
+        """
+        extension = extension or self.extension
+        path = self.path_for(key, extension)
+
+        # Write to a temporary file in the same directory, then rename into place
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, size, voice_id, model_id, extension, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, len(data), voice_id, model_id, extension, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+        return path
+
+    def _delete(self, key: str):
+        """Remove an entry and its file (caller holds the lock)"""
+        row = self._conn.execute("SELECT extension FROM entries WHERE key = ?", (key,)).fetchone()
+        self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        try:
+            os.remove(self.path_for(key, row[0] if row else None))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Evict least recently used entries until the cache fits its budget (caller holds the lock)"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._delete(key)
+            total -= size
+        self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache usage
+
+        Returns:
+            Dictionary with entry count, total bytes and byte budget
+        """
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": count, "bytes": total, "max_bytes": self.max_bytes}
+
+
+def get_audio_cache(directory: str, max_bytes: int, extension: str) -> AudioFileCache:
+    """
+    Get the process-wide cache for a directory
+
+    Args:
+        directory: Cache directory
+        max_bytes: Byte budget of the directory (used when it is first opened)
+        extension: Default file extension of the cached audio
+
+    Returns:
+        The shared AudioFileCache
+    """
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = AudioFileCache(directory, max_bytes=max_bytes, extension=extension)
+        return _caches[directory]
+
+
+def get_tts_cache() -> AudioFileCache:
+    """
+    Get the cache of generated speech shared by all TTS backends
+
+    Returns:
+        The shared AudioFileCache for CACHE_DIR
+    """
+    return get_audio_cache(CACHE_DIR, MAX_CACHE_BYTES, ".mp3")
@@ -0,0 +1,231 @@
+"""
+Background speech synthesis for new assistant replies
+
+When prefetching is enabled in the TTS settings, each new reply is queued for
+synthesis right after it is saved, so pressing its play button usually hits
+the cache. The queue is shared by all sessions, bounded (the oldest jobs are
+dropped first), deduplicated by cache key, and jobs are grouped per session
+and chat so they can be cancelled when the user moves to another chat. Each
+job also records the index of its message, so clearing or deleting messages
+cancels the speech queued for them.
+"""
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import streamlit as st
+
+from utils.tts import ELEVENLABS_API_KEY, DEFAULT_MODEL, DEFAULT_VOICE_ID, generate_audio_hash, synthesize_speech
+from utils.tts_cache import get_tts_cache
+
+# Maximum number of queued jobs
+MAX_QUEUED_JOBS = 32
+
+# Number of synthesis worker threads
+PREFETCH_WORKERS = 2
+
+
+class TTSPrefetcher:
+    """Bounded, deduplicated background synthesis queue"""
+
+    def __init__(self, max_queued: int = MAX_QUEUED_JOBS, workers: int = PREFETCH_WORKERS):
+        self.max_queued = max_queued
+        self._condition = threading.Condition()
+        # cache key -> job, oldest first
+        self._queue: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # cache key -> event set when the job finishes
+        self._in_flight: Dict[str, threading.Event] = {}
+        self._threads = [
+            threading.Thread(target=self._run, name=f"tts-prefetch-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, text: str, voice_id: str, model_id: str, group: str, message: Optional[int] = None) -> bool:
+        """
+        Queue a clip for synthesis
+
+        Args:
+            text: Text to synthesize
+            voice_id: ElevenLabs voice ID
+            model_id: ElevenLabs model ID
+            group: Group the job belongs to (used for cancellation)
+            message: Index of the message in its chat, if any
+
+        Returns:
+            True if a job was queued, False if it is cached or already pending
+        """
+        key = generate_audio_hash(text, voice_id, model_id)
+        if get_tts_cache().get_path(key):
+            return False
+
+        with self._condition:
+            if key in self._queue or key in self._in_flight:
+                return False
+            if len(self._queue) >= self.max_queued:
+                dropped_key, _ = self._queue.popitem(last=False)
+                print(f"TTS prefetch queue full, dropped {dropped_key}")
+            self._queue[key] = {
+                "text": text, "voice_id": voice_id, "model_id": model_id, "group": group, "message": message
+            }
+            self._condition.notify()
+        return True
+
+    def cancel(self, group: str, first_message: int = 0) -> int:
+        """
+        Drop queued jobs of a group; jobs already running finish normally
+
+        Args:
+            group: Group to cancel
+            first_message: Only drop jobs for messages at this index or later
+                (jobs without a message index are always dropped)
+
+        Returns:
+            Number of jobs removed
+        """
+        with self._condition:
+            keys = [
+                key for key, job in self._queue.items()
+                if job["group"] == group and (job["message"] is None or job["message"] >= first_message)
+            ]
+            for key in keys:
+                del self._queue[key]
+        return len(keys)
+
+    def claim(self, key: str, timeout: float = 30) -> None:
+        """
+        Prepare for synthesizing a clip in the foreground
+
+        A queued job for the key is removed (the caller synthesizes it now);
+        if the job is already running, this waits for it to finish so the
+        caller finds the clip in the cache.
+
+        Args:
+            key: Cache key of the clip
+            timeout: Maximum seconds to wait for a running job
+        """
+        with self._condition:
+            self._queue.pop(key, None)
+            event = self._in_flight.get(key)
+        if event:
+            event.wait(timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                key, job = self._queue.popitem(last=False)
+                event = self._in_flight[key] = threading.Event()
+
+            try:
+                cache = get_tts_cache()
+                if not cache.get_path(key):
+                    audio_bytes = synthesize_speech(job["text"], job["voice_id"], job["model_id"])
+                    cache.put(key, audio_bytes, voice_id=job["voice_id"], model_id=job["model_id"])
+            except Exception as e:
+                print(f"Error prefetching speech: {e}")
+            finally:
+                with self._condition:
+                    del self._in_flight[key]
+                event.set()
+
+
+_prefetcher: Optional[TTSPrefetcher] = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher() -> TTSPrefetcher:
+    """Get the process-wide prefetcher"""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = TTSPrefetcher()
+        return _prefetcher
+
+
+def _session_group(chat_id: Any) -> str:
+    """Prefetch group for the current session and chat"""
+    if "tts_prefetch_session" not in st.session_state:
+        st.session_state.tts_prefetch_session = uuid.uuid4().hex
+    return f"{st.session_state.tts_prefetch_session}:{chat_id}"
+
+
+def prefetch_reply(text: str, chat_id: Any, message: Optional[int] = None) -> bool:
+    """
+    Queue speech for a new assistant reply if prefetching is enabled
+
+    Args:
+        text: Reply text, exactly as passed to the play button
+        chat_id: Conversation the reply belongs to
+        message: Index of the reply in the chat's messages
+
+    Returns:
+        True if a job was queued
+    """
+    tts_settings = st.session_state.get('tts_settings', {})
+    if not ELEVENLABS_API_KEY or not tts_settings.get("prefetch") or not tts_settings.get("use_cache", True):
+        return False
+    if not isinstance(text, str) or not text.strip():
+        return False
+
+    # Local synthesis is fast enough to do on demand
+    from utils.tts_backends import select_backend
+    backend = select_backend(text, preferred=tts_settings.get("backend"))
+    if backend is None or backend.name != "elevenlabs":
+        return False
+
+    return get_prefetcher().submit(
+        text,
+        tts_settings.get("voice_id") or DEFAULT_VOICE_ID,
+        tts_settings.get("model_id") or DEFAULT_MODEL,
+        _session_group(chat_id),
+        message
+    )
+
+
+def cancel_prefetch(chat_id: Any, first_message: int = 0) -> int:
+    """
+    Cancel this session's queued speech for messages that were cleared or deleted
+
+    Args:
+        chat_id: Conversation the messages belonged to
+        first_message: Index of the first removed message (0 when the chat is cleared)
+
+    Returns:
+        Number of jobs removed
+    """
+    if _prefetcher is None:
+        return 0
+    return _prefetcher.cancel(_session_group(chat_id), first_message)
+
+
+def track_chat(chat_id: Any) -> None:
+    """
+    Cancel queued speech for the previous chat when the session switches chats
+
+    Call once per script run with the current chat ID.
+
+    Args:
+        chat_id: Conversation currently shown
+    """
+    group = _session_group(chat_id)
+    previous = st.session_state.get("tts_prefetch_group")
+    if previous and previous != group and _prefetcher is not None:
+        _prefetcher.cancel(previous)
+    st.session_state.tts_prefetch_group = group
+
+
+def claim_clip(text: str, voice_id: str, model_id: str) -> None:
+    """
+    Take over a pending prefetch before synthesizing a clip on demand
+
+    Args:
+        text: Text to synthesize
+        voice_id: ElevenLabs voice ID
+        model_id: ElevenLabs model ID
+    """
+    if _prefetcher is not None:
+        _prefetcher.claim(generate_audio_hash(text, voice_id, model_id))
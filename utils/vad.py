@@ -0,0 +1,137 @@
+"""
+Voice activity detection for always-on listening
+
+Audio is split into short frames whose energy is compared with a running
+estimate of the background noise floor. The floor follows the room: it drops
+quickly when the room gets quieter and rises slowly when it gets louder, so a
+fan or a noisy street does not count as speech. Only speech segments (with a
+little audio before the onset and after the last voiced frame) are passed on
+to recognition.
+"""
+from collections import deque
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Frame length (ms)
+VAD_FRAME_MS = 30
+
+# Speech must be this far above the noise floor (dB)
+VAD_MARGIN_DB = 12
+
+# Frames quieter than this never count as speech (dBFS)
+VAD_MIN_SPEECH_DB = -50
+
+# Consecutive voiced frames needed to start a segment (ms)
+VAD_ONSET_MS = 90
+
+# Silence that ends a segment (ms)
+VAD_HANGOVER_MS = 400
+
+# Audio kept from before the onset (ms)
+VAD_PREROLL_MS = 300
+
+# Noise floor adaptation rates per frame when the level falls and rises
+FLOOR_FALL_RATE = 0.3
+FLOOR_RISE_RATE = 0.02
+
+
+class VoiceActivityDetector:
+    """Gates a 16-bit mono PCM stream down to its speech segments"""
+
+    def __init__(self, sample_rate: int = 16000, max_segment_seconds: Optional[float] = None):
+        """
+        Create a detector
+
+        Args:
+            sample_rate: Sample rate of the PCM that will be fed in
+            max_segment_seconds: End segments that run longer than this
+        """
+        self.sample_rate = sample_rate
+        self.frame_bytes = sample_rate * VAD_FRAME_MS // 1000 * 2
+        self.onset_frames = max(1, VAD_ONSET_MS // VAD_FRAME_MS)
+        self.hangover_frames = max(1, VAD_HANGOVER_MS // VAD_FRAME_MS)
+        self.max_segment_frames = int(max_segment_seconds * 1000 // VAD_FRAME_MS) if max_segment_seconds else None
+        self._preroll = deque(maxlen=max(self.onset_frames, VAD_PREROLL_MS // VAD_FRAME_MS))
+        self.reset()
+
+    def reset(self):
+        """Forget the noise floor and any segment in progress"""
+        self.noise_floor: Optional[float] = None
+        self.in_speech = False
+        self._remainder = b""
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._segment_frames = 0
+        self._segment_min_db = 0.0
+        self._preroll.clear()
+
+    def _update_floor(self, level: float):
+        if self.noise_floor is None:
+            self.noise_floor = level
+        else:
+            rate = FLOOR_FALL_RATE if level < self.noise_floor else FLOOR_RISE_RATE
+            self.noise_floor += rate * (level - self.noise_floor)
+
+    def feed(self, pcm: bytes) -> Tuple[bytes, bool]:
+        """
+        Process captured audio
+
+        Args:
+            pcm: Little-endian 16-bit mono samples (any length)
+
+        Returns:
+            Tuple of (speech_audio, segment_ended): the audio to pass on to
+            recognition, and whether a speech segment ended in this chunk
+        """
+        data = self._remainder + pcm
+        frame_count = len(data) // self.frame_bytes
+        self._remainder = data[frame_count * self.frame_bytes:]
+        if frame_count == 0:
+            return b"", False
+
+        # Frame energies in dBFS, computed for the whole chunk at once
+        samples = np.frombuffer(data[:frame_count * self.frame_bytes], dtype=np.int16)
+        frames = samples.reshape(frame_count, -1).astype(np.float32) / 32768.0
+        levels = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+
+        speech = bytearray()
+        ended = False
+        for index, level in enumerate(levels):
+            frame = data[index * self.frame_bytes:(index + 1) * self.frame_bytes]
+            if self.noise_floor is None:
+                self._update_floor(level)
+            voiced = level > max(self.noise_floor + VAD_MARGIN_DB, VAD_MIN_SPEECH_DB)
+
+            if not self.in_speech:
+                self._preroll.append(frame)
+                self._voiced_run = self._voiced_run + 1 if voiced else 0
+                if self._voiced_run >= self.onset_frames:
+                    # Start a segment, including the audio leading up to it
+                    self.in_speech = True
+                    self._silent_run = 0
+                    self._segment_frames = len(self._preroll)
+                    self._segment_min_db = float(level)
+                    speech.extend(b"".join(self._preroll))
+                    self._preroll.clear()
+                else:
+                    self._update_floor(level)
+                continue
+
+            speech.extend(frame)
+            self._segment_frames += 1
+            self._segment_min_db = min(self._segment_min_db, float(level))
+            self._silent_run = 0 if voiced else self._silent_run + 1
+
+            too_long = self.max_segment_frames and self._segment_frames >= self.max_segment_frames
+            if self._silent_run >= self.hangover_frames or too_long:
+                if too_long and not self._silent_run:
+                    # Continuous "speech" this long is more likely louder background noise
+                    self.noise_floor = max(self.noise_floor, self._segment_min_db)
+                self.in_speech = False
+                self._voiced_run = 0
+                ended = True
+                # Leave the rest of the chunk for the next call so segments never merge
+                self._remainder = data[(index + 1) * self.frame_bytes:]
+                break
+        return bytes(speech), ended
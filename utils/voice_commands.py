@@ -3,15 +3,36 @@ Voice Command Integration for accessibility
 This module provides speech recognition and voice command processing
 """
 
+import io
 import os
 import time
+import queue
 import threading
 import json
 import pyaudio
-import wave
-import tempfile
 import speech_recognition as sr
-from typing import Dict, List, Callable, Optional, Tuple
+from typing import Dict, List, Callable, Optional, Union
+
+from utils.asr import ASR_SAMPLE_RATE, StreamingRecognizer, is_available as offline_asr_available
+from utils.audio_capture import get_capture_service
+from utils.command_matcher import DICTATE_WORD, CommandMatch, CommandMatcher
+from utils.vad import VoiceActivityDetector
+from utils.voice_events import VoiceCommandEvent
+
+# Frames per microphone buffer for streaming recognition (100 ms at 16 kHz)
+STREAM_CHUNK_FRAMES = 1600
+
+# Buffers held while the recognizer catches up before audio is dropped
+STREAM_QUEUE_CHUNKS = 50
+
+# Maximum seconds to wait for the listener thread when stopping
+STOP_TIMEOUT = 2.0
+
+# Longest speech segment sent to online recognition (seconds)
+PHRASE_TIME_LIMIT = 5
+
+# Longest speech segment decoded offline before the recognizer is flushed (seconds)
+OFFLINE_MAX_SEGMENT_SECONDS = 15
 
 # Command mapping: Maps spoken phrases to actions
 COMMAND_MAPPING = {
@@ -60,23 +81,60 @@ COMMAND_MAPPING = {
 class VoiceCommandProcessor:
     """
     Handles voice command recognition and processing
+    
+    A single microphone stream stays open while listening and passes through
+    a voice activity detector with an adaptive noise floor, so only speech
+    segments reach recognition. Segments are decoded offline with a streaming
+    Vosk recognizer when one is available (partial hypotheses arrive while the
+    user is still speaking), otherwise each finished segment is sent to
+    Google's recognizer.
+    
+    Transcripts go through a CommandMatcher. The offline recognizer is
+    constrained to the command phrases, and fixed commands fire from partial
+    hypotheses. Only "dictate ..." utterances are decoded again without the
+    grammar.
     """
-    def __init__(self, callback_registry: Dict[str, Callable] = None):
+    def __init__(
+        self,
+        callback_registry: Dict[str, Callable] = None,
+        command_listener: Optional[Callable[[VoiceCommandEvent], None]] = None
+    ):
+        """
+        Create a processor
+        
+        Args:
+            callback_registry: Action name -> callback, run on the listener thread
+            command_listener: Receives every recognized command as an event
+                (e.g. VoiceEventBus.publish), also on the listener thread
+        """
         self.recognizer = sr.Recognizer()
-        self.microphone = sr.Microphone()
+        self.command_listener = command_listener
+        self.streaming_recognizer = None
         self.is_listening = False
         self.listen_thread = None
         self.callback_registry = callback_registry or {}
-        self.adjust_for_ambient_noise()
+        self.partial_text = ""
+        self.matcher = CommandMatcher(COMMAND_MAPPING)
+        
+        # Audio of the utterance being decoded, and whether a partial already triggered its command
+        self._utterance = bytearray()
+        self._utterance_handled = False
+        self._dictation_recognizer = None
+        
+        if offline_asr_available():
+            try:
+                # Decode against the command vocabulary; dictation is re-decoded freely
+                self.streaming_recognizer = StreamingRecognizer(phrases=self.matcher.grammar())
+            except Exception as e:
+                print(f"Falling back to online speech recognition: {str(e)}")
+        
+        # Online recognition is billed per request, so keep its segments short
+        max_segment = OFFLINE_MAX_SEGMENT_SECONDS if self.streaming_recognizer else PHRASE_TIME_LIMIT
+        self.vad = VoiceActivityDetector(ASR_SAMPLE_RATE, max_segment_seconds=max_segment)
         
     def adjust_for_ambient_noise(self):
-        """Calibrate the recognizer for ambient noise levels"""
-        try:
-            with self.microphone as source:
-                self.recognizer.adjust_for_ambient_noise(source, duration=1)
-                print("Ambient noise calibration complete")
-        except Exception as e:
-            print(f"Could not calibrate for ambient noise: {str(e)}")
+        """Recalibrate for ambient noise (the noise floor is re-estimated from the next frames)"""
+        self.vad.reset()
     
     def register_callback(self, command_name: str, callback_function: Callable):
         """Register a callback function for a specific command"""
@@ -86,91 +144,208 @@ class VoiceCommandProcessor:
         """Start the voice command listener in a separate thread"""
         if self.is_listening:
             return
-            
+        
+        # A previous listener may still be closing its stream
+        self.join()
         self.is_listening = True
-        self.listen_thread = threading.Thread(target=self._listen_loop)
+        self.listen_thread = threading.Thread(target=self._listen_loop, name="voice-commands")
         self.listen_thread.daemon = True
         self.listen_thread.start()
         
-    def stop_listening(self):
-        """Stop the voice command listener"""
+    def stop_listening(self, timeout: float = STOP_TIMEOUT):
+        """
+        Stop the voice command listener and wait for its thread to exit
+        
+        Args:
+            timeout: Maximum seconds to wait
+        """
         self.is_listening = False
-        if self.listen_thread:
-            # The thread will exit on its own when is_listening becomes False
+        self.join(timeout)
+    
+    def join(self, timeout: float = STOP_TIMEOUT):
+        """Wait for a stopped listener thread to exit (no-op from the thread itself)"""
+        thread = self.listen_thread
+        if thread is None or thread is threading.current_thread():
+            return
+        thread.join(timeout)
+        if not thread.is_alive():
             self.listen_thread = None
     
     def _listen_loop(self):
         """Continuous listening loop that runs in a separate thread"""
         while self.is_listening:
             try:
-                self._process_audio()
+                self._stream_audio()
             except Exception as e:
                 print(f"Error in voice command listener: {str(e)}")
                 time.sleep(1)  # Prevent tight loop on error
     
-    def _process_audio(self):
-        """Listen for audio and process commands"""
+    def _stream_audio(self):
+        """Gate a continuous microphone stream to speech and decode it until listening stops"""
+        chunks = queue.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+        
+        def on_audio(in_data, frame_count, time_info, status):
+            try:
+                chunks.put_nowait(in_data)
+            except queue.Full:
+                # The recognizer fell behind; drop audio rather than lag further
+                pass
+            return (None, pyaudio.paContinue)
+        
+        stream = get_capture_service().open_stream(
+            on_audio,
+            sample_rate=ASR_SAMPLE_RATE,
+            frames_per_buffer=STREAM_CHUNK_FRAMES
+        )
         try:
-            with self.microphone as source:
-                audio = self.recognizer.listen(source, timeout=1, phrase_time_limit=5)
-                
-                # Attempt to recognize speech
+            while self.is_listening:
                 try:
-                    text = self.recognizer.recognize_google(audio).lower()
-                    print(f"Voice command detected: {text}")
-                    
-                    # Process the detected command
-                    self._process_command(text)
-                    
-                except sr.UnknownValueError:
-                    # Speech was unintelligible
-                    pass
-                except sr.RequestError as e:
-                    print(f"Could not request results from Google Speech Recognition service: {e}")
+                    data = chunks.get(timeout=0.5)
+                except queue.Empty:
+                    continue
                 
+                speech, segment_ended = self.vad.feed(data)
+                if speech:
+                    self._process_speech(speech)
+                if segment_ended:
+                    self._process_segment_end()
+        finally:
+            stream.stop_stream()
+            stream.close()
+            if self.streaming_recognizer is not None:
+                self.streaming_recognizer.reset()
+            self.vad.reset()
+            self._end_utterance()
+    
+    def _process_speech(self, pcm: bytes):
+        """Pass audio from a speech segment to the recognizer"""
+        self._utterance.extend(pcm)
+        if self.streaming_recognizer is None:
+            return
+        
+        final, partial = self.streaming_recognizer.accept(pcm)
+        if partial:
+            self._process_partial(partial)
+        if final:
+            self._process_final(final)
+    
+    def _process_segment_end(self):
+        """Recognize what is left of a speech segment once the speaker pauses"""
+        if self.streaming_recognizer is not None:
+            final = self.streaming_recognizer.finish()
+            if final:
+                self._process_final(final)
+            else:
+                self._end_utterance()
+            return
+        
+        try:
+            audio = sr.AudioData(bytes(self._utterance), ASR_SAMPLE_RATE, 2)
+            self._recognize_online(audio)
+        finally:
+            self._end_utterance()
+    
+    def _end_utterance(self):
+        """Forget the finished utterance"""
+        self.partial_text = ""
+        self._utterance = bytearray()
+        self._utterance_handled = False
+    
+    def _process_final(self, text: str):
+        """
+        Handle the transcript of a finished utterance from the streaming recognizer
+        
+        Args:
+            text: The constrained recognizer's transcript
+        """
+        try:
+            if self._utterance_handled:
+                return
+            
+            match = self.matcher.match(text)
+            if match and match.action == DICTATE_WORD:
+                # The command grammar cannot transcribe free speech; decode the utterance again
+                dictated = self._transcribe_dictation(bytes(self._utterance))
+                match = self.matcher.match(dictated) if dictated else None
+                text = dictated or text
+            
+            print(f"Voice command detected: {text}")
+            self._process_command(text.lower(), match)
+        finally:
+            self._end_utterance()
+    
+    def _transcribe_dictation(self, pcm: bytes) -> str:
+        """Transcribe an utterance without the command grammar"""
+        try:
+            if self._dictation_recognizer is None:
+                self._dictation_recognizer = StreamingRecognizer()
+            final, _ = self._dictation_recognizer.accept(pcm)
+            rest = self._dictation_recognizer.finish()
+            return " ".join(part for part in (final, rest) if part)
         except Exception as e:
-            print(f"Error capturing audio: {str(e)}")
+            print(f"Error transcribing dictation: {str(e)}")
+            return ""
+    
+    def _process_partial(self, text: str):
+        """
+        Handle a partial hypothesis of the utterance in progress
+        
+        Args:
+            text: The current hypothesis
+        """
+        self.partial_text = text
+        if "partial_transcript" in self.callback_registry:
+            self.callback_registry["partial_transcript"](text)
+        
+        # Fixed commands fire as soon as their phrase is heard in full
+        if not self._utterance_handled:
+            match = self.matcher.match(text, fuzzy=False)
+            if match and match.action != DICTATE_WORD:
+                print(f"Voice command detected: {text}")
+                self._utterance_handled = True
+                self._process_command(text, match)
+    
+    def _recognize_online(self, audio: sr.AudioData):
+        """Recognize a speech segment with Google and process commands"""
+        try:
+            text = self.recognizer.recognize_google(audio).lower()
+            print(f"Voice command detected: {text}")
+            
+            # Process the detected command
+            self._process_command(text)
+            
+        except sr.UnknownValueError:
+            # Speech was unintelligible
+            pass
+        except sr.RequestError as e:
+            print(f"Could not request results from Google Speech Recognition service: {e}")
     
-    def _process_command(self, text: str):
+    def _process_command(self, text: str, match: Optional[CommandMatch] = None):
         """
         Process the recognized text and execute the appropriate command
         
         Args:
             text: The recognized speech text
+            match: The command already matched in the text, if any
         """
-        # Check if the text directly matches any command phrase
-        command_action = None
+        match = match or self.matcher.match(text)
+        if match is None:
+            return
         
-        # Look for exact command matches
-        for phrase, action in COMMAND_MAPPING.items():
-            if phrase in text:
-                command_action = action
-                break
-                
-        # If a command was found, execute the associated callback
-        if command_action and command_action in self.callback_registry:
-            # Call the registered function for this command
-            callback = self.callback_registry[command_action]
-            callback()
+        if self.command_listener is not None:
+            self.command_listener(VoiceCommandEvent(match.action, match.argument, text, time.time()))
         
-        # If no command matches were found but there's text to send
-        elif "send message" in text or "submit message" in text:
-            # Extract the message content (if any)
-            parts = text.split("message", 1)
-            if len(parts) > 1 and parts[1].strip():
-                message = parts[1].strip()
-                if "send_message" in self.callback_registry:
-                    self.callback_registry["send_message"](message)
+        # For dictation mode, send the words after "dictate"
+        if match.action == DICTATE_WORD:
+            if match.argument and "send_message" in self.callback_registry:
+                self.callback_registry["send_message"](match.argument)
         
-        # For dictation mode
-        elif "dictate" in text and len(text) > 10:
-            # Strip "dictate" and any surrounding words to get the message
-            message = text.replace("dictate", "").strip()
-            if message and "send_message" in self.callback_registry:
-                self.callback_registry["send_message"](message)
+        # If a command was found, execute the associated callback
+        elif match.action in self.callback_registry:
+            self.callback_registry[match.action]()
 
 
-def record_voice_command(duration=3) -> Tuple[Optional[bytes], Optional[str]]:
+def record_voice_command(duration=3) -> Optional[bytes]:
     """
     Record a short audio clip for voice command processing
     
@@ -178,85 +353,36 @@ def record_voice_command(duration=3) -> Tuple[Optional[bytes], Optional[str]]:
         duration: Recording duration in seconds
         
     Returns:
-        Tuple of (audio_bytes, temp_file_path) or (None, None) on error
+        WAV audio bytes, or None on error
     """
-    # Audio parameters
-    chunk = 1024
-    sample_format = pyaudio.paInt16
-    channels = 1
-    sample_rate = 16000
-    
-    # Create a temporary file
-    temp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-    temp_file_path = temp_file.name
-    temp_file.close()
-    
-    p = None
-    
     try:
-        # Initialize PyAudio
-        p = pyaudio.PyAudio()
-        
-        # Open stream
-        stream = p.open(
-            format=sample_format,
-            channels=channels,
-            rate=sample_rate,
-            input=True,
-            frames_per_buffer=chunk
-        )
-        
-        # Record data
-        frames = []
-        for i in range(0, int(sample_rate / chunk * duration)):
-            data = stream.read(chunk)
-            frames.append(data)
-            
-        # Stop and close the stream
-        stream.stop_stream()
-        stream.close()
-        
-        # Save as WAV file
-        with wave.open(temp_file_path, 'wb') as wf:
-            wf.setnchannels(channels)
-            wf.setsampwidth(p.get_sample_size(sample_format))
-            wf.setframerate(sample_rate)
-            wf.writeframes(b''.join(frames))
-            
-        # Read the file back as bytes
-        with open(temp_file_path, 'rb') as f:
-            audio_bytes = f.read()
-            
-        return audio_bytes, temp_file_path
-        
+        return get_capture_service().record(duration, sample_rate=16000)
     except Exception as e:
         print(f"Error recording voice command: {str(e)}")
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
-        return None, None
-        
-    finally:
-        if p:
-            p.terminate()
+        return None
 
 
-def transcribe_voice_command(audio_file_path: str) -> str:
+def transcribe_voice_command(audio: Union[bytes, str]) -> str:
     """
-    Transcribe a voice command from an audio file
+    Transcribe a voice command
     
     Args:
-        audio_file_path: Path to the audio file to transcribe
+        audio: WAV bytes or a path to an audio file
         
     Returns:
         Transcribed text or empty string on error
     """
-    if not os.path.exists(audio_file_path):
-        return ""
+    if isinstance(audio, str):
+        if not os.path.exists(audio):
+            return ""
+        source_file = audio
+    else:
+        source_file = io.BytesIO(audio)
         
     recognizer = sr.Recognizer()
     
     try:
-        with sr.AudioFile(audio_file_path) as source:
+        with sr.AudioFile(source_file) as source:
             audio_data = recognizer.record(source)
             text = recognizer.recognize_google(audio_data)
             return text.lower()
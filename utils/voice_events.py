@@ -0,0 +1,228 @@
+"""
+Voice command event bus
+
+One VoiceCommandProcessor listens on the microphone for the whole process.
+It publishes each recognized command to the bus, and the bus copies it into a
+bounded queue per subscribed session (the oldest events are dropped first).
+Sessions drain their queue at the start of their own script run. That way
+session state is only changed from the session's thread, and every session
+sees each command. The listener starts with the first subscriber and is
+stopped and joined when the last one leaves. Sessions that stop draining
+(e.g. a closed browser tab) are expired.
+"""
+import time
+import uuid
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional
+
+import streamlit as st
+
+# Events kept per session before the oldest are dropped
+MAX_SESSION_EVENTS = 20
+
+# Sessions that have not drained their queue for this long are unsubscribed (seconds)
+SESSION_IDLE_TIMEOUT = 300
+
+# How often subscribed sessions check for new events (seconds)
+VOICE_POLL_INTERVAL = 1.0
+
+
+class VoiceCommandEvent(NamedTuple):
+    """A recognized voice command"""
+    action: str
+    argument: str
+    text: str
+    timestamp: float
+
+
+class VoiceEventBus:
+    """Fans out events from one shared listener to per-session queues"""
+
+    def __init__(self, processor_factory: Optional[Callable] = None):
+        """
+        Create a bus
+
+        Args:
+            processor_factory: Creates the listener given the publish callback
+                (defaults to VoiceCommandProcessor)
+        """
+        self._processor_factory = processor_factory
+        self._processor = None
+        self._lock = threading.Lock()
+        # Serializes stopping and restarting the listener
+        self._start_lock = threading.Lock()
+        # Set when the listener has been told to stop but its thread has not been joined
+        self._stopping = False
+        self._queues: Dict[str, Deque[VoiceCommandEvent]] = {}
+        self._last_seen: Dict[str, float] = {}
+        self.dropped = 0
+
+    def _create_processor(self):
+        if self._processor_factory is not None:
+            return self._processor_factory(self.publish)
+        from utils.voice_commands import VoiceCommandProcessor
+        return VoiceCommandProcessor(command_listener=self.publish)
+
+    @property
+    def is_listening(self) -> bool:
+        return self._processor is not None and self._processor.is_listening
+
+    def subscribe(self, session_id: str) -> None:
+        """
+        Start delivering events to a session, starting the listener if needed
+
+        Args:
+            session_id: Session to subscribe
+        """
+        with self._lock:
+            self._queues.setdefault(session_id, deque(maxlen=MAX_SESSION_EVENTS))
+            self._last_seen[session_id] = time.time()
+            if self._processor is None:
+                self._processor = self._create_processor()
+        self._settle()
+
+    def unsubscribe(self, session_id: str) -> None:
+        """
+        Stop delivering events to a session, stopping the listener after the last one
+
+        Args:
+            session_id: Session to unsubscribe
+        """
+        with self._lock:
+            self._queues.pop(session_id, None)
+            self._last_seen.pop(session_id, None)
+            if self._queues or self._processor is None:
+                return
+            self._signal_stop()
+        self._settle()
+
+    def _signal_stop(self):
+        """Tell the listener to stop (caller holds the lock)"""
+        self._stopping = True
+        self._processor.is_listening = False
+
+    def _settle(self):
+        """Wait for a stopping listener to exit, then start one if sessions are subscribed"""
+        with self._start_lock:
+            with self._lock:
+                processor = self._processor
+                if processor is None or (processor.is_listening and not self._stopping):
+                    return
+            # Joined outside the lock: the old listener thread may still be publishing
+            processor.join()
+            with self._lock:
+                if processor.listen_thread is not None:
+                    print("Voice commands: previous listener did not stop in time")
+                    return
+                self._stopping = False
+                if self._queues:
+                    processor.start_listening()
+
+    def is_subscribed(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._queues
+
+    def publish(self, event: VoiceCommandEvent) -> None:
+        """
+        Deliver an event to every subscribed session
+
+        Args:
+            event: The recognized command
+        """
+        now = time.time()
+        with self._lock:
+            for session_id in [sid for sid, seen in self._last_seen.items() if now - seen > SESSION_IDLE_TIMEOUT]:
+                print(f"Voice commands: expiring idle session {session_id}")
+                del self._queues[session_id]
+                del self._last_seen[session_id]
+            for events in self._queues.values():
+                if len(events) == events.maxlen:
+                    self.dropped += 1
+                events.append(event)
+            if not self._queues and self._processor is not None and not self._stopping:
+                # Called from the listener thread itself, so signal it without joining;
+                # the next subscriber joins it before starting a new one
+                self._signal_stop()
+
+    def pending(self, session_id: str) -> bool:
+        """Whether a session has undelivered events (also marks it active)"""
+        with self._lock:
+            if session_id in self._last_seen:
+                self._last_seen[session_id] = time.time()
+            return bool(self._queues.get(session_id))
+
+    def drain(self, session_id: str) -> List[VoiceCommandEvent]:
+        """
+        Take all queued events for a session
+
+        Args:
+            session_id: Session to drain
+
+        Returns:
+            Events in the order they were recognized
+        """
+        with self._lock:
+            events = self._queues.get(session_id)
+            if events is None:
+                return []
+            self._last_seen[session_id] = time.time()
+            drained = list(events)
+            events.clear()
+            return drained
+
+
+_bus: Optional[VoiceEventBus] = None
+_bus_lock = threading.Lock()
+
+
+def get_voice_event_bus() -> VoiceEventBus:
+    """Get the process-wide voice event bus"""
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            _bus = VoiceEventBus()
+        return _bus
+
+
+def _session_id() -> str:
+    """Bus subscription ID of the current session"""
+    if "voice_session_id" not in st.session_state:
+        st.session_state.voice_session_id = uuid.uuid4().hex
+    return st.session_state.voice_session_id
+
+
+def subscribe_voice_commands() -> None:
+    """Receive voice commands in the current session"""
+    get_voice_event_bus().subscribe(_session_id())
+
+
+def unsubscribe_voice_commands() -> None:
+    """Stop receiving voice commands in the current session"""
+    if _bus is not None:
+        _bus.unsubscribe(_session_id())
+
+
+def voice_commands_pending() -> bool:
+    """Whether voice commands are waiting for the current session"""
+    return _bus is not None and _bus.pending(_session_id())
+
+
+def drain_voice_commands() -> List[VoiceCommandEvent]:
+    """
+    Take the voice commands recognized for the current session
+
+    Re-subscribes a session whose subscription expired while voice commands
+    are still switched on in its UI.
+
+    Returns:
+        Events in the order they were recognized
+    """
+    if not st.session_state.get("voice_commands_active"):
+        return []
+    bus = get_voice_event_bus()
+    session_id = _session_id()
+    if not bus.is_subscribed(session_id):
+        bus.subscribe(session_id)
+        return []
+    return bus.drain(session_id)
@@ -6,11 +6,10 @@ which offers better quality and real-time processing compared to basic
 audio recording.
 """
 
-import base64
 import numpy as np
 import streamlit as st
 import av
-from typing import List, Optional, Dict, Any, Tuple
+from typing import Callable, List, Optional, Dict, Any, Tuple
 from datetime import datetime
 from streamlit_webrtc import (
     webrtc_streamer, 
@@ -23,35 +22,178 @@ import tempfile
 import os
 import time
 import uuid
+import threading
+
+from utils.audio_ingest import StreamingResampler, to_float32
 
 # Configure RTC for STUN servers
 RTC_CONFIGURATION = RTCConfiguration(
     {"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]}
 )
 
+# Sample rate speech models and recognizers expect
+SPEECH_SAMPLE_RATE = 16000
+
+# Called with each processed chunk (float32, shape (samples, channels)) and its sample rate
+FrameConsumer = Callable[[np.ndarray, int], None]
+
+
+class LiveTranscriber:
+    """
+    Frame consumer that transcribes a recording while it is being made
+    
+    Chunks are decoded by an offline streaming recognizer (see utils/asr.py)
+    on the WebRTC thread as they arrive, so the transcript is ready as soon as
+    recording stops. Best used with 16 kHz mono recordings.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._recognizer = None
+        self._failed = False
+        self._final: List[str] = []
+        self._partial = ""
+        self._finished = False
+    
+    def __call__(self, chunk: np.ndarray, sample_rate: int):
+        if chunk.ndim > 1 and chunk.shape[1] > 1:
+            chunk = chunk.mean(axis=1, keepdims=True)
+        pcm = (np.clip(chunk.reshape(-1), -1, 1) * 32767).astype("<i2").tobytes()
+        
+        with self._lock:
+            if self._failed or self._finished:
+                return
+            if self._recognizer is None:
+                try:
+                    from utils.asr import StreamingRecognizer
+                    self._recognizer = StreamingRecognizer(sample_rate)
+                except Exception as e:
+                    print(f"Live transcription unavailable: {str(e)}")
+                    self._failed = True
+                    return
+            final, partial = self._recognizer.accept(pcm)
+            if final:
+                self._final.append(final)
+                self._partial = ""
+            elif partial:
+                self._partial = partial
+    
+    @property
+    def text(self) -> str:
+        """Transcript so far, including the utterance in progress"""
+        with self._lock:
+            return " ".join(self._final + ([self._partial] if self._partial else []))
+    
+    def finish(self) -> Optional[str]:
+        """Flush the recognizer and return the full transcript, or None if nothing was recognized"""
+        with self._lock:
+            if not self._finished and self._recognizer is not None:
+                final = self._recognizer.finish()
+                if final:
+                    self._final.append(final)
+                self._partial = ""
+            self._finished = True
+            return " ".join(self._final) or None
+
+
+def chain_consumers(*consumers: Optional[FrameConsumer]) -> Optional[FrameConsumer]:
+    """Combine frame consumers into one that calls each in turn"""
+    consumers = [consumer for consumer in consumers if consumer is not None]
+    if len(consumers) <= 1:
+        return consumers[0] if consumers else None
+    
+    def consume(chunk: np.ndarray, sample_rate: int):
+        for consumer in consumers:
+            consumer(chunk, sample_rate)
+    return consume
+
+
 class AudioProcessor(AudioProcessorBase):
-    """Audio processor for WebRTC streaming that saves audio frames to a buffer"""
+    """
+    Audio processor for WebRTC streaming that writes frames to disk as they arrive
     
-    def __init__(self, max_duration: int = 60):
+    A WAV file is opened on the first frame (once the stream's sample rate
+    and channel count are known) and every frame is appended to it, so memory
+    use does not grow with the recording length and the file is complete as
+    soon as recording stops. Frames can optionally be downmixed to mono and
+    resampled (e.g. to 16 kHz for speech models), and each processed chunk can
+    be forwarded to a consumer such as a streaming recognizer while the user
+    is still talking.
+    """
+    
+    def __init__(
+        self,
+        max_duration: int = 60,
+        target_rate: Optional[int] = None,
+        mono: bool = False,
+        frame_consumer: Optional[FrameConsumer] = None
+    ):
         """
         Initialize the audio processor with the specified maximum duration
         
         Args:
             max_duration: Maximum recording duration in seconds
+            target_rate: Sample rate to resample to, or None to keep the stream's rate
+            mono: Whether to downmix to a single channel
+            frame_consumer: Optional callback receiving each processed chunk and its sample rate
         """
-        self.audio_buffer = []
-        self.sample_rate = 48000  # WebRTC typically uses 48kHz
-        self.channels = 1  # Mono audio
+        self.max_duration = max_duration
+        self.target_rate = target_rate
+        self.mono = mono
+        self.frame_consumer = frame_consumer
+        self.sample_rate = 48000  # WebRTC typically uses 48kHz; updated from the first frame
+        self.channels = 1  # Updated from the first frame
         self.max_frames = max_duration * self.sample_rate
+        self.samples_recorded = 0
         self.start_time = None
         self.recording_complete = False
         self.stopped = False
         self.output_file = None
+        self._writer = None
+        self._resampler: Optional[StreamingResampler] = None
+        self._lock = threading.Lock()
         
         # Create a temporary file to store the audio
         fd, self.output_path = tempfile.mkstemp(suffix=".wav")
         os.close(fd)
+    
+    def _frame_samples(self, frame: av.AudioFrame) -> np.ndarray:
+        """Get a frame's samples as a (samples, channels) array"""
+        data = frame.to_ndarray()
+        if frame.format.is_planar:
+            # Planar formats are (channels, samples)
+            return data.T
+        # Packed formats interleave channels in a single row
+        return data.reshape(-1, self.channels)
+    
+    def _open(self, frame: av.AudioFrame):
+        """Open the output file at the processed format (caller holds the lock)"""
+        import soundfile as sf
         
+        self.sample_rate = frame.sample_rate or self.sample_rate
+        self.max_frames = self.max_duration * self.sample_rate
+        output_rate = self.target_rate or self.sample_rate
+        if output_rate != self.sample_rate:
+            self._resampler = StreamingResampler(self.sample_rate, output_rate)
+        
+        self._writer = sf.SoundFile(
+            self.output_path,
+            mode='w',
+            samplerate=output_rate,
+            channels=1 if self.mono else self.channels,
+            format='WAV',
+            subtype='PCM_16'
+        )
+    
+    def _process(self, samples: np.ndarray) -> np.ndarray:
+        """Downmix and resample a chunk as configured"""
+        samples = to_float32(samples)
+        if self.mono and samples.shape[1] > 1:
+            samples = samples.mean(axis=1, keepdims=True)
+        if self._resampler is not None:
+            samples = self._resampler.process(samples)
+        return samples
+    
     def recv(self, frame: av.AudioFrame) -> av.AudioFrame:
         """
         Process each incoming audio frame
@@ -67,57 +209,66 @@ class AudioProcessor(AudioProcessorBase):
             
         if self.start_time is None:
             self.start_time = time.time()
-            
-        # Convert frame to numpy array
-        sound_array = frame.to_ndarray()
+            self.channels = len(frame.layout.channels) or 1
         
-        # Append to buffer
-        self.audio_buffer.append(sound_array)
+        samples = self._frame_samples(frame)
         
-        # Check if we've reached the maximum duration
-        total_samples = sum(len(chunk) for chunk in self.audio_buffer)
-        if total_samples >= self.max_frames:
-            self.recording_complete = True
-            self._save_audio()
+        with self._lock:
+            if self.stopped or self.recording_complete:
+                return frame
+            try:
+                if self._writer is None:
+                    self._open(frame)
+                
+                count = min(len(samples), self.max_frames - self.samples_recorded)
+                chunk = self._process(samples[:count])
+                self._writer.write(chunk)
+                self.samples_recorded += count
+            except Exception as e:
+                print(f"Error writing audio: {str(e)}")
+                self.recording_complete = True
+                self._close()
+                return frame
+            
+            # Check if we've reached the maximum duration
+            if self.samples_recorded >= self.max_frames:
+                self.recording_complete = True
+                self._close()
+        
+        if self.frame_consumer is not None and len(chunk):
+            try:
+                self.frame_consumer(chunk, self._writer.samplerate)
+            except Exception as e:
+                print(f"Error in audio frame consumer: {str(e)}")
             
         return frame
     
     def stop(self):
-        """Stop recording and save the audio file"""
-        self.stopped = True
-        self._save_audio()
+        """Stop recording and finalize the audio file"""
+        with self._lock:
+            self.stopped = True
+            if not self.recording_complete:
+                self._close()
     
-    def _save_audio(self):
-        """Save the recorded audio to a WAV file"""
-        if not self.audio_buffer:
+    def _close(self):
+        """Close the output file so its header is complete (caller holds the lock)"""
+        if self._writer is None:
             return
             
         try:
-            import soundfile as sf
-            
-            # Concatenate all audio chunks
-            audio_data = np.concatenate(self.audio_buffer, axis=0)
-            
-            # Save as WAV file
-            sf.write(
-                self.output_path, 
-                audio_data, 
-                self.sample_rate, 
-                format='WAV'
-            )
+            self._writer.close()
             
             # Set the output file flag
-            self.output_file = self.output_path
+            if self.samples_recorded:
+                self.output_file = self.output_path
             
         except Exception as e:
-            st.error(f"Error saving audio: {str(e)}")
+            print(f"Error saving audio: {str(e)}")
     
     @property
     def recording_duration(self) -> float:
         """Get the current recording duration in seconds"""
-        if self.start_time is None:
-            return 0
-        return time.time() - self.start_time
+        return self.samples_recorded / self.sample_rate
         
 
 def audio_recorder_ui(
@@ -126,7 +277,11 @@ def audio_recorder_ui(
     description: str = "Record audio for transcription or analysis",
     durations: List[int] = [30, 60, 120, 300],
     show_description: bool = True,
-    show_playback: bool = True
+    show_playback: bool = True,
+    target_rate: Optional[int] = None,
+    mono: bool = False,
+    frame_consumer: Optional[FrameConsumer] = None,
+    live_transcript: bool = False
 ) -> Optional[str]:
     """
     Display a WebRTC-based audio recorder widget
@@ -138,18 +293,36 @@ def audio_recorder_ui(
         durations: List of recording duration options in seconds
         show_description: Whether to show the description
         show_playback: Whether to show audio playback after recording
+        target_rate: Sample rate to store the recording at (None keeps the stream's rate)
+        mono: Whether to downmix the recording to mono
+        frame_consumer: Optional callback receiving audio chunks live while recording
+        live_transcript: Whether to transcribe while recording; the transcript
+            is shown live and kept in st.session_state[f"{key}_transcript"]
     
     Returns:
-        Base64-encoded audio data if recording is complete, None otherwise
+        Path to the recorded WAV file if recording is complete, None otherwise
     """
-    # Session state for audio data
-    if f"{key}_data" not in st.session_state:
-        st.session_state[f"{key}_data"] = None
+    def new_processor() -> AudioProcessor:
+        transcriber = LiveTranscriber() if live_transcript else None
+        st.session_state[f"{key}_transcriber"] = transcriber
+        st.session_state[f"{key}_transcript"] = None
+        return AudioProcessor(
+            max_duration=selected_duration,
+            target_rate=target_rate,
+            mono=mono,
+            frame_consumer=chain_consumers(frame_consumer, transcriber)
+        )
+    
+    # Session state for the recording (a file path, not the audio itself)
     if f"{key}_file_path" not in st.session_state:
         st.session_state[f"{key}_file_path"] = None
     if f"{key}_duration" not in st.session_state:
         st.session_state[f"{key}_duration"] = durations[0]
     
+    # The app moves recordings it has sent, so forget files that are gone
+    if st.session_state[f"{key}_file_path"] and not os.path.exists(st.session_state[f"{key}_file_path"]):
+        st.session_state[f"{key}_file_path"] = None
+    
     # Display title and description
     st.subheader(title)
     if show_description:
@@ -174,9 +347,7 @@ def audio_recorder_ui(
     with col1:
         # Audio processor state
         if f"{key}_processor" not in st.session_state:
-            st.session_state[f"{key}_processor"] = AudioProcessor(
-                max_duration=selected_duration
-            )
+            st.session_state[f"{key}_processor"] = new_processor()
         
         # Create the WebRTC streamer
         webrtc_ctx = webrtc_streamer(
@@ -195,6 +366,10 @@ def audio_recorder_ui(
             
             progress = min(1.0, elapsed / selected_duration)
             st.progress(progress)
+            
+            transcriber = st.session_state.get(f"{key}_transcriber")
+            if transcriber is not None and transcriber.text:
+                st.caption(f"Live transcript: {transcriber.text}")
         
         # When stopped, save the recording
         elif webrtc_ctx.state.playing == False and hasattr(st.session_state, f"{key}_processor"):
@@ -209,10 +384,9 @@ def audio_recorder_ui(
                 # Save file path to session state
                 st.session_state[f"{key}_file_path"] = processor.output_file
                 
-                # Read the audio file and encode as base64
-                with open(processor.output_file, "rb") as f:
-                    audio_bytes = f.read()
-                    st.session_state[f"{key}_data"] = base64.b64encode(audio_bytes).decode("utf-8")
+                transcriber = st.session_state.get(f"{key}_transcriber")
+                if transcriber is not None:
+                    st.session_state[f"{key}_transcript"] = transcriber.finish()
                 
                 st.success("Recording saved!")
     
@@ -221,13 +395,10 @@ def audio_recorder_ui(
         # Reset button
         if st.button("Reset Recording", key=f"{key}_reset"):
             # Clear session state
-            st.session_state[f"{key}_data"] = None
             st.session_state[f"{key}_file_path"] = None
             
             # Create new processor
-            st.session_state[f"{key}_processor"] = AudioProcessor(
-                max_duration=selected_duration
-            )
+            st.session_state[f"{key}_processor"] = new_processor()
             
             st.experimental_rerun()
     
@@ -235,5 +406,5 @@ def audio_recorder_ui(
     if show_playback and st.session_state[f"{key}_file_path"]:
         st.audio(st.session_state[f"{key}_file_path"])
         
-    # Return base64-encoded audio data
-    return st.session_state[f"{key}_data"]
\ No newline at end of file
+    # Return the path of the recording
+    return st.session_state[f"{key}_file_path"]
\ No newline at end of file